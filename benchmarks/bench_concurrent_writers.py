@@ -0,0 +1,110 @@
+"""
+    Benchmark of application instances writing runs into the same data folder at the same time: every process
+    runs constant voltage tests on its own simulated potentiostat, the runs are saved to run files and the shared
+    run store. Runs of all processes have the same compound and start time, so run file names collide on purpose.
+    Reports the aggregate samples per second for every number of processes and checks that every run file
+    and every run in the store is complete.
+
+    Usage: python benchmarks/bench_concurrent_writers.py [--processes 1 2 4 8] [--runs 3] [--duration 20000]
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import zntest.recipe as recipe  # noqa: E402
+import zntest.runfile as runfile  # noqa: E402
+import zntest.store as store  # noqa: E402
+import zntest.utils as utils  # noqa: E402
+from zntest.simulator import SimulatedPotentiostat  # noqa: E402
+
+
+def create_context(duration, sample_rate, port):
+    return recipe.create_test_context(recipe.CONSTANT_VOLTAGE_TEST_KIND, 'Benchmark', '100uA', sample_rate,
+                                      {'quietValue': 0.0, 'quietTime': 1000, 'value': -1.4, 'duration': duration},
+                                      'BENCH', True, False, port)
+
+
+def write_runs(folder, process_index, runs_count, duration, sample_rate, start_time, barrier):
+    os.chdir(folder)
+    port = f'sim://{process_index + 1}'
+    pstat = SimulatedPotentiostat(port, speed=0.0, seed=process_index)
+    pstat.set_curr_range('100uA')
+    pstat.set_sample_rate(sample_rate)
+    context = create_context(duration, sample_rate, port)
+    barrier.wait()
+    samples_count = 0
+    for _ in range(runs_count):
+        writer = utils.OutputDataWriter(recipe.CONSTANT_VOLTAGE_TEST_KIND, context, start_time)
+        for t, volt, curr in utils.iter_test_samples(pstat, 'constant', context['param']):
+            writer.write(t, volt, curr)
+        writer.close()
+        samples_count += writer.samples_count
+    return samples_count
+
+
+def check_integrity(folder, runs_count, samples_count):
+    run_file_folder = os.path.join(folder, 'data', 'out', recipe.CONSTANT_VOLTAGE_TEST_KIND)
+    file_names = os.listdir(run_file_folder)
+    run_file_names = [file_name for file_name in file_names if file_name.endswith(runfile.RUN_FILE_EXTENSION)]
+    errors = []
+    if len(run_file_names) != runs_count or len(file_names) != runs_count:
+        errors.append(f'{len(run_file_names)} run files of {runs_count} runs, files {sorted(file_names)}')
+    run_files_samples_count = sum(len(runfile.open_run(os.path.join(run_file_folder, file_name)))
+                                  for file_name in run_file_names)
+    if run_files_samples_count != samples_count:
+        errors.append(f'{run_files_samples_count} samples in run files of {samples_count}')
+
+    run_store = store.RunStore(os.path.join(folder, 'data', 'out', 'runs.sqlite3'))
+    runs = run_store.find_runs()
+    if len(runs) != runs_count or any(run.status != store.RUN_STATUS_COMPLETE for run in runs):
+        errors.append(f'{len(runs)} runs in the store of {runs_count}, statuses {[run.status for run in runs]}')
+    store_samples_count = sum(len(run_store.load_samples(run.id)[0]) for run in runs)
+    if store_samples_count != samples_count:
+        errors.append(f'{store_samples_count} samples in the store of {samples_count}')
+    run_store.close()
+    return errors
+
+
+def measure(processes_count, runs_count, duration, sample_rate):
+    # all runs start in the same second, so they compete for the same run file names
+    start_time = datetime.now()
+    with tempfile.TemporaryDirectory() as folder:
+        context = multiprocessing.get_context('spawn')
+        with context.Manager() as manager, context.Pool(processes_count) as pool:
+            barrier = manager.Barrier(processes_count + 1)
+            results = [pool.apply_async(write_runs, (folder, process_index, runs_count, duration, sample_rate,
+                                                     start_time, barrier))
+                       for process_index in range(processes_count)]
+            barrier.wait()
+            started_at = time.perf_counter()
+            samples_count = sum(result.get() for result in results)
+            duration_sec = time.perf_counter() - started_at
+        errors = check_integrity(folder, processes_count * runs_count, samples_count)
+    return samples_count, duration_sec, errors
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--processes', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--runs', type=int, default=3, help='runs per process')
+    parser.add_argument('--duration', type=int, default=20000, help='constant voltage test duration, ms')
+    parser.add_argument('--sample-rate', type=int, default=200)
+    args = parser.parse_args()
+
+    is_failed = False
+    for processes_count in args.processes:
+        samples_count, duration_sec, errors = measure(processes_count, args.runs, args.duration, args.sample_rate)
+        print(f'{processes_count:>3} processes: {samples_count} samples in {duration_sec:.2f} s, '
+              f'{samples_count / duration_sec:,.0f} samples/s, {"OK" if not errors else "; ".join(errors)}')
+        is_failed = is_failed or bool(errors)
+    sys.exit(1 if is_failed else 0)
+
+
+if __name__ == '__main__':
+    main()
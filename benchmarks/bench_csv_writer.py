@@ -0,0 +1,71 @@
+"""
+    Benchmark comparing the per-row csv.writer loop used before with the vectorized output data formatting
+    from zntest.utils. Both writers render into an in-memory buffer, so disk speed does not affect the numbers.
+
+    Usage: python benchmarks/bench_csv_writer.py [samples ...]
+"""
+import csv
+import io
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import zntest.utils as utils  # noqa: E402
+
+DEFAULT_SAMPLES_COUNTS = (10 ** 4, 10 ** 5, 10 ** 6)
+COMPOUND = 'ABC'
+
+
+def legacy_write(t, volt, curr, compound):
+    output_csv = io.StringIO()
+    writer = csv.writer(output_csv, delimiter=',')
+    writer.writerow(['time', 'volt', 'current', 'compound'])
+    for i in range(len(t)):
+        single_time_value = f'{t[i]:.4f}'
+        single_potential_value = f'{volt[i]:.4f}'
+        single_current_value = f'{curr[i]:.4f}'
+        row = [single_time_value, single_potential_value, single_current_value, compound]
+        writer.writerow(row)
+    return output_csv.getvalue()
+
+
+def vectorized_write(t, volt, curr, compound):
+    output_csv = io.StringIO()
+    output_csv.write(utils.format_csv_row(utils.OUTPUT_DATA_HEADER) + utils.format_output_data(t, volt, curr,
+                                                                                                compound))
+    return output_csv.getvalue()
+
+
+def measure(write_fun, t, volt, curr, repeats=3):
+    best = float('inf')
+    result = None
+    for _ in range(repeats):
+        started = time.perf_counter()
+        result = write_fun(t, volt, curr, COMPOUND)
+        best = min(best, time.perf_counter() - started)
+    return best, result
+
+
+def main():
+    samples_counts = [int(arg) for arg in sys.argv[1:]] or DEFAULT_SAMPLES_COUNTS
+    print(f'{"samples":>10} {"legacy rows/s":>15} {"vectorized rows/s":>18} {"speedup":>8}')
+    for samples_count in samples_counts:
+        # the driver returns lists of floats, so the benchmark feeds both writers the same way
+        t = (np.arange(samples_count) / 200.0).tolist()
+        volt = np.random.uniform(-1.0, 1.0, samples_count).tolist()
+        curr = np.random.uniform(-100.0, 100.0, samples_count).tolist()
+
+        legacy_time, legacy_output = measure(legacy_write, t, volt, curr)
+        vectorized_time, vectorized_output = measure(vectorized_write, t, volt, curr)
+        assert legacy_output == vectorized_output, 'writers produced different output'
+
+        print(f'{samples_count:>10} {samples_count / legacy_time:>15,.0f} {samples_count / vectorized_time:>18,.0f} '
+              f'{legacy_time / vectorized_time:>7.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""
+    Benchmark of the stored runs viewer overlay: time to redraw many overlaid runs at full resolution
+    and from their min/max pyramids, for the whole runs and for a zoomed in window.
+    Figures are rendered with the Agg backend, so no display is needed.
+
+    Usage: python benchmarks/bench_overlay.py [--runs 500] [--samples 20000]
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from zntest.plotting import MinMaxPyramid  # noqa: E402
+
+ZOOM_WINDOW = (-1.05, -0.95)
+
+
+def create_runs(runs_count, samples_count):
+    volt = np.linspace(-1.4, -0.6, samples_count)
+    runs = []
+    for run_index in range(runs_count):
+        peak = (1.0 + 0.01 * run_index) * np.exp(-((volt + 1.0) / 0.04) ** 2)
+        runs.append((volt, peak + np.random.normal(0.0, 0.02, samples_count)))
+    return runs
+
+
+def create_figure(runs_count):
+    figure = Figure(figsize=(6.0, 5.0), dpi=100)
+    canvas = FigureCanvasAgg(figure)
+    axes = figure.add_subplot(1, 1, 1)
+    lines = [axes.plot([], [], linewidth=0.8)[0] for _ in range(runs_count)]
+    axes.set_ylim(-0.2, 6.5)
+    return canvas, axes, lines
+
+
+def measure_redraw(canvas, axes, lines, x_window, get_points_fun):
+    started_at = time.perf_counter()
+    axes.set_xlim(*x_window)
+    for line_index, line in enumerate(lines):
+        line.set_data(*get_points_fun(line_index))
+    canvas.draw()
+    return time.perf_counter() - started_at
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=500)
+    parser.add_argument('--samples', type=int, default=20000)
+    args = parser.parse_args()
+
+    runs = create_runs(args.runs, args.samples)
+    started_at = time.perf_counter()
+    pyramids = [MinMaxPyramid(volt, curr) for volt, curr in runs]
+    print(f'{args.runs} runs of {args.samples} samples, pyramids are built in {time.perf_counter() - started_at:.2f} s')
+
+    canvas, axes, lines = create_figure(args.runs)
+    pixels_count = int(axes.bbox.width)
+
+    def get_pyramid_points(run_index, x_window):
+        pyramid = pyramids[run_index]
+        start, end = pyramid.get_index_range(*x_window)
+        if end - start <= 2 * pixels_count:
+            volt, curr = runs[run_index]
+            return volt[start:end], curr[start:end]
+        return pyramid.get_points(start, end, 2 * pixels_count)
+
+    for name, x_window in (('whole runs', (-1.4, -0.6)), ('zoomed in', ZOOM_WINDOW)):
+        full_time = measure_redraw(canvas, axes, lines, x_window, lambda run_index: runs[run_index])
+        pyramid_time = measure_redraw(canvas, axes, lines, x_window,
+                                      lambda run_index: get_pyramid_points(run_index, x_window))
+        print(f'{name:>10}: full resolution {full_time:.3f} s, pyramids {pyramid_time:.3f} s')
+
+
+if __name__ == '__main__':
+    main()
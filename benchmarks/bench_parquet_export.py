@@ -0,0 +1,87 @@
+"""
+    Benchmark of the Parquet export (zntest.parquet). Runs of zntest.simulator.SimulatedPotentiostat of several
+    compounds started over several months are saved to a run store in a temporary folder and exported,
+    then a few new runs are exported incrementally. Reports the export times and the time of the query
+    "square wave runs of one compound in the last month" against reading the whole samples dataset.
+    Requires pyarrow, see requirements-parquet.txt.
+
+    Usage: python benchmarks/bench_parquet_export.py [--runs 2000] [--compounds 10] [--days 120]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import zntest.parquet as parquet  # noqa: E402
+import zntest.recipe as recipe  # noqa: E402
+from zntest.simulator import SimulatedPotentiostat  # noqa: E402
+from zntest.store import RunStore  # noqa: E402
+
+TEST_PARAM = {
+    recipe.CONSTANT_VOLTAGE_TEST_KIND: {'quietValue': 0.0, 'quietTime': 1000, 'value': -1.4, 'duration': 20000},
+    recipe.SQUARE_WAVE_VOLTAMMETRY_TEST_KIND: {'quietValue': 0.0, 'quietTime': 1000, 'amplitude': 0.025,
+                                               'startValue': -1.4, 'finalValue': -0.6, 'stepValue': 0.005,
+                                               'window': 0.2},
+}
+TEST_NAMES = {recipe.CONSTANT_VOLTAGE_TEST_KIND: 'constant', recipe.SQUARE_WAVE_VOLTAMMETRY_TEST_KIND: 'squareWave'}
+
+
+def add_runs(run_store, first_index, runs_count, compounds_count, days, last_day):
+    for run_index in range(first_index, first_index + runs_count):
+        # every sample of a compound is a constant voltage test followed by a square wave voltammetry
+        kind = recipe.SEQUENCE_STEPS[run_index % 2 * 2][1]
+        compound = f'Compound {run_index // 2 % compounds_count}'
+        pstat = SimulatedPotentiostat(f'sim://{run_index % 8 + 1}', speed=0.0, seed=run_index)
+        pstat.set_sample_rate(100)
+        pstat.set_param(TEST_NAMES[kind], TEST_PARAM[kind])
+        t, volt, curr = pstat.create_samples(TEST_NAMES[kind])
+        context = recipe.create_test_context(kind, 'Benchmark', '100uA', 100, TEST_PARAM[kind], compound, True)
+        started_at = last_day - timedelta(days=days - 1 - run_index * days // (first_index + runs_count))
+        run_store.add_run(kind, context, started_at, t / 1.0e3, volt, curr)
+
+
+def measure(fun):
+    started_at = time.perf_counter()
+    result = fun()
+    return result, time.perf_counter() - started_at
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=2000)
+    parser.add_argument('--compounds', type=int, default=10)
+    parser.add_argument('--days', type=int, default=120, help='the runs are spread over this many days')
+    parser.add_argument('--new-runs', type=int, default=20, help='runs exported incrementally')
+    args = parser.parse_args()
+
+    last_day = datetime.now().replace(hour=12, minute=0, second=0, microsecond=0)
+    with tempfile.TemporaryDirectory() as folder:
+        run_store = RunStore(os.path.join(folder, 'runs.sqlite3'))
+        add_runs(run_store, 0, args.runs, args.compounds, args.days, last_day)
+        exporter = parquet.ParquetExporter(os.path.join(folder, 'export'))
+        (runs_count, files_count), duration_sec = measure(lambda: exporter.export(run_store))
+        print(f'export: {runs_count} runs to {files_count} files in {duration_sec:.2f} s')
+
+        add_runs(run_store, args.runs, args.new_runs, args.compounds, 1, last_day)
+        (runs_count, files_count), duration_sec = measure(lambda: exporter.export(run_store))
+        print(f'incremental export: {runs_count} runs to {files_count} files in {duration_sec:.2f} s')
+
+        query = {'compound': 'Compound 1', 'kind': recipe.SQUARE_WAVE_VOLTAMMETRY_TEST_KIND,
+                 'started_from': last_day - timedelta(days=30)}
+        # the first query imports pyarrow.dataset
+        parquet.read_runs(exporter.folder, compound='')
+        runs, duration_sec = measure(lambda: parquet.read_runs(exporter.folder, **query))
+        print(f'query runs: {runs.num_rows} runs in {duration_sec * 1e3:.1f} ms')
+        samples, duration_sec = measure(lambda: parquet.read_samples(exporter.folder, **query))
+        print(f'query samples: {samples.num_rows} samples in {duration_sec * 1e3:.1f} ms')
+        samples, duration_sec = measure(lambda: parquet.read_samples(exporter.folder))
+        print(f'whole samples dataset: {samples.num_rows} samples in {duration_sec * 1e3:.1f} ms')
+        run_store.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""
+    End-to-end benchmark of the acquisition pipeline driven by the simulated potentiostat from zntest.simulator:
+    samples per second through acquisition only, acquisition and storage (run file and run store), and the whole
+    pipeline with the acquisition worker and the live plot updated from its events as the GUI does.
+    The simulator runs faster than real time (as fast as possible by default), the live plot is rendered with
+    the Agg backend, so neither a device nor a display is needed. Output files are written to a temporary folder.
+
+    Usage: python benchmarks/bench_pipeline.py [--runs 3] [--duration 100000] [--sample-rate 200] [--speed 0]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import zntest.recipe as recipe  # noqa: E402
+import zntest.utils as utils  # noqa: E402
+from zntest.plotting import LivePlot  # noqa: E402
+from zntest.simulator import SimulatedPotentiostat  # noqa: E402
+from zntest.worker import (AcquisitionWorker, SEQUENCE_FAILED, SEQUENCE_FINISHED, STEP_SAMPLES,  # noqa: E402
+                           STEP_STARTED)
+
+POLL_INTERVAL_SEC = 0.01
+
+
+def create_context(duration, sample_rate, create_plot=False):
+    return recipe.create_test_context(recipe.CONSTANT_VOLTAGE_TEST_KIND, 'Benchmark', '100uA', sample_rate,
+                                      {'quietValue': 0.0, 'quietTime': 1000, 'value': -1.4, 'duration': duration},
+                                      'BENCH', True, create_plot, 'sim://bench')
+
+
+def measure_acquisition(pstat, context):
+    pstat.set_curr_range(context['current_range'])
+    pstat.set_sample_rate(context['sample_rate'])
+    samples_count = 0
+    for t, _, _ in utils.iter_test_samples(pstat, 'constant', context['param']):
+        samples_count += len(t)
+    return samples_count
+
+
+def measure_storage(pstat, context):
+    return utils.run_constant_voltage_test(pstat, context).samples_count
+
+
+def measure_pipeline(pstat, context, live_plot):
+    import zntest.waveforms as waveforms
+
+    worker = AcquisitionWorker(pstat, pstat.port)
+    worker.start([(utils.run_constant_voltage_test, context)])
+    samples_count = 0
+    while True:
+        # the GUI polls worker events with its timer, here they are polled in a loop
+        for event in worker.get_events():
+            if event.kind == STEP_STARTED:
+                live_plot.start_run(event.context['title'], waveforms.get_plot_bounds(event.context))
+            elif event.kind == STEP_SAMPLES:
+                live_plot.add_samples(*event.payload.get_columns())
+                samples_count += len(event.payload)
+            elif event.kind == SEQUENCE_FAILED:
+                raise event.payload
+            elif event.kind == SEQUENCE_FINISHED:
+                return samples_count
+        time.sleep(POLL_INTERVAL_SEC)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--duration', type=int, default=100000, help='constant voltage test duration, ms')
+    parser.add_argument('--sample-rate', type=int, default=200)
+    parser.add_argument('--speed', type=float, default=0.0, help='times faster than real time, 0 is unlimited')
+    args = parser.parse_args()
+
+    pstat = SimulatedPotentiostat('sim://bench', speed=args.speed, seed=0)
+    with tempfile.TemporaryDirectory() as folder:
+        # output files and the run store go to the temporary folder
+        os.chdir(folder)
+        live_plot = LivePlot(None)
+        stages = (
+            ('acquisition', lambda context: measure_acquisition(pstat, context)),
+            ('acquisition + storage', lambda context: measure_storage(pstat, context)),
+            ('acquisition + storage + plotting', lambda context: measure_pipeline(pstat, context, live_plot)),
+        )
+        for name, measure_fun in stages:
+            context = create_context(args.duration, args.sample_rate, create_plot=True)
+            samples_count = 0
+            started_at = time.perf_counter()
+            for _ in range(args.runs):
+                samples_count += measure_fun(context)
+            duration = time.perf_counter() - started_at
+            print(f'{name:>32}: {samples_count} samples in {duration:.2f} s, {samples_count / duration:,.0f} samples/s')
+        os.chdir(os.path.dirname(folder))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""
+    Benchmark comparing the CSV run files with the binary run files from zntest.runfile: write time, file size,
+    time to read the whole run and time to open the run and read a short window of it.
+    Both formats are written chunk by chunk and every chunk is synced to disk, as they are during a test.
+
+    Usage: python benchmarks/bench_run_file.py [samples ...]
+"""
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import zntest.reanalysis as reanalysis  # noqa: E402
+import zntest.runfile as runfile  # noqa: E402
+import zntest.utils as utils  # noqa: E402
+
+DEFAULT_SAMPLES_COUNTS = (10 ** 4, 10 ** 5, 10 ** 6)
+CONTEXT = {'compound': 'ABC', 'title': 'Benchmark', 'current_range': '100uA', 'sample_rate': 100,
+           'param': {'quietValue': 0.0, 'quietTime': 0, 'value': -1.0, 'duration': 1000}}
+WINDOW_SAMPLES_COUNT = 1000
+
+
+def create_samples(samples_count):
+    t = np.arange(samples_count) * 0.01
+    return t, np.full(samples_count, -1.0), np.exp(-t / 100.0) + np.random.normal(0.0, 1e-3, samples_count)
+
+
+def write_csv(path, t, volt, curr):
+    with open(path, 'w', encoding='utf-8', newline='') as output_csv:
+        output_csv.write(utils.format_csv_row(utils.OUTPUT_DATA_HEADER))
+        for start in range(0, len(t), utils.SAMPLES_CHUNK_SIZE):
+            chunk = slice(start, start + utils.SAMPLES_CHUNK_SIZE)
+            output_csv.write(utils.format_output_data(t[chunk], volt[chunk], curr[chunk], CONTEXT['compound']))
+            # every chunk is flushed to disk, as the CSV writer did
+            output_csv.flush()
+            os.fsync(output_csv.fileno())
+
+
+def write_run_file(path, t, volt, curr):
+    writer = runfile.RunFileWriter(path + '.partial', runfile.create_header('constant', CONTEXT, datetime.now()))
+    for start in range(0, len(t), utils.SAMPLES_CHUNK_SIZE):
+        chunk = slice(start, start + utils.SAMPLES_CHUNK_SIZE)
+        writer.write(t[chunk], volt[chunk], curr[chunk])
+    writer.close()
+    runfile.finish_run_file(path + '.partial', path)
+
+
+def read_csv(path):
+    with open(path, 'rb') as run_csv:
+        return reanalysis.parse_run_file_content(run_csv.read())
+
+
+def read_csv_window(path):
+    # CSV has to be parsed up to the window
+    samples = read_csv(path)
+    return samples[:, len(samples[0]) // 2:len(samples[0]) // 2 + WINDOW_SAMPLES_COUNT].sum()
+
+
+def read_run_file(path):
+    return np.array(runfile.open_run(path).samples)
+
+
+def read_run_file_window(path):
+    run = runfile.open_run(path)
+    start = len(run) // 2
+    return run.samples[:, start:start + WINDOW_SAMPLES_COUNT].sum()
+
+
+def measure(fun, *args):
+    started_at = time.perf_counter()
+    fun(*args)
+    return time.perf_counter() - started_at
+
+
+def main():
+    samples_counts = [int(value) for value in sys.argv[1:]] or DEFAULT_SAMPLES_COUNTS
+    print(f'{"samples":>10} {"format":>6} {"write s":>9} {"size MB":>9} {"read s":>9} {"window s":>9}')
+    with tempfile.TemporaryDirectory() as folder:
+        for samples_count in samples_counts:
+            t, volt, curr = create_samples(samples_count)
+            for name, extension, write_fun, read_fun, read_window_fun in (
+                    ('csv', '.csv', write_csv, read_csv, read_csv_window),
+                    ('zrun', runfile.RUN_FILE_EXTENSION, write_run_file, read_run_file, read_run_file_window)):
+                path = os.path.join(folder, f'run_{samples_count}{extension}')
+                write_time = measure(write_fun, path, t, volt, curr)
+                read_time = measure(read_fun, path)
+                read_window_time = measure(read_window_fun, path)
+                print(f'{samples_count:>10} {name:>6} {write_time:>9.3f} {os.path.getsize(path) / 1e6:>9.2f} '
+                      f'{read_time:>9.4f} {read_window_time:>9.5f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+"""
+    Memory benchmark: a 10^6 sample run kept as three lists of Python floats, as returned by pstat.run_test,
+    compared with MeasurementRun holding float64 and float32 samples.
+
+    Usage: python benchmarks/bench_run_memory.py [--samples 1000000]
+"""
+import argparse
+import os
+import sys
+import tracemalloc
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from zntest.measurement import MeasurementRun, create_run_metadata  # noqa: E402
+
+
+def measure_allocated_bytes(create_fun):
+    tracemalloc.start()
+    value = create_fun()
+    allocated_bytes, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del value
+    return allocated_bytes
+
+
+def create_lists(samples_count):
+    # every value is a separate float object, like the values parsed from JSON by the driver
+    return ([i * 0.01 for i in range(samples_count)], [i * 1e-6 - 1.0 for i in range(samples_count)],
+            [i * 1e-5 + 0.5 for i in range(samples_count)])
+
+
+def create_run(samples_count, dtype):
+    metadata = create_run_metadata('Zn', 'constant', {'value': -1.0}, None)
+    samples = np.empty((3, samples_count), dtype=dtype)
+    samples[0] = np.arange(samples_count) * 0.01
+    samples[1] = np.arange(samples_count) * 1e-6 - 1.0
+    samples[2] = np.arange(samples_count) * 1e-5 + 0.5
+    return MeasurementRun(samples, metadata)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--samples', type=int, default=1000000)
+    args = parser.parse_args()
+
+    lists_bytes = measure_allocated_bytes(lambda: create_lists(args.samples))
+    print(f'{args.samples} samples')
+    print(f'    lists of floats:          {lists_bytes / 1e6:8.1f} MB')
+    for dtype in (np.float64, np.float32):
+        run_bytes = measure_allocated_bytes(lambda: create_run(args.samples, dtype))
+        print(f'    MeasurementRun {np.dtype(dtype).name:9s}: {run_bytes / 1e6:8.1f} MB '
+              f'({lists_bytes / run_bytes:.1f}x less)')
+
+
+if __name__ == '__main__':
+    main()
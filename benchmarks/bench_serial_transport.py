@@ -0,0 +1,227 @@
+"""
+    Benchmark of the serial transports: potentiostat.Potentiostat, used by default, and PipelinedPotentiostat
+    from zntest.transport. Potentiostats are emulated at the serial level on pseudo terminals (POSIX only):
+    every device answers the JSON commands and streams the samples of zntest.simulator.SimulatedPotentiostat.
+    Reports command round-trip latency, the time to configure and start a test, the parsing cost per sample,
+    the streaming throughput of one device and of several devices served at the same time.
+
+    Usage: python benchmarks/bench_serial_transport.py [--commands 500] [--duration 60000] [--devices 4]
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+import tty
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import zntest.transport as transport  # noqa: E402
+import zntest.utils as utils  # noqa: E402
+from zntest.simulator import SimulatedPotentiostat  # noqa: E402
+
+HARDWARE_VARIANT = 'microAmpV0.1'
+# samples are written in packets of this many lines, like full USB packets of a device which is read late
+LINES_PER_WRITE = 16
+LINES_PER_PARSED_BATCH = 64
+CONSTANT_PARAM = {'quietValue': 0.0, 'quietTime': 1000, 'value': -1.4, 'duration': 10000}
+
+
+class EmulatedDevice:
+    """
+        Class answering the potentiostat serial protocol on the master side of a pseudo terminal.
+    """
+
+    def __init__(self, seed):
+        self.master, slave = os.openpty()
+        tty.setraw(slave)
+        self.port = os.ttyname(slave)
+        self.slave = slave
+        self.pstat = SimulatedPotentiostat(self.port, speed=0.0, seed=seed)
+        self.is_testing = False
+        self.lock = threading.Lock()
+        threading.Thread(target=self.serve_commands, daemon=True).start()
+
+    def write(self, data):
+        with self.lock:
+            os.write(self.master, data)
+
+    def respond(self, cmd_dict, **fields):
+        self.write(json.dumps({'success': True, 'response': dict(command=cmd_dict['command'], **fields)},
+                              separators=(',', ':')).encode() + b'\r\n')
+
+    def serve_commands(self):
+        pending = b''
+        while True:
+            try:
+                data = os.read(self.master, 4096)
+            except OSError:
+                return
+            pending += data
+            while b'\n' in pending:
+                line, pending = pending.split(b'\n', 1)
+                if line.strip():
+                    self.handle_cmd(json.loads(line))
+
+    def handle_cmd(self, cmd_dict):
+        command = cmd_dict['command']
+        if command == 'getVariant':
+            self.respond(cmd_dict, variant=HARDWARE_VARIANT)
+        elif command == 'getVersion':
+            self.respond(cmd_dict, version=self.pstat.get_firmware_version())
+        elif command == 'getHardwareVersion':
+            self.respond(cmd_dict, version='HW0.1')
+        elif command == 'getCurrRange':
+            self.respond(cmd_dict, currRange=self.pstat.get_curr_range())
+        elif command == 'setCurrRange':
+            self.respond(cmd_dict, currRange=self.pstat.set_curr_range(cmd_dict['currRange']))
+        elif command == 'setSamplePeriod':
+            self.respond(cmd_dict, samplePeriod=self.pstat.set_sample_period(cmd_dict['samplePeriod']))
+        elif command == 'setParam':
+            self.respond(cmd_dict, test=cmd_dict['test'], param=self.pstat.set_param(cmd_dict['test'],
+                                                                                     cmd_dict['param']))
+        elif command == 'runTest':
+            self.pstat.send_cmd(cmd_dict)
+            self.respond(cmd_dict, test=cmd_dict['test'])
+            self.is_testing = True
+            threading.Thread(target=self.stream_samples, daemon=True).start()
+        elif command == 'stopTest':
+            self.is_testing = False
+            self.respond(cmd_dict)
+
+    def stream_samples(self):
+        lines = []
+        while self.is_testing:
+            line = self.pstat.readline()
+            if line == b'{}\n':
+                self.is_testing = False
+            lines.append(line.rstrip(b'\n') + b'\r\n')
+            if len(lines) == LINES_PER_WRITE or not self.is_testing:
+                self.write(b''.join(lines))
+                lines = []
+
+    def close(self):
+        os.close(self.master)
+        os.close(self.slave)
+
+
+def connect(port, is_asyncio):
+    from potentiostat import Potentiostat
+
+    return transport.PipelinedPotentiostat(port) if is_asyncio else Potentiostat(port, timeout=1.5)
+
+
+def measure_round_trip(pstat, commands_count):
+    durations = []
+    for _ in range(commands_count):
+        started_at = time.perf_counter()
+        pstat.get_curr_range()
+        durations.append(time.perf_counter() - started_at)
+    return statistics.median(durations), statistics.mean(durations)
+
+
+def measure_test_start(pstat, starts_count):
+    # settings and runTest as run_test_streaming and iter_test_samples send them, the test is stopped right away
+    durations = []
+    for start_index in range(starts_count):
+        started_at = time.perf_counter()
+        pstat.set_curr_range('100uA')
+        pstat.set_sample_rate(100 + start_index % 2 * 100)
+        samples = utils.iter_test_samples(pstat, 'constant', dict(CONSTANT_PARAM, duration=60000), chunk_size=1)
+        next(samples)
+        durations.append(time.perf_counter() - started_at)
+        samples.close()
+    return statistics.median(durations)
+
+
+def measure_parsing(duration):
+    # the sample lines of one test, parsed as iter_test_samples parses the lines of the driver
+    # and as the asyncio transport parses a read buffer
+    pstat = SimulatedPotentiostat('sim://parse', speed=0.0, seed=0)
+    pstat.set_param('constant', dict(CONSTANT_PARAM, duration=duration))
+    pstat.send_cmd({'command': 'runTest', 'test': 'constant'})
+    lines = []
+    while True:
+        line = pstat.readline()
+        if line == b'{}\n':
+            break
+        lines.append(line.rstrip(b'\n') + b'\r\n')
+
+    started_at = time.perf_counter()
+    for line in lines:
+        sample = json.loads(line.strip().decode())
+        _ = sample['t'] * 1.0e-3, sample['v'], sample['i']
+    driver_sec = time.perf_counter() - started_at
+
+    # the lines of every batch are read at once, as when the port is read once per USB packets burst
+    batches = [bytearray(b''.join(lines[start:start + LINES_PER_PARSED_BATCH]))
+               for start in range(0, len(lines), LINES_PER_PARSED_BATCH)]
+    started_at = time.perf_counter()
+    for batch in batches:
+        transport.parse_sample_lines(batch, len(batch))
+    transport_sec = time.perf_counter() - started_at
+    return len(lines), driver_sec, transport_sec
+
+
+def stream_test(pstat, duration, sample_rate=1000):
+    pstat.set_curr_range('100uA')
+    pstat.set_sample_rate(sample_rate)
+    samples_count = 0
+    for t, _, _ in utils.iter_test_samples(pstat, 'constant', dict(CONSTANT_PARAM, duration=duration)):
+        samples_count += len(t)
+    return samples_count
+
+
+def measure_streaming(devices, is_asyncio, duration):
+    pstats = [connect(device.port, is_asyncio) for device in devices]
+    samples_counts = [0] * len(pstats)
+
+    def stream(index):
+        samples_counts[index] = stream_test(pstats[index], duration)
+
+    threads = [threading.Thread(target=stream, args=(index,)) for index in range(len(pstats))]
+    started_at = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    duration_sec = time.perf_counter() - started_at
+    for pstat in pstats:
+        pstat.close()
+    return sum(samples_counts), duration_sec
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--commands', type=int, default=500, help='commands of the round-trip measurement')
+    parser.add_argument('--starts', type=int, default=50, help='test starts of the configuration measurement')
+    parser.add_argument('--duration', type=int, default=60000, help='constant voltage test duration, ms')
+    parser.add_argument('--devices', type=int, default=4)
+    args = parser.parse_args()
+
+    devices = [EmulatedDevice(seed) for seed in range(args.devices)]
+    for name, is_asyncio in (('driver', False), ('asyncio', True)):
+        pstat = connect(devices[0].port, is_asyncio)
+        median_sec, mean_sec = measure_round_trip(pstat, args.commands)
+        start_sec = measure_test_start(pstat, args.starts)
+        pstat.close()
+        print(f'{name:>8}: command round-trip {median_sec * 1e6:.0f} us median, {mean_sec * 1e6:.0f} us mean, '
+              f'test configured and started in {start_sec * 1e3:.2f} ms')
+
+    samples_count, driver_sec, transport_sec = measure_parsing(args.duration)
+    print(f' parsing: driver {driver_sec / samples_count * 1e6:.2f} us/sample, '
+          f'asyncio {transport_sec / samples_count * 1e6:.2f} us/sample')
+
+    for name, is_asyncio in (('driver', False), ('asyncio', True)):
+        for devices_count in sorted({1, args.devices}):
+            samples_count, duration_sec = measure_streaming(devices[:devices_count], is_asyncio, args.duration)
+            print(f'{name:>8}: {devices_count} devices streamed {samples_count} samples in {duration_sec:.2f} s, '
+                  f'{samples_count / duration_sec:,.0f} samples/s')
+    for device in devices:
+        device.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""
+    Benchmark of recomputing forward, reverse and difference currents of stored pulse resolved square wave runs
+    with other windows (zntest.squarewave.reconstruct_stored_runs). Runs of zntest.simulator.SimulatedPotentiostat
+    reporting every half period as raw samples are saved to a run store in a temporary folder, then all of them
+    are reconstructed and analyzed with every window.
+
+    Usage: python benchmarks/bench_square_wave_window.py [--runs 2000] [--pulse-samples 10] [--windows 0.1 0.2 0.5 1]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import zntest.recipe as recipe  # noqa: E402
+import zntest.squarewave as squarewave  # noqa: E402
+from zntest.simulator import SimulatedPotentiostat  # noqa: E402
+from zntest.store import RunStore  # noqa: E402
+
+SQUARE_WAVE_PARAM = {'quietValue': 0.0, 'quietTime': 1000, 'amplitude': 0.025, 'startValue': -1.4,
+                     'finalValue': -0.6, 'stepValue': 0.005, 'window': 0.2}
+
+
+def add_runs(run_store, runs_count, pulse_samples, sample_rate):
+    context = recipe.create_test_context(recipe.SQUARE_WAVE_VOLTAMMETRY_TEST_KIND, 'Benchmark', '100uA', sample_rate,
+                                         SQUARE_WAVE_PARAM, 'BENCH', True)
+    run_ids = []
+    for run_index in range(runs_count):
+        pstat = SimulatedPotentiostat(f'sim://{run_index % 8 + 1}', speed=0.0, seed=run_index,
+                                      pulse_samples=pulse_samples)
+        pstat.set_sample_rate(sample_rate)
+        pstat.set_param('squareWave', SQUARE_WAVE_PARAM)
+        t, volt, curr = pstat.create_samples('squareWave')
+        run_ids.append(run_store.add_run(recipe.SQUARE_WAVE_VOLTAMMETRY_TEST_KIND, context, datetime.now(),
+                                         t / 1.0e3, volt, curr))
+    return run_ids
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=2000)
+    parser.add_argument('--pulse-samples', type=int, default=10, help='raw samples of every half period')
+    parser.add_argument('--sample-rate', type=int, default=100)
+    parser.add_argument('--windows', type=float, nargs='+', default=[0.1, 0.2, 0.5, 1.0])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        run_store = RunStore(os.path.join(folder, 'runs.sqlite3'))
+        started_at = time.perf_counter()
+        run_ids = add_runs(run_store, args.runs, args.pulse_samples, args.sample_rate)
+        print(f'{len(run_ids)} runs of {len(run_store.load_samples(run_ids[0])[0])} samples stored in '
+              f'{time.perf_counter() - started_at:.2f} s')
+
+        for window in args.windows:
+            started_at = time.perf_counter()
+            results = squarewave.reconstruct_stored_runs(run_store, run_ids, window)
+            duration_sec = time.perf_counter() - started_at
+            peak_heights = np.array([result['peak_height'] for _, result in results])
+            print(f'window {window:.2f}: {len(results)} runs reconstructed and analyzed in {duration_sec:.2f} s, '
+                  f'{len(results) / duration_sec:,.0f} runs/s, peak height {peak_heights.mean():.4f} '
+                  f'+- {peak_heights.std():.4f} uA')
+        run_store.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""
+    Startup benchmark: cumulative import time of zntest.app measured with 'python -X importtime'
+    and time from the interpreter start to the first shown window.
+    Exits with code 1 when any measurement exceeds its threshold, the window measurement is skipped
+    when there is no display.
+
+    Usage: python benchmarks/bench_startup.py [--max-import-ms 150] [--max-first-window-ms 1000] [--repeats 5]
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+import time
+
+ROOT_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+IMPORT_TIME_LINE_PATTERN = re.compile(r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)$')
+FIRST_WINDOW_SCRIPT = '''
+import time
+from zntest.app import ZnApplication
+app = ZnApplication()
+app.root.update()
+print(time.time())
+app.root.destroy()
+'''
+
+
+def run_python(args):
+    return subprocess.run([sys.executable] + args, cwd=ROOT_FOLDER, capture_output=True, text=True, check=True)
+
+
+def measure_import_time(module_name):
+    """
+        Returns cumulative import time (ms) of the module and the heaviest modules it has imported.
+    """
+    result = run_python(['-X', 'importtime', '-c', f'import {module_name}'])
+    module_times = []
+    module_cumulative_ms = None
+    for line in result.stderr.splitlines():
+        match = IMPORT_TIME_LINE_PATTERN.match(line)
+        if match is None:
+            continue
+        self_us, cumulative_us, _, name = match.groups()
+        module_times.append((int(self_us) / 1000.0, name))
+        if name == module_name:
+            module_cumulative_ms = int(cumulative_us) / 1000.0
+    return module_cumulative_ms, sorted(module_times, reverse=True)[:10]
+
+
+def measure_first_window_time():
+    # the child process prints wall clock time when the window is shown, so interpreter start is included
+    started_at = time.time()
+    result = run_python(['-c', FIRST_WINDOW_SCRIPT])
+    return (float(result.stdout.strip().splitlines()[-1]) - started_at) * 1000.0
+
+
+def is_display_available():
+    if sys.platform.startswith('win') or sys.platform == 'darwin':
+        return True
+    return bool(os.environ.get('DISPLAY') or os.environ.get('WAYLAND_DISPLAY'))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--max-import-ms', type=float, default=150.0)
+    parser.add_argument('--max-first-window-ms', type=float, default=1000.0)
+    parser.add_argument('--repeats', type=int, default=5)
+    args = parser.parse_args()
+
+    is_regression = False
+
+    import_times = []
+    heaviest_modules = []
+    for _ in range(args.repeats):
+        import_time, heaviest_modules = measure_import_time('zntest.app')
+        import_times.append(import_time)
+    import_time = min(import_times)
+    print(f'import zntest.app: {import_time:.1f} ms (threshold {args.max_import_ms:.0f} ms)')
+    print('heaviest modules (self time):')
+    for self_ms, name in heaviest_modules:
+        print(f'    {self_ms:8.1f} ms  {name}')
+    if import_time > args.max_import_ms:
+        print('REGRESSION: import time exceeds the threshold')
+        is_regression = True
+
+    if is_display_available():
+        first_window_time = min(measure_first_window_time() for _ in range(args.repeats))
+        print(f'time to first window: {first_window_time:.1f} ms (threshold {args.max_first_window_ms:.0f} ms)')
+        if first_window_time > args.max_first_window_ms:
+            print('REGRESSION: time to first window exceeds the threshold')
+            is_regression = True
+    else:
+        print('time to first window: skipped, no display')
+
+    sys.exit(1 if is_regression else 0)
+
+
+if __name__ == '__main__':
+    main()
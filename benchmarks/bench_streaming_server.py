@@ -0,0 +1,259 @@
+"""
+    Load test of the streaming server (zntest.streaming). Constant voltage tests run on simulated potentiostats
+    through zntest.worker.AcquisitionWorker, as the GUI runs them, without the server, with the server and
+    no subscribers and with a few hundred /live subscribers held by another process, some of which read slowly.
+    Reports acquisition throughput of every case, the samples every group of subscribers received and the sample
+    frames dropped for them, then the throughput of stored runs served to concurrent /runs/<id> requests.
+
+    Usage: python benchmarks/bench_streaming_server.py [--subscribers 300] [--slow 30] [--devices 4] [--speed 20]
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import socket
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import zntest.recipe as recipe  # noqa: E402
+import zntest.streaming as streaming  # noqa: E402
+import zntest.utils as utils  # noqa: E402
+import zntest.worker as worker  # noqa: E402
+from zntest.simulator import SimulatedPotentiostat  # noqa: E402
+from zntest.store import RunStore  # noqa: E402
+
+CONSTANT_PARAM = {'quietValue': 0.0, 'quietTime': 1000, 'value': -1.4}
+# slow subscribers read this many bytes at this interval, about 80 kB/s, through a small socket receive buffer,
+# so their backlog isn't absorbed by the loopback socket buffers and builds up in the server
+SLOW_READ_BYTES = 4096
+SLOW_READ_INTERVAL_SEC = 0.05
+SLOW_RECEIVE_BUFFER_BYTES = 16384
+CONNECT_BATCH_SIZE = 50
+SUBSCRIBERS_TIMEOUT_SEC = 300.0
+
+
+def split_chunks(data):
+    """
+        Returns the payload of the complete chunks of the chunked response body and the number of bytes they took.
+    """
+    payload = bytearray()
+    offset = 0
+    while True:
+        line_end = data.find(b'\r\n', offset)
+        if line_end < 0:
+            break
+        size = int(data[offset:line_end], 16)
+        if line_end + 2 + size + 2 > len(data):
+            break
+        payload += data[line_end + 2:line_end + 2 + size]
+        offset = line_end + 2 + size + 2
+    return payload, offset
+
+
+async def get(host, port, path, receive_buffer_bytes=None):
+    sock = socket.socket()
+    if receive_buffer_bytes is not None:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, receive_buffer_bytes)
+    sock.setblocking(False)
+    await asyncio.get_running_loop().sock_connect(sock, (host, port))
+    reader, writer = await asyncio.open_connection(sock=sock)
+    writer.write(f'GET {path} HTTP/1.1\r\nHost: {host}\r\n\r\n'.encode())
+    await writer.drain()
+    await reader.readuntil(b'\r\n\r\n')
+    return reader, writer
+
+
+async def subscribe(host, port, is_slow, devices_count, connected):
+    """
+        Reads the live stream until every device finished its sequence, returns (is slow, samples received,
+        sample frames dropped by the server).
+    """
+    reader, writer = await get(host, port, '/live', SLOW_RECEIVE_BUFFER_BYTES if is_slow else None)
+    connected.release()
+    body = bytearray()
+    frames_data = bytearray()
+    samples_count = 0
+    dropped_count = 0
+    finished_count = 0
+    while finished_count < devices_count:
+        data = await reader.read(SLOW_READ_BYTES if is_slow else 1 << 16)
+        if not data:
+            break
+        if is_slow:
+            await asyncio.sleep(SLOW_READ_INTERVAL_SEC)
+        body += data
+        payload, offset = split_chunks(body)
+        del body[:offset]
+        frames_data += payload
+        frames, offset = streaming.decode_frames(frames_data)
+        for kind, frame in frames:
+            if kind == streaming.FRAME_SAMPLES:
+                samples_count += streaming.decode_samples(frame)[1].shape[1]
+            else:
+                event = json.loads(bytes(frame))
+                if event['event'] == streaming.EVENT_SAMPLES_DROPPED:
+                    dropped_count += event['frames_count']
+                elif event['event'] == worker.SEQUENCE_FINISHED:
+                    finished_count += 1
+        del frames_data[:offset]
+    writer.close()
+    return is_slow, samples_count, dropped_count
+
+
+async def run_subscribers(host, port, subscribers_count, slow_count, devices_count, connection):
+    connected = asyncio.Semaphore(0)
+    tasks = []
+    # the listen backlog is limited, connections are opened in batches
+    for batch_start in range(0, subscribers_count, CONNECT_BATCH_SIZE):
+        batch_end = min(batch_start + CONNECT_BATCH_SIZE, subscribers_count)
+        for index in range(batch_start, batch_end):
+            tasks.append(asyncio.create_task(subscribe(host, port, index < slow_count, devices_count, connected)))
+        for _ in range(batch_start, batch_end):
+            await connected.acquire()
+    connection.send('connected')
+    done, _ = await asyncio.wait(tasks, timeout=SUBSCRIBERS_TIMEOUT_SEC)
+    connection.send([task.result() for task in done])
+
+
+def subscribers_process(host, port, subscribers_count, slow_count, devices_count, connection):
+    asyncio.run(run_subscribers(host, port, subscribers_count, slow_count, devices_count, connection))
+
+
+def run_acquisition(devices_count, steps_count, duration, sample_rate, speed):
+    """
+        Runs a sequence of constant voltage tests on every simulated device, returns (samples count, duration, s).
+    """
+    workers = []
+    contexts = []
+    for device_index in range(devices_count):
+        port = f'sim://{device_index + 1}'
+        context = recipe.create_test_context(recipe.CONSTANT_VOLTAGE_TEST_KIND, 'Benchmark', '100uA', sample_rate,
+                                             dict(CONSTANT_PARAM, duration=duration), 'BENCH', False, False, port)
+        context['abort_on_anomaly'] = False
+        contexts.append(context)
+        workers.append(worker.AcquisitionWorker(SimulatedPotentiostat(port, speed=speed, seed=device_index), port))
+
+    samples_count = 0
+    started_at = time.perf_counter()
+    for acquisition_worker, context in zip(workers, contexts):
+        acquisition_worker.start([(utils.run_constant_voltage_test, context)] * steps_count)
+    while any(acquisition_worker.is_running() for acquisition_worker in workers):
+        # the events are taken as the GUI takes them
+        time.sleep(0.05)
+        for acquisition_worker in workers:
+            samples_count += sum(event.payload.t.size for event in acquisition_worker.get_events()
+                                 if event.kind == worker.STEP_SAMPLES)
+    duration_sec = time.perf_counter() - started_at
+    for acquisition_worker in workers:
+        samples_count += sum(event.payload.t.size for event in acquisition_worker.get_events()
+                             if event.kind == worker.STEP_SAMPLES)
+    return samples_count, duration_sec
+
+
+def print_acquisition(name, samples_count, duration_sec):
+    print(f'{name:>32}: {samples_count} samples in {duration_sec:.2f} s, {samples_count / duration_sec:,.0f} samples/s')
+
+
+def print_subscribers(name, results, samples_count):
+    if not results:
+        return
+    received = [result[1] for result in results]
+    dropped = [result[2] for result in results]
+    print(f'{name:>32}: {len(results)} received {statistics.mean(received) / samples_count:.1%} of the samples, '
+          f'min {min(received) / samples_count:.1%}, {statistics.mean(dropped):.0f} frames dropped on average')
+
+
+async def fetch_run(host, port, run_id):
+    reader, writer = await get(host, port, f'/runs/{run_id}')
+    body = await reader.read()
+    writer.close()
+    payload, _ = split_chunks(body)
+    frames, _ = streaming.decode_frames(payload)
+    return sum(streaming.decode_samples(frame)[1].shape[1] for kind, frame in frames
+               if kind == streaming.FRAME_SAMPLES)
+
+
+async def fetch_runs(host, port, run_ids, requests_count):
+    return await asyncio.gather(*[fetch_run(host, port, run_ids[index % len(run_ids)])
+                                  for index in range(requests_count)])
+
+
+def measure_stored_runs(folder, runs_count, requests_count, duration, sample_rate):
+    run_store = RunStore(os.path.join(folder, 'runs.sqlite3'))
+    run_ids = []
+    for run_index in range(runs_count):
+        pstat = SimulatedPotentiostat(f'sim://{run_index % 8 + 1}', speed=0.0, seed=run_index)
+        pstat.set_sample_rate(sample_rate)
+        pstat.set_param('constant', dict(CONSTANT_PARAM, duration=duration))
+        t, volt, curr = pstat.create_samples('constant')
+        context = recipe.create_test_context(recipe.CONSTANT_VOLTAGE_TEST_KIND, 'Benchmark', '100uA', sample_rate,
+                                             dict(CONSTANT_PARAM, duration=duration), 'BENCH', True)
+        run_ids.append(run_store.add_run(recipe.CONSTANT_VOLTAGE_TEST_KIND, context, datetime.now(), t / 1.0e3,
+                                         volt, curr))
+    expected_counts = [run_store.load_samples(run_id).shape[1] for run_id in run_ids]
+    run_store.close()
+
+    server = streaming.start_server('127.0.0.1', 0, run_store.path)
+    started_at = time.perf_counter()
+    samples_counts = asyncio.run(fetch_runs(server.host, server.port, run_ids, requests_count))
+    duration_sec = time.perf_counter() - started_at
+    streaming.stop_server()
+    is_complete = all(samples_counts[index] == expected_counts[index % len(run_ids)]
+                      for index in range(requests_count))
+    print(f'{"stored runs":>32}: {requests_count} requests of {runs_count} runs served in {duration_sec:.2f} s, '
+          f'{sum(samples_counts) / duration_sec:,.0f} samples/s, {"complete" if is_complete else "INCOMPLETE"}')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--subscribers', type=int, default=300)
+    parser.add_argument('--slow', type=int, default=30, help='subscribers reading about 80 kB/s')
+    parser.add_argument('--devices', type=int, default=4)
+    parser.add_argument('--steps', type=int, default=5, help='constant voltage tests of every device')
+    parser.add_argument('--duration', type=int, default=100000, help='constant voltage test duration, ms')
+    parser.add_argument('--sample-rate', type=int, default=200)
+    parser.add_argument('--speed', type=float, default=20.0,
+                        help='samples are paced this many times faster than real time, 0 streams them as fast as '
+                             'they are read')
+    parser.add_argument('--runs', type=int, default=20, help='stored runs of the /runs/<id> measurement')
+    parser.add_argument('--requests', type=int, default=100, help='concurrent /runs/<id> requests')
+    args = parser.parse_args()
+
+    acquisition_args = (args.devices, args.steps, args.duration, args.sample_rate, args.speed)
+    # warm-up, the first tests pay for imports and first allocations
+    run_acquisition(args.devices, 1, args.duration, args.sample_rate, args.speed)
+    samples_count, duration_sec = run_acquisition(*acquisition_args)
+    print_acquisition('no server', samples_count, duration_sec)
+
+    server = streaming.start_server('127.0.0.1', 0)
+    samples_count, duration_sec = run_acquisition(*acquisition_args)
+    print_acquisition('server, no subscribers', samples_count, duration_sec)
+
+    connection, child_connection = multiprocessing.Pipe()
+    process = multiprocessing.get_context('spawn').Process(
+        target=subscribers_process, args=(server.host, server.port, args.subscribers, args.slow, args.devices,
+                                          child_connection))
+    process.start()
+    connection.recv()
+    samples_count, duration_sec = run_acquisition(*acquisition_args)
+    print_acquisition(f'server, {args.subscribers} subscribers', samples_count, duration_sec)
+    results = connection.recv()
+    process.join()
+    streaming.stop_server()
+    if len(results) < args.subscribers:
+        print(f'{args.subscribers - len(results)} subscribers didn\'t finish in {SUBSCRIBERS_TIMEOUT_SEC:.0f} s')
+    print_subscribers('fast subscribers', [result for result in results if not result[0]], samples_count)
+    print_subscribers('slow subscribers', [result for result in results if result[0]], samples_count)
+
+    with tempfile.TemporaryDirectory() as folder:
+        measure_stored_runs(folder, args.runs, args.requests, args.duration, args.sample_rate)
+
+
+if __name__ == '__main__':
+    main()
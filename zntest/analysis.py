@@ -0,0 +1,167 @@
+import json
+import os
+from collections import namedtuple
+from functools import lru_cache
+
+import numpy as np
+
+# results computed by an older version of the analysis are recomputed
+ANALYSIS_VERSION = 1
+
+AnalysisSettings = namedtuple('AnalysisSettings', ['smoothing_window', 'smoothing_order', 'peak_potential_range',
+                                                   'peak_sign'])
+# Zn stripping peak is expected around -1.0 V, anodic stripping current is positive
+DEFAULT_ANALYSIS_SETTINGS = AnalysisSettings(smoothing_window=11, smoothing_order=2,
+                                             peak_potential_range=(-1.4, -0.6), peak_sign=1)
+
+# concentration = (peak height - intercept) / slope
+Calibration = namedtuple('Calibration', ['slope', 'intercept', 'unit'])
+
+RESULT_FIELDS = ('peak_potential', 'peak_height', 'peak_area', 'concentration')
+
+
+def get_default_calibration_path():
+    return os.path.join(os.getcwd(), 'data', 'calibration.json')
+
+
+def load_calibration(path=None):
+    path = path or get_default_calibration_path()
+    if os.path.exists(path) is False:
+        return None
+    with open(path, 'r', encoding='utf-8') as calibration_file:
+        return Calibration(**json.load(calibration_file))
+
+
+def save_calibration(calibration, path=None):
+    path = path or get_default_calibration_path()
+    folder = os.path.dirname(path)
+    if folder and os.path.exists(folder) is False:
+        os.makedirs(folder)
+    with open(path, 'w', encoding='utf-8') as calibration_file:
+        json.dump(calibration._asdict(), calibration_file, indent=2)
+
+
+def fit_calibration(concentrations, peak_heights, unit='ppb'):
+    slope, intercept = np.polyfit(np.asarray(concentrations, dtype=float), np.asarray(peak_heights, dtype=float), 1)
+    return Calibration(float(slope), float(intercept), unit)
+
+
+@lru_cache(maxsize=16)
+def get_savitzky_golay_coefficients(window, order):
+    # least squares polynomial fit evaluated at the window center is a fixed linear combination of the window
+    offsets = np.arange(window) - window // 2
+    vandermonde = np.vander(offsets, order + 1, increasing=True)
+    return np.linalg.pinv(vandermonde)[0]
+
+
+def savitzky_golay_smooth(values, window, order):
+    """
+        Savitzky-Golay smoothing along the last axis, signal edges are mirrored.
+        Works with a single run (1D) as well as with a batch of runs of the same length (2D).
+    """
+    window = min(window, values.shape[-1] - (1 - values.shape[-1] % 2))
+    if window <= order:
+        return values.astype(float)
+    half = window // 2
+    padding = [(0, 0)] * (values.ndim - 1) + [(half, half)]
+    padded = np.pad(values.astype(float), padding, mode='reflect')
+    windows = np.lib.stride_tricks.sliding_window_view(padded, window, axis=-1)
+    return windows @ get_savitzky_golay_coefficients(window, order)
+
+
+def integrate_trapezoid(y, x):
+    return np.sum(0.5 * (y[..., 1:] + y[..., :-1]) * np.abs(np.diff(x, axis=-1)), axis=-1)
+
+
+def analyze_square_wave_voltammetry(volt, curr, settings=DEFAULT_ANALYSIS_SETTINGS, calibration=None):
+    """
+        Finds Zn stripping peak: the current is smoothed, the linear baseline drawn between the edges of
+        the peak potential range is subtracted and the maximum of what is left is the peak.
+        volt and curr are either arrays of a single run or 2D arrays with a run per row, all runs of the batch
+        are processed at once. Returns dict of RESULT_FIELDS, the values are floats for a single run and arrays
+        for a batch. Values of runs without samples in the peak potential range are NaN.
+    """
+    is_single_run = np.ndim(volt) == 1
+    volt = np.atleast_2d(np.asarray(volt, dtype=float))
+    curr = np.atleast_2d(np.asarray(curr, dtype=float)) * settings.peak_sign
+    rows = np.arange(volt.shape[0])
+
+    smoothed = savitzky_golay_smooth(curr, settings.smoothing_window, settings.smoothing_order)
+
+    low, high = settings.peak_potential_range
+    in_range = (volt >= low) & (volt <= high)
+    has_samples = in_range.any(axis=1)
+    first = in_range.argmax(axis=1)
+    last = volt.shape[1] - 1 - in_range[:, ::-1].argmax(axis=1)
+
+    first_volt, last_volt = volt[rows, first], volt[rows, last]
+    first_curr, last_curr = smoothed[rows, first], smoothed[rows, last]
+    volt_span = np.where(last_volt != first_volt, last_volt - first_volt, 1.0)
+    baseline = first_curr[:, None] + (last_curr - first_curr)[:, None] * (volt - first_volt[:, None]) / \
+        volt_span[:, None]
+    corrected = np.where(in_range, smoothed - baseline, 0.0)
+
+    peak_index = np.where(in_range, corrected, -np.inf).argmax(axis=1)
+    result = {
+        'peak_potential': np.where(has_samples, volt[rows, peak_index], np.nan),
+        'peak_height': np.where(has_samples, corrected[rows, peak_index] * settings.peak_sign, np.nan),
+        'peak_area': np.where(has_samples, integrate_trapezoid(np.clip(corrected, 0.0, None), volt) *
+                              settings.peak_sign, np.nan),
+    }
+    if calibration is not None:
+        result['concentration'] = (result['peak_height'] - calibration.intercept) / calibration.slope
+    else:
+        result['concentration'] = np.full(volt.shape[0], np.nan)
+
+    if is_single_run:
+        return {field: float(values[0]) for field, values in result.items()}
+    return result
+
+
+def analyze_runs_batch(runs, settings=DEFAULT_ANALYSIS_SETTINGS, calibration=None):
+    """
+        Analyzes (volt, curr) pairs of many runs. Runs of the same length, e.g. made with the same recipe,
+        are stacked and processed as one batch. Returns the list of result dicts in the order of runs.
+    """
+    results = [None] * len(runs)
+    runs_by_length = {}
+    for run_index, (volt, curr) in enumerate(runs):
+        runs_by_length.setdefault(len(volt), []).append(run_index)
+
+    for length, run_indexes in runs_by_length.items():
+        if length == 0:
+            for run_index in run_indexes:
+                results[run_index] = {field: float('nan') for field in RESULT_FIELDS}
+            continue
+        volt = np.stack([np.asarray(runs[run_index][0], dtype=float) for run_index in run_indexes])
+        curr = np.stack([np.asarray(runs[run_index][1], dtype=float) for run_index in run_indexes])
+        batch_result = analyze_square_wave_voltammetry(volt, curr, settings, calibration)
+        for row, run_index in enumerate(run_indexes):
+            results[run_index] = {field: float(np.atleast_1d(batch_result[field])[row]) for field in RESULT_FIELDS}
+    return results
+
+
+def analyze_stored_runs(run_store, run_ids, settings=DEFAULT_ANALYSIS_SETTINGS, calibration=None, errors=None):
+    """
+        Analyzes the stored runs and stores their results. Returns the result dict of every run in the order
+        of run_ids, None for the runs which can't be analyzed, e.g. legacy or truncated runs whose samples
+        don't make the steps of their param, they are skipped and their ValueError is put into the errors dict
+        by run id, when it is given.
+    """
+    import zntest.squarewave as squarewave
+
+    runs = []
+    analyzed_run_ids = []
+    for run_id in run_ids:
+        # currents of pulse resolved runs are reconstructed with the window of the run first
+        try:
+            runs.append(squarewave.get_voltammogram(run_store.load_run(run_id)))
+        except ValueError as e:
+            if errors is not None:
+                errors[run_id] = e
+            continue
+        analyzed_run_ids.append(run_id)
+    results = dict(zip(analyzed_run_ids, analyze_runs_batch(runs, settings, calibration)))
+    for run_id, result in results.items():
+        run_store.set_analysis(run_id, ANALYSIS_VERSION, result)
+    return [results.get(run_id) for run_id in run_ids]
@@ -1,5 +1,6 @@
 from tkinter import Tk
 
+import zntest.streaming as streaming
 from zntest.gui import MainApplication
 
 
@@ -12,6 +13,12 @@ class ZnApplication:
     def __init__(self):
         self.root = Tk()
         MainApplication(self.root)
+        server = streaming.start_server_from_environment()
+        if server is not None:
+            print(f'Streaming live data at http://{server.host}:{server.port}/live')
 
     def start(self):
-        self.root.mainloop()
+        try:
+            self.root.mainloop()
+        finally:
+            streaming.stop_server()
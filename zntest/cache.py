@@ -0,0 +1,86 @@
+import sys
+import threading
+from collections import OrderedDict
+
+# cached artifacts are small, the limit keeps a long session of many recipes bounded
+DEFAULT_MAX_BYTES = 4 * 1024 * 1024
+
+
+def get_parameter_key(context):
+    # tests with the same kind, current range, sample rate and parameters have the same derived artifacts
+    return (context['kind'], context.get('current_range'), context.get('sample_rate'),
+            tuple(sorted(context.get('param', {}).items())))
+
+
+def get_size(value):
+    if hasattr(value, 'nbytes'):
+        return int(value.nbytes)
+    if isinstance(value, (tuple, list)):
+        return sys.getsizeof(value) + sum(get_size(item) for item in value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(get_size(key) + get_size(item) for key, item in value.items())
+    return sys.getsizeof(value)
+
+
+class ParameterCache:
+    """
+        Class keeping artifacts derived from test parameters, e.g. plot bounds, in memory, so tests repeated
+        with the same recipe don't compute them again.
+        Values are keyed by the artifact name and the test parameters, the least recently used values are evicted
+        when the total size exceeds max_bytes.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.hits_count = 0
+        self.misses_count = 0
+
+    def get(self, artifact, context, compute_fun):
+        """
+            Returns the cached artifact of the test context, compute_fun() is called to compute a missing one.
+            Cached values are shared, they must not be modified.
+        """
+        key = (artifact, get_parameter_key(context))
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits_count += 1
+                return self.entries[key][0]
+            self.misses_count += 1
+
+        value = compute_fun()
+        self.put(key, value)
+        return value
+
+    def put(self, key, value):
+        size = get_size(value)
+        with self.lock:
+            if key in self.entries:
+                self.total_bytes -= self.entries.pop(key)[1]
+            if size > self.max_bytes:
+                return
+            self.entries[key] = (value, size)
+            self.total_bytes += size
+            while self.total_bytes > self.max_bytes:
+                _, (_, evicted_size) = self.entries.popitem(last=False)
+                self.total_bytes -= evicted_size
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.total_bytes = 0
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def get_default_cache():
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = ParameterCache()
+        return _default_cache
@@ -0,0 +1,214 @@
+import math
+from collections import namedtuple
+
+import numpy as np
+
+# window_sec: length of the rolling mean and variance window,
+# saturation_fraction, saturation_sec: current at this fraction of the range limit for this long is saturation,
+# open_circuit_fraction: rolling mean current below this fraction of the range limit is open circuit,
+# settle_sec: open circuit isn't checked for this long after the potential step, the current still decays then,
+# max_cottrell_residual: relative RMS residual of the Cottrell fit above which the decay is reported as irregular
+MonitorSettings = namedtuple('MonitorSettings', ['window_sec', 'saturation_fraction', 'saturation_sec',
+                                                 'open_circuit_fraction', 'settle_sec', 'max_cottrell_residual'])
+DEFAULT_MONITOR_SETTINGS = MonitorSettings(window_sec=1.0, saturation_fraction=0.98, saturation_sec=0.5,
+                                           open_circuit_fraction=1e-3, settle_sec=1.0, max_cottrell_residual=0.2)
+# samples right after the potential step are limited by the cell resistance, they aren't fitted
+COTTRELL_MIN_TIME_SEC = 0.05
+
+ANOMALY_SATURATION = 'saturation'
+ANOMALY_OPEN_CIRCUIT = 'open_circuit'
+ANOMALY_IRREGULAR_DECAY = 'irregular_decay'
+# anomalies which make the rest of the sequence useless, the step is aborted when one is found
+FATAL_ANOMALIES = (ANOMALY_SATURATION, ANOMALY_OPEN_CIRCUIT)
+
+Anomaly = namedtuple('Anomaly', ['kind', 't', 'message'])
+RESULT_FIELDS = ('charge', 'mean_current', 'current_std', 'cottrell_coefficient', 'cottrell_offset',
+                 'cottrell_residual', 'anomalies')
+
+
+class DepositionAbortedError(RuntimeError):
+    """
+        Exception raised by a constant voltage test aborted because of a fatal anomaly.
+    """
+
+    def __init__(self, title, anomaly):
+        super().__init__(f'{title} is aborted: {anomaly.message}')
+        self.anomaly = anomaly
+
+
+def get_current_range_limit(current_range):
+    # current ranges are named by their limit, e.g. '100uA' or '60nA', the limit is returned in uA
+    if current_range.endswith('nA'):
+        return float(current_range[:-2]) / 1.0e3
+    return float(current_range[:-2])
+
+
+def get_potential_step_time(param):
+    # the potential steps from the open circuit to the quiet value at the test start
+    # and to the test value after the quiet time, when they differ
+    return param['quietTime'] / 1.0e3 if param['value'] != param['quietValue'] else 0.0
+
+
+class ChronoamperometryMonitor:
+    """
+        Class analyzing the current of a constant voltage test while it is acquired. Chunks are added as they
+        come off the device, every sample updates the running charge (trapezoidal integral of the current),
+        the rolling mean and variance of the last window_sec and the sums of the least squares fit of
+        the Cottrell decay i = offset + coefficient / sqrt(t - step time) in constant time.
+        Current range saturation and open circuit are reported as fatal anomalies as soon as they are found.
+    """
+
+    def __init__(self, context, settings=DEFAULT_MONITOR_SETTINGS):
+        self.settings = settings
+        self.limit = get_current_range_limit(context['current_range'])
+        self.step_time = get_potential_step_time(context['param'])
+        self.window_size = max(2, int(settings.window_sec * context['sample_rate']))
+        self.saturation_size = max(1, int(settings.saturation_sec * context['sample_rate']))
+
+        self.samples_count = 0
+        self.charge = 0.0
+        self.last_t = None
+        self.last_curr = None
+        # ring buffer of the last window_size samples and their running sums, rolling mean and variance are
+        # updated from the samples which enter and leave the window, slots which weren't filled yet are zeros
+        self.window = np.zeros(self.window_size)
+        self.window_position = 0
+        self.window_count = 0
+        self.window_sum = 0.0
+        self.window_sum_squares = 0.0
+        self.window_end_t = None
+        self.saturated_count = 0
+        # sums of the Cottrell fit, x = 1 / sqrt(t - step time), y = current
+        self.fit_sums = np.zeros(6)
+        self.anomalies = []
+
+    def add(self, t, volt, curr):
+        """
+            Adds the chunk of samples, returns the first new fatal anomaly found in it or None.
+        """
+        if len(t) == 0:
+            return None
+        t = np.asarray(t, dtype=float)
+        curr = np.asarray(curr, dtype=float)
+
+        if self.last_t is not None:
+            self.charge += (t[0] - self.last_t) * (curr[0] + self.last_curr) / 2.0
+        self.charge += float(np.dot(np.diff(t), (curr[1:] + curr[:-1]) / 2.0))
+        self.last_t = float(t[-1])
+        self.last_curr = float(curr[-1])
+        self.samples_count += len(t)
+
+        self.add_to_window(curr)
+        self.window_end_t = self.last_t
+
+        elapsed = t - self.step_time
+        fitted = elapsed >= COTTRELL_MIN_TIME_SEC
+        if fitted.any():
+            x = 1.0 / np.sqrt(elapsed[fitted])
+            y = curr[fitted]
+            self.fit_sums += (len(x), x.sum(), y.sum(), np.dot(x, x), np.dot(x, y), np.dot(y, y))
+
+        anomaly = self.find_saturation(t, curr)
+        if anomaly is None:
+            anomaly = self.find_open_circuit()
+        # every kind of anomaly is reported once
+        if anomaly is None or any(found.kind == anomaly.kind for found in self.anomalies):
+            return None
+        self.anomalies.append(anomaly)
+        return anomaly
+
+    def add_to_window(self, curr):
+        if len(curr) >= self.window_size:
+            self.window[:] = curr[-self.window_size:]
+            self.window_position = 0
+            self.window_count = self.window_size
+            self.update_window_sums()
+            return
+        indexes = (self.window_position + np.arange(len(curr))) % self.window_size
+        left = self.window[indexes]
+        self.window_sum += float(curr.sum() - left.sum())
+        self.window_sum_squares += float(np.dot(curr, curr) - np.dot(left, left))
+        self.window[indexes] = curr
+        self.window_count = min(self.window_count + len(curr), self.window_size)
+        position = self.window_position + len(curr)
+        self.window_position = position % self.window_size
+        if position >= self.window_size:
+            # the sums are taken again once per window, so rounding errors of the updates don't pile up
+            self.update_window_sums()
+
+    def update_window_sums(self):
+        self.window_sum = float(self.window.sum())
+        self.window_sum_squares = float(np.dot(self.window, self.window))
+
+    def find_saturation(self, t, curr):
+        # saturated runs are counted across chunks, the anomaly is reported at the sample which completes one
+        is_saturated = np.abs(curr) >= self.settings.saturation_fraction * self.limit
+        unsaturated_indexes = np.flatnonzero(~is_saturated)
+        # length of the saturated run ending at every sample
+        run_starts = np.full(len(curr), -1)
+        run_starts[unsaturated_indexes] = unsaturated_indexes
+        run_lengths = np.arange(len(curr)) - np.maximum.accumulate(run_starts)
+        if len(unsaturated_indexes):
+            run_lengths[:unsaturated_indexes[0]] += self.saturated_count
+        else:
+            run_lengths += self.saturated_count
+        self.saturated_count = int(run_lengths[-1])
+
+        completed_indexes = np.flatnonzero(run_lengths >= self.saturation_size)
+        if len(completed_indexes) == 0:
+            return None
+        index = completed_indexes[0]
+        return Anomaly(ANOMALY_SATURATION, float(t[index]),
+                       f'current reached the {self.limit:g} uA range limit at {t[index]:.2f} s')
+
+    def find_open_circuit(self):
+        if self.window_count < self.window_size or self.window_end_t - self.step_time < self.settings.settle_sec + \
+                self.settings.window_sec:
+            return None
+        mean, _ = self.get_rolling_statistics()
+        threshold = self.settings.open_circuit_fraction * self.limit
+        if abs(mean) >= threshold:
+            return None
+        return Anomaly(ANOMALY_OPEN_CIRCUIT, self.window_end_t,
+                       f'mean current {mean:.4f} uA is below {threshold:g} uA at {self.window_end_t:.2f} s, '
+                       f'the cell seems to be disconnected')
+
+    def get_rolling_statistics(self):
+        if self.window_count == 0:
+            return math.nan, math.nan
+        mean = self.window_sum / self.window_count
+        return mean, max(self.window_sum_squares / self.window_count - mean * mean, 0.0)
+
+    def get_cottrell_fit(self):
+        """
+            Returns (coefficient, offset, relative RMS residual) of the Cottrell fit, NaN before two samples are fitted.
+        """
+        n, sum_x, sum_y, sum_xx, sum_xy, sum_yy = self.fit_sums
+        determinant = n * sum_xx - sum_x * sum_x
+        if n < 2 or determinant <= 0.0:
+            return math.nan, math.nan, math.nan
+        coefficient = (n * sum_xy - sum_x * sum_y) / determinant
+        offset = (sum_y - coefficient * sum_x) / n
+        squared_error = sum_yy - 2.0 * coefficient * sum_xy - 2.0 * offset * sum_y + \
+            coefficient * coefficient * sum_xx + 2.0 * coefficient * offset * sum_x + offset * offset * n
+        mean_abs_curr = abs(sum_y / n)
+        residual = math.sqrt(max(squared_error, 0.0) / n) / mean_abs_curr if mean_abs_curr > 0.0 else math.nan
+        return float(coefficient), float(offset), float(residual)
+
+    def get_result(self):
+        mean, variance = self.get_rolling_statistics()
+        coefficient, offset, residual = self.get_cottrell_fit()
+        anomalies = list(self.anomalies)
+        if residual > self.settings.max_cottrell_residual and \
+                not any(anomaly.kind == ANOMALY_IRREGULAR_DECAY for anomaly in anomalies):
+            anomalies.append(Anomaly(ANOMALY_IRREGULAR_DECAY, self.last_t,
+                                     f'current doesn\'t follow Cottrell decay, relative residual {residual:.2f}'))
+        return {
+            'charge': float(self.charge),
+            'mean_current': mean,
+            'current_std': math.nan if math.isnan(variance) else math.sqrt(variance),
+            'cottrell_coefficient': coefficient,
+            'cottrell_offset': offset,
+            'cottrell_residual': residual,
+            'anomalies': [anomaly.kind for anomaly in anomalies],
+        }
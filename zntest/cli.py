@@ -0,0 +1,384 @@
+import argparse
+import os
+import sys
+import time
+from datetime import datetime
+
+import zntest.instrumentation as instrumentation
+import zntest.recipe as recipe
+import zntest.store as store
+import zntest.streaming as streaming
+import zntest.utils as utils
+from zntest.devices import DeviceManager
+from zntest.devicestate import get_savings, get_savings_difference
+
+
+def print_message(message):
+    print('[{}]\t{}'.format(datetime.now().strftime("%H:%M:%S"), message))
+
+
+def connect_device(port):
+    device_manager = DeviceManager()
+    if port is not None:
+        pstat = device_manager.connect(port)
+        if pstat is None:
+            raise RuntimeError(f'Unable to initialize potentiostat on port {port}')
+        return pstat
+
+    # only ports of potentiostat boards are probed, other serial devices aren't written to
+    found_ports = device_manager.probe_ports(utils.get_potentiostat_ports())
+    if not found_ports:
+        raise RuntimeError('No potentiostats are found')
+    # the first found potentiostat is used, the others are closed, so they stay free for other instances
+    for port in found_ports[1:]:
+        device_manager.disconnect(port)
+    return device_manager.get(found_ports[0])
+
+
+def run_command(args):
+    from zntest.chronoamperometry import DepositionAbortedError
+
+    test_recipe = recipe.load_recipe(args.recipe)
+    samples = get_samples(args, test_recipe)
+    if not samples:
+        raise ValueError('There are no samples to run, use --compound, --batch or recipe "samples"')
+
+    # every context is validated before the first test starts
+    sequences = [(compound, recipe.create_sequence_contexts(test_recipe, compound)) for compound in samples]
+    pstat = connect_device(args.port or test_recipe.get('port'))
+    for _, contexts in sequences:
+        for _, context in contexts:
+            context['device'] = pstat.port
+
+    aborted_compounds = []
+    for sample_index, (compound, contexts) in enumerate(sequences):
+        print_message(f'Sample {sample_index + 1}/{len(sequences)}: {compound}')
+        initial_savings = get_savings(pstat)
+        for kind, context in contexts:
+            try:
+                result = utils.RUN_TEST_FUNS[kind](pstat, context)
+            except DepositionAbortedError as e:
+                # the aborted run is kept as a partial run, the batch goes on with the next sample
+                print_message(f'{e}, the remaining steps of {compound} are skipped')
+                aborted_compounds.append(compound)
+                break
+            print_message(f'{context["title"]}: {result.samples_count} samples, run #{result.run_id}')
+        savings = get_savings_difference(get_savings(pstat), initial_savings)
+        print_message(f'{savings.sent_count} device settings sent, {savings.skipped_count} unchanged skipped, '
+                      f'{savings.saved_sec * 1e3:.0f} ms saved')
+        print()
+    if aborted_compounds:
+        print_message(f'{len(aborted_compounds)} of {len(sequences)} samples are aborted: '
+                      f'{", ".join(aborted_compounds)}')
+        return 1
+    return 0
+
+
+def get_samples(args, test_recipe):
+    if args.compound:
+        return args.compound
+    if args.batch:
+        return recipe.load_batch_samples(args.batch)
+    return recipe.get_recipe_samples(test_recipe)
+
+
+def queue_add_command(args):
+    from zntest.jobs import JobQueue
+
+    test_recipe = recipe.load_recipe(args.recipe)
+    samples = get_samples(args, test_recipe)
+    if not samples:
+        raise ValueError('There are no samples to queue, use --compound, --batch or recipe "samples"')
+    jobs_contexts = [(compound, recipe.create_sequence_contexts(test_recipe, compound)) for compound in samples]
+    job_queue = JobQueue(args.queue)
+    for compound, contexts in jobs_contexts:
+        job_queue.add_job(compound, contexts, os.path.basename(args.recipe))
+    print(f'{len(jobs_contexts)} jobs are queued')
+    return 0
+
+
+def queue_run_command(args):
+    from zntest.jobs import JobQueue, run_job
+
+    job_queue = JobQueue(args.queue)
+    pstat = connect_device(args.port)
+    started_at = time.time()
+
+    def on_step_finished(job, step, context, result):
+        print_message(f'Job #{job.id} {job.compound}: {context["title"]}: {result.samples_count} samples, '
+                      f'run #{result.run_id}')
+
+    while True:
+        job = job_queue.claim_next_job(pstat.port)
+        if job is None:
+            break
+        initial_savings = get_savings(pstat)
+        run_job(job_queue, job, pstat, pstat.port, on_step_finished=on_step_finished)
+        savings = get_savings_difference(get_savings(pstat), initial_savings)
+        print_message(f'Job #{job.id}: {savings.skipped_count} unchanged device settings skipped, '
+                      f'{savings.saved_sec * 1e3:.0f} ms saved')
+
+    throughput = job_queue.get_throughput(since=started_at)
+    print_message(f'The queue is empty: {throughput.steps_count} steps, {throughput.samples_count} samples, '
+                  f'{throughput.samples_per_hour:.0f} samples/hour in steps, '
+                  f'{throughput.wall_samples_per_hour:.0f} samples/hour overall')
+    return 0
+
+
+def queue_status_command(args):
+    from zntest.jobs import JobQueue
+
+    job_queue = JobQueue(args.queue)
+    if args.retry_failed:
+        print(f'{job_queue.retry_failed_jobs()} failed jobs are queued again')
+    if args.clear:
+        print(f'{job_queue.clear()} finished jobs are removed')
+    for status, count in sorted(job_queue.count_jobs().items()):
+        print(f'{status}: {count} jobs')
+    throughput = job_queue.get_throughput()
+    if throughput.steps_count:
+        print(f'{throughput.steps_count} steps, {throughput.samples_count} samples, '
+              f'{throughput.busy_sec / 3600.0:.2f} h in steps of {throughput.wall_sec / 3600.0:.2f} h, '
+              f'{throughput.samples_per_hour:.0f} samples/hour in steps, '
+              f'{throughput.wall_samples_per_hour:.0f} samples/hour overall')
+    return 0
+
+
+def import_database_command(args):
+    run_store = store.RunStore(args.store)
+    for database_file_path in args.database:
+        imported_run_ids = store.import_database_csv(run_store, database_file_path, args.kind)
+        print(f'{len(imported_run_ids)} runs are imported from {database_file_path}')
+    return 0
+
+
+def analyze_command(args):
+    import zntest.analysis as analysis
+
+    run_store = store.RunStore(args.store)
+    runs = run_store.find_runs(compound=args.compound, kind=recipe.SQUARE_WAVE_VOLTAMMETRY_TEST_KIND)
+    started_at = time.perf_counter()
+    # runs which can't be analyzed, e.g. truncated ones, are left out and reported
+    errors = {}
+    if args.window is None:
+        results = analysis.analyze_stored_runs(run_store, [run.id for run in runs],
+                                               calibration=analysis.load_calibration(args.calibration),
+                                               errors=errors)
+    else:
+        import zntest.squarewave as squarewave
+
+        # currents of pulse resolved runs are reconstructed with the window, the results aren't stored,
+        # runs processed by the device can't be reconstructed and are left out
+        reconstructed = squarewave.reconstruct_stored_runs(run_store, [run.id for run in runs], args.window,
+                                                           calibration=analysis.load_calibration(args.calibration),
+                                                           errors=errors)
+        results = [item[1] if item is not None else None for item in reconstructed]
+    runs, results = [run for run, result in zip(runs, results) if result is not None], \
+        [result for result in results if result is not None]
+    elapsed = time.perf_counter() - started_at
+    for run_id, error in errors.items():
+        print(f'Run #{run_id} is skipped: {error}', file=sys.stderr)
+
+    print('run_id,compound,started_at,' + ','.join(analysis.RESULT_FIELDS))
+    for run, result in zip(runs, results):
+        print(f'{run.id},{run.compound},{run.started_at.isoformat()},' +
+              ','.join(f'{result[field]:.6g}' for field in analysis.RESULT_FIELDS))
+    print(f'{len(runs)} runs are analyzed in {elapsed:.2f} s', file=sys.stderr)
+    return 0
+
+
+def calibrate_command(args):
+    import zntest.analysis as analysis
+    import zntest.squarewave as squarewave
+
+    run_store = store.RunStore(args.store)
+    concentrations = []
+    peak_heights = []
+    for standard in args.standards:
+        run_id, concentration = standard.split('=')
+        run = run_store.load_run(int(run_id))
+        try:
+            voltammogram = squarewave.get_voltammogram(run)
+        except ValueError as e:
+            print_message(f'Run #{run_id} is skipped: {e}')
+            continue
+        concentrations.append(float(concentration))
+        peak_heights.append(analysis.analyze_square_wave_voltammetry(*voltammogram)['peak_height'])
+    if len(concentrations) < 2:
+        raise ValueError('At least two standards are needed for calibration')
+
+    calibration = analysis.fit_calibration(concentrations, peak_heights, args.unit)
+    analysis.save_calibration(calibration, args.calibration)
+    print(f'Calibration: peak height = {calibration.slope:.6g} * concentration ({calibration.unit}) + '
+          f'{calibration.intercept:.6g}')
+    return 0
+
+
+def reanalyze_command(args):
+    import zntest.analysis as analysis
+    import zntest.reanalysis as reanalysis
+
+    started_at = time.perf_counter()
+    analyzed_count, skipped_count = reanalysis.reanalyze(args.output, args.workers, args.chunk_size, args.force,
+                                                         analysis.load_calibration(args.calibration))
+    elapsed = time.perf_counter() - started_at
+    files_count = analyzed_count + skipped_count
+    print(f'{analyzed_count} files are analyzed, {skipped_count} unchanged files are skipped in {elapsed:.2f} s '
+          f'({files_count / max(elapsed, 1e-9):.1f} files/s)', file=sys.stderr)
+    return 0
+
+
+def export_csv_command(args):
+    import zntest.runfile as runfile
+
+    for run_file_path in args.run_file:
+        csv_path = None
+        if args.output_folder:
+            csv_path = os.path.join(args.output_folder,
+                                    os.path.splitext(os.path.basename(run_file_path))[0] + '.csv')
+        print(f'{run_file_path} is exported to {runfile.export_csv(run_file_path, csv_path)}')
+    return 0
+
+
+def export_parquet_command(args):
+    import zntest.parquet as parquet
+
+    run_store = store.RunStore(args.store)
+    exporter = parquet.ParquetExporter(args.output)
+    started_at = time.perf_counter()
+    runs_count, files_count = exporter.export(run_store, args.compound, args.kind,
+                                              datetime.fromisoformat(args.since) if args.since else None)
+    print(f'{runs_count} runs are exported to {files_count} files of {exporter.folder} in '
+          f'{time.perf_counter() - started_at:.2f} s')
+    return 0
+
+
+def timings_command(args):
+    for report in instrumentation.read_run_reports(args.trace_file):
+        effective_sample_rate = report['effective_sample_rate']
+        print(f'{report["started_at"]}  {report["title"]} ({report["compound"]}, {report["device"]}): '
+              f'{report["duration_sec"]:.2f} s, {report["samples_count"]} samples, sample rate '
+              f'{"-" if effective_sample_rate is None else format(effective_sample_rate, ".2f")} '
+              f'of {report["requested_sample_rate"]} Hz' + (f', error: {report["error"]}' if report['error'] else ''))
+        for name, phase in sorted(report['phases'].items(), key=lambda item: -item[1]['total_sec']):
+            print(f'    {name:<16}{phase["total_sec"]:10.3f} s{phase["count"]:8d} x, '
+                  f'max {phase["max_sec"] * 1e3:.1f} ms')
+        for name, value in report['counters'].items():
+            print(f'    {name:<24}{value:12d}')
+    return 0
+
+
+def create_parser():
+    parser = argparse.ArgumentParser(prog='python -m zntest', description='Zn test without GUI')
+    parser.add_argument('--trace', help=f'append JSON lines with phase timings of every run to this file, '
+                                        f'{instrumentation.TRACE_PATH_VARIABLE} environment variable by default')
+    parser.add_argument('--profile', help=f'save cProfile stats of every run into this folder, '
+                                          f'{instrumentation.PROFILE_FOLDER_VARIABLE} environment variable by default')
+    parser.add_argument('--serve', metavar='[HOST:]PORT', default=os.environ.get(streaming.STREAMING_SERVER_VARIABLE),
+                        help=f'stream live samples and step events and serve stored runs over HTTP at this address, '
+                             f'{streaming.STREAMING_SERVER_VARIABLE} environment variable by default')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help='run Zn test sequence for every sample')
+    run_parser.add_argument('recipe', help='recipe JSON file')
+    run_parser.add_argument('--port', help='potentiostat port, the first found potentiostat is used by default')
+    samples_group = run_parser.add_mutually_exclusive_group()
+    samples_group.add_argument('--compound', action='append', help='sample compound, can be repeated')
+    samples_group.add_argument('--batch', help='text file with one sample compound per line')
+    run_parser.set_defaults(command_fun=run_command)
+
+    queue_parser = subparsers.add_parser('queue', help='persistent job queue for unattended runs')
+    queue_subparsers = queue_parser.add_subparsers(dest='queue_command', required=True)
+
+    queue_add_parser = queue_subparsers.add_parser('add', help='queue Zn test sequence of every sample')
+    queue_add_parser.add_argument('recipe', help='recipe JSON file')
+    queue_samples_group = queue_add_parser.add_mutually_exclusive_group()
+    queue_samples_group.add_argument('--compound', action='append', help='sample compound, can be repeated')
+    queue_samples_group.add_argument('--batch', help='text file with one sample compound per line')
+    queue_add_parser.add_argument('--queue', help='job queue path, data/jobs.sqlite3 by default')
+    queue_add_parser.set_defaults(command_fun=queue_add_command)
+
+    queue_run_parser = queue_subparsers.add_parser('run', help='run queued jobs until the queue is empty')
+    queue_run_parser.add_argument('--port', help='potentiostat port, the first found potentiostat is used by default')
+    queue_run_parser.add_argument('--queue', help='job queue path, data/jobs.sqlite3 by default')
+    queue_run_parser.set_defaults(command_fun=queue_run_command)
+
+    queue_status_parser = queue_subparsers.add_parser('status', help='print job counts and throughput')
+    queue_status_parser.add_argument('--retry-failed', action='store_true', help='queue failed jobs again')
+    queue_status_parser.add_argument('--clear', action='store_true', help='remove finished and failed jobs')
+    queue_status_parser.add_argument('--queue', help='job queue path, data/jobs.sqlite3 by default')
+    queue_status_parser.set_defaults(command_fun=queue_status_command)
+
+    import_parser = subparsers.add_parser('import-database', help='import legacy database.csv files into run store')
+    import_parser.add_argument('kind', choices=(recipe.CONSTANT_VOLTAGE_TEST_KIND,
+                                                recipe.SQUARE_WAVE_VOLTAMMETRY_TEST_KIND))
+    import_parser.add_argument('database', nargs='+', help='database.csv file')
+    import_parser.add_argument('--store', help='run store path, data/out/runs.sqlite3 by default')
+    import_parser.set_defaults(command_fun=import_database_command)
+
+    analyze_parser = subparsers.add_parser('analyze', help='find Zn peak of stored square wave voltammetry runs')
+    analyze_parser.add_argument('--compound', help='analyze runs of this compound only')
+    analyze_parser.add_argument('--store', help='run store path, data/out/runs.sqlite3 by default')
+    analyze_parser.add_argument('--calibration', help='calibration file, data/calibration.json by default')
+    analyze_parser.add_argument('--window', type=float,
+                                help='reconstruct currents of pulse resolved runs averaging this fraction of every '
+                                     'half period')
+    analyze_parser.set_defaults(command_fun=analyze_command)
+
+    calibrate_parser = subparsers.add_parser('calibrate', help='fit calibration curve from standards runs')
+    calibrate_parser.add_argument('standards', nargs='+', metavar='RUN_ID=CONCENTRATION',
+                                  help='stored square wave voltammetry run of a standard and its concentration')
+    calibrate_parser.add_argument('--unit', default='ppb', help='concentration unit, ppb by default')
+    calibrate_parser.add_argument('--store', help='run store path, data/out/runs.sqlite3 by default')
+    calibrate_parser.add_argument('--calibration', help='calibration file, data/calibration.json by default')
+    calibrate_parser.set_defaults(command_fun=calibrate_command)
+
+    reanalyze_parser = subparsers.add_parser('reanalyze', help='analyze every per-run CSV file of the output folder')
+    reanalyze_parser.add_argument('--output', help='output folder, data/out by default')
+    reanalyze_parser.add_argument('--workers', type=int, help='number of worker processes, CPU count by default')
+    reanalyze_parser.add_argument('--chunk-size', type=int, help='files sent to a worker at once')
+    reanalyze_parser.add_argument('--force', action='store_true', help='ignore cached results')
+    reanalyze_parser.add_argument('--calibration', help='calibration file, data/calibration.json by default')
+    reanalyze_parser.set_defaults(command_fun=reanalyze_command)
+
+    export_parser = subparsers.add_parser('export-csv', help='convert binary run files to CSV')
+    export_parser.add_argument('run_file', nargs='+', help='.zrun run file')
+    export_parser.add_argument('--output-folder', help='CSV files folder, the run file folder by default')
+    export_parser.set_defaults(command_fun=export_csv_command)
+
+    parquet_parser = subparsers.add_parser('export-parquet',
+                                           help='add stored runs, which aren\'t exported yet, to Parquet datasets '
+                                                'partitioned by kind, compound and date')
+    parquet_parser.add_argument('--store', help='run store path, data/out/runs.sqlite3 by default')
+    parquet_parser.add_argument('--output', help='datasets folder, data/export by default')
+    parquet_parser.add_argument('--compound', help='export runs of this compound only')
+    parquet_parser.add_argument('--kind', choices=(recipe.CONSTANT_VOLTAGE_TEST_KIND,
+                                                   recipe.SQUARE_WAVE_VOLTAMMETRY_TEST_KIND),
+                                help='export runs of this kind only')
+    parquet_parser.add_argument('--since', help='export runs started at this ISO date or time or later')
+    parquet_parser.set_defaults(command_fun=export_parquet_command)
+
+    timings_parser = subparsers.add_parser('timings', help='print per-run timing report of a trace file')
+    timings_parser.add_argument('trace_file', help='JSON lines file written with --trace')
+    timings_parser.set_defaults(command_fun=timings_command)
+
+    return parser
+
+
+def main(argv=None):
+    args = create_parser().parse_args(argv)
+    if args.trace or args.profile:
+        instrumentation.configure(args.trace or os.path.join(args.profile, 'trace.jsonl'), args.profile)
+    try:
+        if args.serve:
+            server = streaming.start_server(*streaming.parse_address(args.serve))
+            print_message(f'Streaming live data at http://{server.host}:{server.port}/live')
+        return args.command_fun(args)
+    except (ValueError, RuntimeError, OSError) as e:
+        print(f'Error: {e}', file=sys.stderr)
+        return 1
+    except KeyboardInterrupt:
+        print('Interrupted', file=sys.stderr)
+        return 130
+    finally:
+        streaming.stop_server()
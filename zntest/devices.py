@@ -0,0 +1,89 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import zntest.utils as utils
+from zntest.devicestate import DeviceStateShadow
+
+MAX_PROBE_WORKERS = 16
+
+
+class DeviceManager:
+    """
+        Class keeping a pool of connected potentiostats keyed by their ports.
+        Ports are probed concurrently, so probing N ports takes about as long as probing the slowest one.
+        When a discovery service is given, potentiostats it has already opened are taken over without probing.
+        Every opened potentiostat is wrapped into DeviceStateShadow, so unchanged settings aren't sent again,
+        a reconnected port gets a new shadow.
+    """
+
+    def __init__(self, discovery=None):
+        self.lock = threading.Lock()
+        self.devices = {}
+        self.discovery = discovery
+
+    def get_ports(self):
+        with self.lock:
+            return sorted(self.devices)
+
+    def get(self, port):
+        with self.lock:
+            return self.devices[port]
+
+    def add(self, port, pstat):
+        with self.lock:
+            self.devices[port] = pstat
+
+    def connect(self, port):
+        with self.lock:
+            if port in self.devices:
+                return self.devices[port]
+        pstat = self.open(port)
+        if pstat is not None:
+            self.add(port, pstat)
+        return pstat
+
+    def open(self, port):
+        pstat = None
+        if self.discovery is not None:
+            pstat = self.discovery.take_handle(port)
+        if pstat is None:
+            pstat = utils.connect(port)
+        if pstat is None and self.discovery is not None:
+            self.discovery.release(port)
+        return DeviceStateShadow(pstat) if pstat is not None else None
+
+    def probe_ports(self, ports=None):
+        """
+            Connects to every given port (all potentiostat ports by default, see utils.list_available_ports)
+            which isn't in the pool yet and returns the ports where potentiostats were found.
+        """
+        if ports is None and self.discovery is not None:
+            ports = [port for port in self.discovery.get_ports() if not self.discovery.has_no_device(port)]
+        elif ports is None:
+            ports = utils.get_potentiostat_ports()
+        with self.lock:
+            new_ports = [port for port in ports if port not in self.devices]
+        if not new_ports:
+            return []
+
+        with ThreadPoolExecutor(max_workers=min(MAX_PROBE_WORKERS, len(new_ports))) as executor:
+            connected = list(zip(new_ports, executor.map(self.open, new_ports)))
+
+        found_ports = []
+        for port, pstat in connected:
+            if pstat is not None:
+                self.add(port, pstat)
+                found_ports.append(port)
+        return found_ports
+
+    def disconnect(self, port):
+        with self.lock:
+            pstat = self.devices.pop(port, None)
+        if pstat is not None:
+            pstat.close()
+        if self.discovery is not None:
+            self.discovery.release(port)
+
+    def disconnect_all(self):
+        for port in self.get_ports():
+            self.disconnect(port)
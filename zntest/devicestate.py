@@ -0,0 +1,102 @@
+import time
+from collections import namedtuple
+
+import zntest.instrumentation as instrumentation
+
+ShadowSavings = namedtuple('ShadowSavings', ['sent_count', 'skipped_count', 'saved_sec'])
+
+
+def get_sample_period(sample_rate):
+    # the same conversion as Potentiostat.set_sample_rate does, rates of the same period are the same setting
+    return int(1.0e3 / sample_rate)
+
+
+class DeviceStateShadow:
+    """
+        Class wrapping a potentiostat handle and keeping the last settings confirmed by the device.
+        Setting a value the device already has is answered from the shadow without a serial round-trip.
+        The shadow is cleared when a command fails, the serial port is reopened or invalidate is called,
+        e.g. after a test was interrupted, so a setting is never skipped unless the device surely has it.
+        Every other attribute is the attribute of the wrapped handle.
+    """
+
+    def __init__(self, pstat):
+        self.pstat = pstat
+        # setting key: (requested value, response of the device)
+        self.settings = {}
+        # setting key: duration of its last round-trip, used to estimate the time saved by skipping it
+        self.round_trip_secs = {}
+        self.sent_count = 0
+        self.skipped_count = 0
+        self.saved_sec = 0.0
+
+    def __getattr__(self, name):
+        return getattr(self.pstat, name)
+
+    def invalidate(self):
+        self.settings.clear()
+
+    def get_savings(self):
+        return ShadowSavings(self.sent_count, self.skipped_count, self.saved_sec)
+
+    def set_setting(self, key, value, set_fun, is_confirmed_fun=None):
+        if key in self.settings and self.settings[key][0] == value:
+            self.skipped_count += 1
+            self.saved_sec += self.round_trip_secs.get(key, 0.0)
+            instrumentation.count('skipped_device_commands', 1)
+            return self.settings[key][1]
+
+        self.settings.pop(key, None)
+        started_at = time.perf_counter()
+        try:
+            response = set_fun()
+        except BaseException:
+            # the command may or may not have reached the device
+            self.invalidate()
+            raise
+        self.round_trip_secs[key] = time.perf_counter() - started_at
+        self.sent_count += 1
+        if is_confirmed_fun is None or is_confirmed_fun(response):
+            self.settings[key] = (value, response)
+        return response
+
+    def set_curr_range(self, curr_range):
+        return self.set_setting('curr_range', curr_range, lambda: self.pstat.set_curr_range(curr_range),
+                                lambda response: response == curr_range)
+
+    def set_volt_range(self, volt_range):
+        return self.set_setting('volt_range', volt_range, lambda: self.pstat.set_volt_range(volt_range))
+
+    def set_sample_period(self, sample_period):
+        return self.set_setting('sample_period', int(sample_period),
+                                lambda: self.pstat.set_sample_period(sample_period))
+
+    def set_sample_rate(self, sample_rate):
+        return self.set_setting('sample_period', get_sample_period(sample_rate),
+                                lambda: self.pstat.set_sample_rate(sample_rate))
+
+    def set_param(self, test_name, param):
+        return self.set_setting(('param', test_name), dict(param), lambda: self.pstat.set_param(test_name, param))
+
+    def open(self):
+        self.invalidate()
+        return self.pstat.open()
+
+    def close(self):
+        self.invalidate()
+        return self.pstat.close()
+
+
+def invalidate_device_state(pstat):
+    if isinstance(pstat, DeviceStateShadow):
+        pstat.invalidate()
+
+
+def get_savings(pstat):
+    if isinstance(pstat, DeviceStateShadow):
+        return pstat.get_savings()
+    return ShadowSavings(0, 0, 0.0)
+
+
+def get_savings_difference(savings, previous_savings):
+    return ShadowSavings(*(value - previous_value for value, previous_value in zip(savings, previous_savings)))
@@ -0,0 +1,180 @@
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import zntest.utils as utils
+
+DEVICE_INFO_TTL_SEC = 60.0
+SCAN_INTERVAL_SEC = 2.0
+PROBE_TIMEOUT_SEC = 3.0
+MAX_PROBE_WORKERS = 16
+
+DeviceInfo = namedtuple('DeviceInfo', ['port', 'firmware_version', 'current_ranges', 'probed_at'])
+
+
+class DiscoveryService:
+    """
+        Class discovering potentiostats in the background.
+        Serial ports are enumerated every SCAN_INTERVAL_SEC, so plugged and unplugged devices are noticed
+        without user actions. New ports and ports whose cached result is older than ttl are probed in parallel
+        when their USB ids or description are the ones of a potentiostat board (see utils.list_available_ports),
+        every serial read of a probe is bounded by PROBE_TIMEOUT_SEC. Ports are opened locked (see utils.connect),
+        so ports used by another application instance are skipped without writing to them. Potentiostat handles
+        opened by probes are kept, so connecting to a discovered device doesn't open and query the port again,
+        and when their result expires they are queried again instead of being reopened.
+    """
+
+    def __init__(self, ttl=DEVICE_INFO_TTL_SEC, scan_interval=SCAN_INTERVAL_SEC, probe_timeout=PROBE_TIMEOUT_SEC):
+        self.ttl = ttl
+        self.scan_interval = scan_interval
+        self.probe_timeout = probe_timeout
+
+        # the condition notifies about finished probes
+        self.lock = threading.Condition()
+        self.ports = []
+        self.potentiostat_ports = set()
+        self.devices = {}
+        self.handles = {}
+        self.probed_at = {}
+        self.probing_ports = set()
+        self.claimed_ports = set()
+
+        self.executor = ThreadPoolExecutor(max_workers=MAX_PROBE_WORKERS)
+        self.scan_requested = threading.Event()
+        self.stop_requested = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_requested.set()
+        self.scan_requested.set()
+        if self.thread is not None:
+            self.thread.join()
+        self.executor.shutdown(wait=False)
+        with self.lock:
+            handles = list(self.handles.values())
+            self.handles = {}
+        for pstat in handles:
+            pstat.close()
+
+    def request_scan(self):
+        self.scan_requested.set()
+
+    def run(self):
+        while not self.stop_requested.is_set():
+            self.scan()
+            self.scan_requested.wait(self.scan_interval)
+            self.scan_requested.clear()
+
+    def scan(self):
+        available_ports = utils.list_available_ports()
+        ports = [port for port, _ in available_ports]
+        now = time.monotonic()
+        with self.lock:
+            self.ports = ports
+            self.potentiostat_ports = {port for port, is_potentiostat in available_ports if is_potentiostat}
+            for port in set(self.probed_at) - self.potentiostat_ports:
+                self.forget(port)
+            ports_to_probe = [port for port, is_potentiostat in available_ports
+                              if is_potentiostat and self.is_probe_needed(port, now)]
+            self.probing_ports.update(ports_to_probe)
+
+        futures = [self.executor.submit(self.probe, port) for port in ports_to_probe]
+        if futures:
+            # probes which don't finish in time keep running and store their results when they are done
+            wait(futures, timeout=self.probe_timeout)
+
+    def is_probe_needed(self, port, now):
+        if port in self.probing_ports or port in self.claimed_ports:
+            return False
+        return port not in self.probed_at or now - self.probed_at[port] > self.ttl
+
+    def forget(self, port):
+        self.devices.pop(port, None)
+        self.probed_at.pop(port, None)
+        self.claimed_ports.discard(port)
+        pstat = self.handles.pop(port, None)
+        if pstat is not None:
+            pstat.close()
+
+    def probe(self, port):
+        with self.lock:
+            pstat = self.handles.pop(port, None)
+        # the handle of the last probe keeps the port locked, it is kept while the device answers through it
+        info = self.read_device_info(port, pstat) if pstat is not None else None
+        if info is None:
+            try:
+                pstat = utils.connect(port, timeout=self.probe_timeout)
+            except Exception:
+                # anything else than a potentiostat may answer
+                pstat = None
+            info = self.read_device_info(port, pstat) if pstat is not None else None
+            if info is None:
+                pstat = None
+
+        with self.lock:
+            self.probing_ports.discard(port)
+            self.probed_at[port] = time.monotonic()
+            self.lock.notify_all()
+            if info is not None and port in self.ports and not self.stop_requested.is_set():
+                self.devices[port] = info
+                self.handles[port] = pstat
+                return
+            self.devices.pop(port, None)
+        if pstat is not None:
+            pstat.close()
+
+    @staticmethod
+    def read_device_info(port, pstat):
+        """
+            Returns DeviceInfo of the opened potentiostat, None when it doesn't answer, then it is closed.
+        """
+        try:
+            # the current range is queried, so the device answers even when the other values are cached
+            pstat.get_curr_range()
+            return DeviceInfo(port, pstat.get_firmware_version(), pstat.get_all_curr_range(), time.time())
+        except Exception:
+            pstat.close()
+            return None
+
+    def get_ports(self):
+        # ports with discovered potentiostats go first
+        with self.lock:
+            return sorted(self.ports, key=lambda port: (port not in self.devices, port))
+
+    def get_devices(self):
+        with self.lock:
+            return [self.devices[port] for port in sorted(self.devices)]
+
+    def get_device_info(self, port):
+        with self.lock:
+            return self.devices.get(port)
+
+    def has_no_device(self, port):
+        # True when the port isn't a potentiostat board or it was probed recently and no potentiostat answered
+        with self.lock:
+            if port not in self.potentiostat_ports:
+                return True
+            return port in self.probed_at and port not in self.devices and port not in self.probing_ports
+
+    def take_handle(self, port):
+        """
+            Claims the port for the caller, so it isn't probed until it is released, and hands over
+            the potentiostat opened by the last probe. Returns None when there is no opened potentiostat,
+            then the caller has to connect by itself. It waits for the running probe of the port,
+            so it isn't called from the Tk thread.
+        """
+        with self.lock:
+            self.claimed_ports.add(port)
+            self.lock.wait_for(lambda: port not in self.probing_ports, timeout=self.probe_timeout)
+            return self.handles.pop(port, None)
+
+    def release(self, port):
+        with self.lock:
+            self.claimed_ports.discard(port)
+            self.probed_at.pop(port, None)
+        self.request_scan()
@@ -1,8 +1,31 @@
+import importlib
+import queue
+import threading
+import time
+from datetime import datetime
 from tkinter import *
 from tkinter import messagebox
 from tkinter.ttk import *
 
+import zntest.instrumentation as instrumentation
+import zntest.recipe as recipe
+import zntest.store as store
 import zntest.utils as utils
+from zntest.devices import DeviceManager
+from zntest.discovery import DiscoveryService
+from zntest.jobs import JOB_STATUS_DONE, JOB_STATUS_FAILED, JOB_STATUS_PENDING, JobQueue
+from zntest.worker import AcquisitionWorker, STEP_STARTED, STEP_SAMPLES, STEP_FINISHED, SEQUENCE_FINISHED, \
+    SEQUENCE_CANCELLED, SEQUENCE_FAILED
+
+
+# modules which aren't needed to show the window, they are imported in the background after it is shown
+WARM_UP_MODULES = ('numpy', 'matplotlib.figure', 'matplotlib.backends.backend_tkagg', 'zntest.plotting',
+                   'zntest.waveforms', 'serial.tools.list_ports', 'potentiostat')
+
+
+def warm_up_modules(module_names=WARM_UP_MODULES):
+    for module_name in module_names:
+        importlib.import_module(module_name)
 
 
 class Connection:
@@ -10,7 +33,10 @@ class Connection:
         Class initializing connection frame.
     """
 
-    def __init__(self, parent, set_pstat_obj_fun):
+    def __init__(self, parent, get_ports_fun, connect_fun, connect_all_fun):
+        self.get_ports_fun = get_ports_fun
+        self.connect_fun = connect_fun
+
         self.frame = LabelFrame(parent, text='Connection')
         self.frame.pack(side=TOP)
 
@@ -23,31 +49,86 @@ class Connection:
         self.device_ports_combobox.pack(side=LEFT, padx=5)
 
         self.connection_button = Button(self.frame, text='Connect',
-                                        command=lambda: self.click_connection_button(set_pstat_obj_fun))
+                                        command=self.click_connection_button)
         self.connection_button.pack(side=LEFT, padx=5)
 
+        self.connect_all_button = Button(self.frame, text='Connect all', command=connect_all_fun)
+        self.connect_all_button.pack(side=LEFT, padx=5)
+
+    def set_probing_state(self, is_probing):
+        state = DISABLED if is_probing else NORMAL
+        self.connection_button['state'] = state
+        self.connect_all_button['state'] = state
+        self.connect_all_button['text'] = 'Connecting...' if is_probing else 'Connect all'
+
     def set_device_ports_combobox_values(self):
-        ports = utils.get_available_ports()
+        ports = self.get_ports_fun()
         ports.insert(0, 'None')
         self.device_ports_combobox['values'] = ports
         self.device_ports_combobox.current(0)
 
-    def click_connection_button(self, set_pstat_obj_fun):
+    def set_connected(self):
+        self.description_label.pack_forget()
+        self.device_ports_combobox.current(0)
+
+    def click_connection_button(self):
         combobox_value = self.device_ports_combobox.get()
         if combobox_value != 'None':
-            pstat = utils.connect(combobox_value)
-            if pstat is not None:
-                set_pstat_obj_fun(pstat)
-                self.description_label.pack_forget()
-                self.device_ports_combobox['state'] = DISABLED
-                self.connection_button['state'] = DISABLED
-                self.connection_button['text'] = 'Connected'
-            else:
-                messagebox.showwarning('Warning!', 'Unable to initialize potentiostat on this port')
+            self.connect_fun(combobox_value)
         else:
             messagebox.showwarning('Warning!', 'Select one of available ports')
 
 
+class ConnectedDevices:
+    """
+        Class initializing connected devices frame. Every device has its own compound,
+        the compound from test options is used when it is left empty.
+    """
+
+    def __init__(self, parent):
+        self.frame = LabelFrame(parent, text='Connected devices')
+        self.frame.pack(side=TOP, fill=X)
+
+        self.devices = {}
+
+    def add_device(self, port):
+        if port in self.devices:
+            return
+        row = Frame(self.frame)
+        row.pack(side=TOP, fill=X)
+
+        is_selected_value = BooleanVar(value=1)
+        Checkbutton(row, text=port, variable=is_selected_value).pack(side=LEFT, padx=5)
+
+        Label(row, text='Compound').pack(side=LEFT, padx=5)
+        compound_input_value = StringVar(value='')
+        compound_input_value.trace('w', lambda name, index, mode: self.limit_compound_entry(compound_input_value))
+        Entry(row, width=16, textvariable=compound_input_value).pack(side=LEFT, padx=5)
+
+        self.devices[port] = (row, is_selected_value, compound_input_value)
+
+    def get_selected_devices(self, default_compound):
+        return [(port, compound_input_value.get() or default_compound)
+                for port, (_, is_selected_value, compound_input_value) in sorted(self.devices.items())
+                if is_selected_value.get()]
+
+    def disable_all_elements(self):
+        for row, _, _ in self.devices.values():
+            for element in row.winfo_children():
+                element.config(state=DISABLED)
+
+    def enable_all_elements(self):
+        for row, _, _ in self.devices.values():
+            for element in row.winfo_children():
+                element.config(state=NORMAL)
+
+    @staticmethod
+    def limit_compound_entry(compound_input_value):
+        new_entry_value = compound_input_value.get()
+        if len(new_entry_value) > 15:
+            compound_input_value.set(new_entry_value[:15])
+
+
 class ConstantVoltageSingleTestProperties:
     """
         Class initializing constant voltage single test properties frame.
@@ -349,11 +430,15 @@ class ZnTestOptions:
     """
 
     def __init__(self, parent, constant_voltage_test_1_properties, constant_voltage_test_2_properties,
-                 square_wave_voltammetry_test_properties, run_test_fun):
+                 square_wave_voltammetry_test_properties, run_test_fun, cancel_test_fun, add_to_queue_fun,
+                 run_queue_fun):
         self.constant_voltage_test_1_properties = constant_voltage_test_1_properties
         self.constant_voltage_test_2_properties = constant_voltage_test_2_properties
         self.square_wave_voltammetry_test_properties = square_wave_voltammetry_test_properties
         self.run_test_fun = run_test_fun
+        self.cancel_test_fun = cancel_test_fun
+        self.add_to_queue_fun = add_to_queue_fun
+        self.run_queue_fun = run_queue_fun
 
         self.frame = LabelFrame(parent, text='Test options')
         self.frame.pack(side=TOP)
@@ -381,6 +466,37 @@ class ZnTestOptions:
                                       command=lambda: self.click_run_test_button())
         self.run_test_button.pack(side=TOP)
 
+        self.cancel_test_button = Button(self.frame, text='Cancel',
+                                         command=lambda: self.click_cancel_test_button())
+        self.cancel_test_button.pack(side=TOP)
+
+        self.replicates_label = Label(self.frame, text='Replicates')
+        self.replicates_label.pack(side=TOP)
+
+        self.replicates_input_value = IntVar(value=1)
+        self.replicates_input = Spinbox(self.frame, from_=1, to=100, width=5, textvariable=self.replicates_input_value)
+        self.replicates_input.pack(side=TOP)
+
+        self.add_to_queue_button = Button(self.frame, text='Add to queue',
+                                          command=lambda: self.click_add_to_queue_button())
+        self.add_to_queue_button.pack(side=TOP)
+
+        self.run_queue_button = Button(self.frame, text='Run queue', command=lambda: self.run_queue_fun())
+        self.run_queue_button.pack(side=TOP)
+
+        # progress widgets are kept outside of the options frame, so they aren't disabled together with it
+        self.progress_frame = Frame(parent)
+        self.progress_frame.pack(side=TOP)
+
+        self.progress_bar = Progressbar(self.progress_frame, length=200, mode='determinate')
+        self.progress_bar.pack(side=TOP, pady=2)
+
+        self.status_label = Label(self.progress_frame, text='')
+        self.status_label.pack(side=TOP)
+
+        self.queue_status_label = Label(self.progress_frame, text='')
+        self.queue_status_label.pack(side=TOP)
+
         self.disable_all_elements()
 
     def disable_all_elements(self):
@@ -390,50 +506,328 @@ class ZnTestOptions:
     def enable_all_elements(self):
         for element in self.frame.winfo_children():
             element.config(state=NORMAL)
+        self.cancel_test_button.config(state=DISABLED)
+
+    def set_running_state(self, is_running):
+        if is_running:
+            self.disable_all_elements()
+            self.cancel_test_button.config(state=NORMAL)
+        else:
+            self.enable_all_elements()
+
+    def set_progress(self, value, maximum, status):
+        self.progress_bar.config(maximum=maximum, value=value)
+        self.status_label.config(text=status)
+
+    def set_queue_status(self, status):
+        self.queue_status_label.config(text=status)
 
     def limit_compound_entry(self):
         new_entry_value = self.compound_input_value.get()
         if len(new_entry_value) > 15:
             self.compound_input_value.set(new_entry_value[:15])
 
+    def is_valid_properties(self):
+        return self.constant_voltage_test_1_properties.is_valid() and \
+            self.constant_voltage_test_2_properties.is_valid() and \
+            self.square_wave_voltammetry_test_properties.is_valid()
+
     def click_run_test_button(self):
-        is_valid_properties = self.constant_voltage_test_1_properties.is_valid() and \
-                              self.constant_voltage_test_2_properties.is_valid() and \
-                              self.square_wave_voltammetry_test_properties.is_valid()
-        if is_valid_properties:
+        if self.is_valid_properties():
             self.run_test_fun()
 
+    def click_add_to_queue_button(self):
+        try:
+            replicates = int(self.replicates_input_value.get())
+        except (TclError, ValueError):
+            replicates = 0
+        if replicates < 1:
+            messagebox.showerror('The error occurred!', 'Replicates must be a positive integer')
+            return
+        if self.is_valid_properties():
+            self.add_to_queue_fun(replicates)
+
+    def click_cancel_test_button(self):
+        self.cancel_test_button.config(state=DISABLED)
+        self.status_label.config(text='Cancelling after the current step...')
+        self.cancel_test_fun()
+
+
+class RunViewer:
+    """
+        Class initializing stored runs viewer window. Runs are found by compound, test kind and start date,
+        any selection of them is overlaid on one plot. Every run is drawn from its min/max pyramid,
+        full resolution samples are read from the store only for the visible part of a run and only when
+        it is zoomed in enough to show them.
+    """
+
+    DATE_FORMAT = '%Y-%m-%d'
+    # full resolution samples are drawn when there are at most that many samples per pixel column
+    MAX_FULL_RESOLUTION_SAMPLES_PER_PIXEL = 2
+    REDRAW_DELAY_MS = 50
+    MAX_LEGEND_RUNS = 10
+
+    def __init__(self, parent, run_store):
+        from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg, NavigationToolbar2Tk
+        from matplotlib.figure import Figure
+
+        self.run_store = run_store
+        self.parent = parent
+        # pyramids are kept for the lifetime of the window, so selecting a run again doesn't read it again
+        self.pyramids = {}
+        self.overlaid_runs = []
+        self.x_row = None
+        self.redraw_job = None
+
+        self.window = Toplevel(parent)
+        self.window.title('Stored runs')
+        self.window.geometry('1000x650')
+
+        self.filters = LabelFrame(self.window, text='Filters')
+        self.filters.pack(side=TOP, fill=X)
+
+        Label(self.filters, text='Compound').pack(side=LEFT, padx=5)
+        self.compound_input_value = StringVar(value='')
+        Entry(self.filters, width=16, textvariable=self.compound_input_value).pack(side=LEFT, padx=5)
+
+        Label(self.filters, text='Kind').pack(side=LEFT, padx=5)
+        self.kind_combobox = Combobox(self.filters, width=12, state='readonly',
+                                      values=(recipe.SQUARE_WAVE_VOLTAMMETRY_TEST_KIND,
+                                              recipe.CONSTANT_VOLTAGE_TEST_KIND))
+        self.kind_combobox.current(0)
+        self.kind_combobox.pack(side=LEFT, padx=5)
+
+        Label(self.filters, text='From (YYYY-MM-DD)').pack(side=LEFT, padx=5)
+        self.started_from_input_value = StringVar(value='')
+        Entry(self.filters, width=12, textvariable=self.started_from_input_value).pack(side=LEFT, padx=5)
+
+        Label(self.filters, text='To').pack(side=LEFT, padx=5)
+        self.started_to_input_value = StringVar(value='')
+        Entry(self.filters, width=12, textvariable=self.started_to_input_value).pack(side=LEFT, padx=5)
+
+        Button(self.filters, text='Find', command=self.find_runs).pack(side=LEFT, padx=5)
+
+        self.runs_frame = Frame(self.window)
+        self.runs_frame.pack(side=LEFT, fill=Y)
+
+        self.runs_tree = Treeview(self.runs_frame, columns=('compound', 'started_at', 'samples'), show='headings',
+                                  selectmode='extended', height=25)
+        for column, heading, width in (('compound', 'Compound', 110), ('started_at', 'Started at', 140),
+                                       ('samples', 'Samples', 70)):
+            self.runs_tree.heading(column, text=heading)
+            self.runs_tree.column(column, width=width)
+        runs_scrollbar = Scrollbar(self.runs_frame, orient=VERTICAL, command=self.runs_tree.yview)
+        self.runs_tree.configure(yscrollcommand=runs_scrollbar.set)
+        Button(self.runs_frame, text='Overlay selected', command=self.overlay_selected_runs).pack(side=BOTTOM, pady=5)
+        runs_scrollbar.pack(side=RIGHT, fill=Y)
+        self.runs_tree.pack(side=LEFT, fill=Y)
+
+        self.plot_frame = Frame(self.window)
+        self.plot_frame.pack(side=LEFT, fill=BOTH, expand=True)
+        self.figure = Figure(figsize=(6.0, 5.0), dpi=100)
+        self.axes = self.figure.add_subplot(1, 1, 1)
+        self.axes.grid(True)
+        self.canvas = FigureCanvasTkAgg(self.figure, master=self.plot_frame)
+        # zooming and panning with the toolbar change the limits, the visible part is redrawn after it
+        self.toolbar = NavigationToolbar2Tk(self.canvas, self.plot_frame)
+        self.canvas.get_tk_widget().pack(side=TOP, fill=BOTH, expand=True)
+        self.axes.callbacks.connect('xlim_changed', lambda axes: self.schedule_redraw())
+
+        self.find_runs()
+
+    def parse_date(self, value, is_end_of_day=False):
+        if not value.strip():
+            return None
+        date = datetime.strptime(value.strip(), self.DATE_FORMAT)
+        return date.replace(hour=23, minute=59, second=59) if is_end_of_day else date
+
+    def find_runs(self):
+        try:
+            started_from = self.parse_date(self.started_from_input_value.get())
+            started_to = self.parse_date(self.started_to_input_value.get(), is_end_of_day=True)
+        except ValueError:
+            messagebox.showerror('The error occurred!', 'Dates must be in YYYY-MM-DD format', parent=self.window)
+            return
+
+        runs = self.run_store.find_runs(compound=self.compound_input_value.get().strip() or None,
+                                        kind=self.kind_combobox.get(), started_from=started_from,
+                                        started_to=started_to)
+        self.runs_tree.delete(*self.runs_tree.get_children())
+        for run in runs:
+            self.runs_tree.insert('', END, iid=str(run.id),
+                                  values=(run.compound, run.started_at.strftime('%Y-%m-%d %H:%M:%S'),
+                                          run.samples_count))
+
+    def get_pyramid(self, run):
+        from zntest.measurement import CURR_ROW
+        from zntest.plotting import MinMaxPyramid
+
+        if run.id not in self.pyramids:
+            samples = self.run_store.load_samples(run.id)
+            self.pyramids[run.id] = MinMaxPyramid(samples[self.get_x_row(run.kind)], samples[CURR_ROW])
+        return self.pyramids[run.id]
+
+    @staticmethod
+    def get_x_row(kind):
+        from zntest.measurement import T_ROW, VOLT_ROW
+
+        return VOLT_ROW if kind == recipe.SQUARE_WAVE_VOLTAMMETRY_TEST_KIND else T_ROW
+
+    def overlay_selected_runs(self):
+        runs = [self.run_store.get_run(int(run_id)) for run_id in self.runs_tree.selection()]
+        if not runs:
+            messagebox.showwarning('Warning!', 'Select at least one run', parent=self.window)
+            return
+
+        for _, line, _ in self.overlaid_runs:
+            line.remove()
+        self.overlaid_runs = []
+        # runs of one kind are listed at a time, so all of them share the x axis
+        self.x_row = self.get_x_row(runs[0].kind)
+        for run in runs:
+            line = self.axes.plot([], [], linewidth=0.8,
+                                  label=f'{run.compound} {run.started_at.strftime("%Y-%m-%d %H:%M")}')[0]
+            self.overlaid_runs.append((run, line, self.get_pyramid(run)))
+
+        is_voltammetry = runs[0].kind == recipe.SQUARE_WAVE_VOLTAMMETRY_TEST_KIND
+        self.axes.set_xlabel('potential (V)' if is_voltammetry else 'time (sec)')
+        self.axes.set_ylabel('current (uA)')
+        legend = self.axes.get_legend()
+        if legend is not None:
+            legend.remove()
+        if len(runs) <= self.MAX_LEGEND_RUNS:
+            self.axes.legend(fontsize='small')
+
+        pyramids = [pyramid for _, _, pyramid in self.overlaid_runs if pyramid.samples_count > 0]
+        if pyramids:
+            coarsest_levels = [pyramid.levels[-1] for pyramid in pyramids]
+            x_low = min(pyramid.x_range[0] for pyramid in pyramids)
+            x_high = max(pyramid.x_range[1] for pyramid in pyramids)
+            y_low = min(level[1].min() for level in coarsest_levels)
+            y_high = max(level[4].max() for level in coarsest_levels)
+            self.axes.set_ylim(y_low - 0.05 * (y_high - y_low + 1e-9), y_high + 0.05 * (y_high - y_low + 1e-9))
+            self.axes.set_xlim(x_low, x_high)
+        # the whole runs view becomes the toolbar home view
+        self.toolbar.update()
+        self.redraw()
+
+    def schedule_redraw(self):
+        if self.redraw_job is None:
+            self.redraw_job = self.window.after(self.REDRAW_DELAY_MS, self.redraw)
+
+    def redraw(self):
+        from zntest.measurement import CURR_ROW
+
+        if self.redraw_job is not None:
+            self.window.after_cancel(self.redraw_job)
+            self.redraw_job = None
+
+        x_low, x_high = sorted(self.axes.get_xlim())
+        pixels_count = max(int(self.axes.bbox.width), 1)
+        for run, line, pyramid in self.overlaid_runs:
+            start, end = pyramid.get_index_range(x_low, x_high)
+            if end - start <= pixels_count * self.MAX_FULL_RESOLUTION_SAMPLES_PER_PIXEL:
+                samples = self.run_store.load_samples_range(run.id, start, end)
+                line.set_data(samples[self.x_row], samples[CURR_ROW])
+            else:
+                line.set_data(*pyramid.get_points(start, end, 2 * pixels_count))
+        self.canvas.draw_idle()
+
 
 class MainApplication:
     """
         Class initializing application main window.
     """
 
+    WORKER_POLL_INTERVAL_MS = 100
+    WARM_UP_DELAY_MS = 50
+
     def __init__(self, parent):
         self.parent = parent
 
         self.pstat = None
+        self.discovery = DiscoveryService()
+        self.discovery.start()
+        self.device_manager = DeviceManager(self.discovery)
+        self.workers = []
+        self.plotted_device = None
+        self.running_devices = set()
+        self.finished_steps_count = 0
+        self.steps_count = 0
+        self.job_queue = JobQueue()
+        # time.time() when the queue run was started, None when a single sequence is run
+        self.queue_started_at = None
+
+        recovered_file_paths = utils.recover_partial_runs()
+        if recovered_file_paths:
+            print(f'{len(recovered_file_paths)} interrupted runs are recovered')
 
         self.set_initial_properties()
 
-        self.connection = Connection(self.parent, self.set_pstat_obj)
+        self.controls = Frame(self.parent)
+        self.controls.pack(side=LEFT, fill=Y)
+
+        self.connection = Connection(self.controls, self.discovery.get_ports, self.connect_device,
+                                     self.connect_all_devices)
+        self.connected_devices = ConnectedDevices(self.controls)
 
-        self.tests = LabelFrame(self.parent, text='Inner tests')
+        self.tests = LabelFrame(self.controls, text='Inner tests')
         self.tests.pack(side=TOP)
 
         self.constant_voltage_test_1_properties = ConstantVoltageSingleTestProperties(self.tests, 1)
         self.constant_voltage_test_2_properties = ConstantVoltageSingleTestProperties(self.tests, 2)
         self.square_wave_voltammetry_test_properties = SquareWaveVoltammetrySingleTestProperties(self.tests)
-        self.test_options = ZnTestOptions(self.parent,
+        self.test_options = ZnTestOptions(self.controls,
                                           self.constant_voltage_test_1_properties,
                                           self.constant_voltage_test_2_properties,
                                           self.square_wave_voltammetry_test_properties,
-                                          self.run_test)
+                                          self.run_test,
+                                          self.cancel_test,
+                                          self.add_to_queue,
+                                          self.run_queue)
+        self.update_queue_status()
+
+        self.stored_runs_button = Button(self.controls, text='Stored runs', command=self.open_run_viewer)
+        self.stored_runs_button.pack(side=TOP, pady=5)
+
+        self.plot_frame = LabelFrame(self.parent, text='Live plot')
+        self.plot_frame.pack(side=LEFT, fill=BOTH, expand=True)
+        self.live_plot = None
+        self.live_plot_placeholder = Label(self.plot_frame, text='Loading plots...')
+        self.live_plot_placeholder.pack(side=TOP, expand=True)
+
+        self.parent.after(self.WARM_UP_DELAY_MS, self.start_warm_up)
+
+    def start_warm_up(self):
+        warm_up_thread = threading.Thread(target=warm_up_modules, daemon=True)
+        warm_up_thread.start()
+        self.parent.after(self.WORKER_POLL_INTERVAL_MS, self.poll_warm_up, warm_up_thread)
+
+    def poll_warm_up(self, warm_up_thread):
+        if warm_up_thread.is_alive():
+            self.parent.after(self.WORKER_POLL_INTERVAL_MS, self.poll_warm_up, warm_up_thread)
+        else:
+            self.get_live_plot()
+
+    def get_live_plot(self):
+        # matplotlib is imported when the plot is created, usually it is already warmed up by then
+        if self.live_plot is None:
+            from zntest.plotting import LivePlot
+
+            self.live_plot_placeholder.destroy()
+            self.live_plot = LivePlot(self.plot_frame)
+            self.clear_plot_button = Button(self.plot_frame, text='Clear', command=self.live_plot.clear)
+            self.clear_plot_button.pack(side=TOP)
+        return self.live_plot
+
+    def open_run_viewer(self):
+        # matplotlib is imported by the viewer, usually it is already warmed up by then
+        RunViewer(self.parent, store.get_default_store())
 
     def set_initial_properties(self):
         self.parent.title('Potentiostat App. Zn test')
-        width = 600
-        height = 580
+        width = 1080
+        height = 700
         self.parent.geometry(f'{width}x{height}')
         self.parent.resizable(False, False)
 
@@ -442,8 +836,18 @@ class MainApplication:
         self.parent.geometry(f'+{main_window_position_horizontal}+{main_window_position_vertical}')
 
     def set_pstat_obj(self, pstat):
+        self.device_manager.add(pstat.port, pstat)
+        self.connected_devices.add_device(pstat.port)
+        if self.pstat is not None:
+            return
+
+        # test properties are shared by all devices, current ranges are taken from the first connected one
         self.pstat = pstat
-        available_current_ranges = self.pstat.get_all_curr_range()
+        device_info = self.discovery.get_device_info(pstat.port)
+        if device_info is not None:
+            available_current_ranges = device_info.current_ranges
+        else:
+            available_current_ranges = self.pstat.get_all_curr_range()
 
         self.constant_voltage_test_1_properties.enable_all_elements()
         self.constant_voltage_test_1_properties.set_current_range_values(available_current_ranges)
@@ -456,59 +860,246 @@ class MainApplication:
 
         self.test_options.enable_all_elements()
 
-    def run_constant_voltage_test_1(self):
-        context = {}
-        context['title'] = self.constant_voltage_test_1_properties.frame['text']
-        context['current_range'] = self.constant_voltage_test_1_properties.current_range_combo.get()
-        context['sample_rate'] = int(self.constant_voltage_test_1_properties.sample_rate_input_value.get())
-        context['param'] = {
-            'quietValue': float(self.constant_voltage_test_1_properties.quite_value_input_value.get()),
-            'quietTime': int(self.constant_voltage_test_1_properties.quite_time_input_value.get()),
-            'value': float(self.constant_voltage_test_1_properties.value_input_value.get()),
-            'duration': int(self.constant_voltage_test_1_properties.duration_input_value.get()),
-        }
-        context['create_plot'] = self.constant_voltage_test_1_properties.is_show_plot_value.get()
-        context['compound'] = self.test_options.compound_input_value.get()
-        context['save_data'] = self.test_options.is_save_constant_voltage_tests_output_data.get()
-        utils.run_constant_voltage_test(self.pstat, context)
-
-    def run_constant_voltage_test_2(self):
-        context = {}
-        context['title'] = self.constant_voltage_test_2_properties.frame['text']
-        context['current_range'] = self.constant_voltage_test_2_properties.current_range_combo.get()
-        context['sample_rate'] = int(self.constant_voltage_test_2_properties.sample_rate_input_value.get())
-        context['param'] = {
-            'quietValue': float(self.constant_voltage_test_2_properties.quite_value_input_value.get()),
-            'quietTime': int(self.constant_voltage_test_2_properties.quite_time_input_value.get()),
-            'value': float(self.constant_voltage_test_2_properties.value_input_value.get()),
-            'duration': int(self.constant_voltage_test_2_properties.duration_input_value.get()),
-        }
-        context['create_plot'] = self.constant_voltage_test_2_properties.is_show_plot_value.get()
-        context['compound'] = self.test_options.compound_input_value.get()
-        context['save_data'] = self.test_options.is_save_constant_voltage_tests_output_data.get()
-        utils.run_constant_voltage_test(self.pstat, context)
-
-    def run_square_wave_voltammetry_test(self):
-        context = {}
-        context['title'] = self.square_wave_voltammetry_test_properties.frame['text']
-        context['current_range'] = self.square_wave_voltammetry_test_properties.current_range_combo.get()
-        context['sample_rate'] = int(self.square_wave_voltammetry_test_properties.sample_rate_input_value.get())
-        context['param'] = {
-            'quietValue': float(self.square_wave_voltammetry_test_properties.quite_value_input_value.get()),
-            'quietTime': int(self.square_wave_voltammetry_test_properties.quite_time_input_value.get()),
-            'amplitude': float(self.square_wave_voltammetry_test_properties.amplitude_input_value.get()),
-            'startValue': float(self.square_wave_voltammetry_test_properties.start_value_input_value.get()),
-            'finalValue': float(self.square_wave_voltammetry_test_properties.final_value_input_value.get()),
-            'stepValue': float(self.square_wave_voltammetry_test_properties.step_value_input_value.get()),
-            'window': float(self.square_wave_voltammetry_test_properties.window_input_value.get()),
-        }
-        context['create_plot'] = self.square_wave_voltammetry_test_properties.is_show_plot_value.get()
-        context['compound'] = self.test_options.compound_input_value.get()
-        context['save_data'] = self.test_options.is_save_square_wave_voltammetry_test_output_data.get()
-        utils.run_square_wave_voltammetry_test(self.pstat, context)
+    def connect_device(self, port):
+        # the port may be being probed by the discovery, the probe is waited for out of the Tk thread
+        self.connection.set_probing_state(True)
+        connect_results = queue.Queue()
+        threading.Thread(target=lambda: connect_results.put(self.device_manager.connect(port)), daemon=True).start()
+        self.parent.after(self.WORKER_POLL_INTERVAL_MS, self.poll_connect_result, connect_results)
+
+    def poll_connect_result(self, connect_results):
+        try:
+            pstat = connect_results.get_nowait()
+        except queue.Empty:
+            self.parent.after(self.WORKER_POLL_INTERVAL_MS, self.poll_connect_result, connect_results)
+            return
+
+        self.connection.set_probing_state(False)
+        if pstat is not None:
+            self.set_pstat_obj(pstat)
+            self.connection.set_connected()
+        else:
+            messagebox.showwarning('Warning!', 'Unable to initialize potentiostat on this port')
+
+    def connect_all_devices(self):
+        self.connection.set_probing_state(True)
+        self.discovery.request_scan()
+        probe_results = queue.Queue()
+        threading.Thread(target=lambda: probe_results.put(self.device_manager.probe_ports()), daemon=True).start()
+        self.parent.after(self.WORKER_POLL_INTERVAL_MS, self.poll_probe_results, probe_results)
+
+    def poll_probe_results(self, probe_results):
+        try:
+            found_ports = probe_results.get_nowait()
+        except queue.Empty:
+            self.parent.after(self.WORKER_POLL_INTERVAL_MS, self.poll_probe_results, probe_results)
+            return
+
+        self.connection.set_probing_state(False)
+        for port in found_ports:
+            self.set_pstat_obj(self.device_manager.get(port))
+        if not found_ports:
+            messagebox.showwarning('Warning!', 'No new potentiostats are found')
+
+    def create_constant_voltage_test_context(self, properties):
+        return recipe.create_test_context(
+            recipe.CONSTANT_VOLTAGE_TEST_KIND,
+            properties.frame['text'],
+            properties.current_range_combo.get(),
+            properties.sample_rate_input_value.get(),
+            {
+                'quietValue': float(properties.quite_value_input_value.get()),
+                'quietTime': int(properties.quite_time_input_value.get()),
+                'value': float(properties.value_input_value.get()),
+                'duration': int(properties.duration_input_value.get()),
+            },
+            self.test_options.compound_input_value.get(),
+            self.test_options.is_save_constant_voltage_tests_output_data.get(),
+            properties.is_show_plot_value.get(),
+        )
+
+    def create_square_wave_voltammetry_test_context(self):
+        properties = self.square_wave_voltammetry_test_properties
+        return recipe.create_test_context(
+            recipe.SQUARE_WAVE_VOLTAMMETRY_TEST_KIND,
+            properties.frame['text'],
+            properties.current_range_combo.get(),
+            properties.sample_rate_input_value.get(),
+            {
+                'quietValue': float(properties.quite_value_input_value.get()),
+                'quietTime': int(properties.quite_time_input_value.get()),
+                'amplitude': float(properties.amplitude_input_value.get()),
+                'startValue': float(properties.start_value_input_value.get()),
+                'finalValue': float(properties.final_value_input_value.get()),
+                'stepValue': float(properties.step_value_input_value.get()),
+                'window': float(properties.window_input_value.get()),
+            },
+            self.test_options.compound_input_value.get(),
+            self.test_options.is_save_square_wave_voltammetry_test_output_data.get(),
+            properties.is_show_plot_value.get(),
+        )
+
+    def create_sequence_contexts(self, device, compound):
+        contexts = [
+            (recipe.CONSTANT_VOLTAGE_TEST_KIND,
+             self.create_constant_voltage_test_context(self.constant_voltage_test_1_properties)),
+            (recipe.CONSTANT_VOLTAGE_TEST_KIND,
+             self.create_constant_voltage_test_context(self.constant_voltage_test_2_properties)),
+            (recipe.SQUARE_WAVE_VOLTAMMETRY_TEST_KIND, self.create_square_wave_voltammetry_test_context()),
+        ]
+        for kind, context in contexts:
+            context['compound'] = compound
+            context['device'] = device
+        return contexts
+
+    def create_sequence_steps(self, device, compound):
+        return [(utils.RUN_TEST_FUNS[kind], context) for kind, context in self.create_sequence_contexts(device,
+                                                                                                       compound)]
 
     def run_test(self):
-        self.run_constant_voltage_test_1()
-        self.run_constant_voltage_test_2()
-        self.run_square_wave_voltammetry_test()
-        print()
+        devices = self.connected_devices.get_selected_devices(self.test_options.compound_input_value.get())
+        if not devices:
+            messagebox.showwarning('Warning!', 'Select at least one connected device')
+            return
+        compounds = [compound for _, compound in devices]
+        if len(set(compounds)) != len(compounds):
+            messagebox.showwarning('Warning!', 'Every selected device must have its own compound')
+            return
+        try:
+            devices_steps = [(device, self.create_sequence_steps(device, compound)) for device, compound in devices]
+        except ValueError as ve:
+            messagebox.showerror('The error occurred!', ve.__str__().capitalize())
+            return
+
+        self.workers = []
+        for device, steps in devices_steps:
+            worker = AcquisitionWorker(self.device_manager.get(device), device)
+            worker.start(steps)
+            self.workers.append(worker)
+        self.queue_started_at = None
+        self.start_polling_workers([device for device, _ in devices], 3 * len(devices))
+
+    def add_to_queue(self, replicates):
+        # every selected device adds jobs of its compound, the queue runs them on any device
+        devices = self.connected_devices.get_selected_devices(self.test_options.compound_input_value.get())
+        compounds = [compound for _, compound in devices] or [self.test_options.compound_input_value.get()]
+        try:
+            jobs_contexts = [(compound, self.create_sequence_contexts(None, compound)) for compound in compounds]
+        except ValueError as ve:
+            messagebox.showerror('The error occurred!', ve.__str__().capitalize())
+            return
+        for _ in range(replicates):
+            for compound, contexts in jobs_contexts:
+                self.job_queue.add_job(compound, contexts)
+        self.update_queue_status()
+
+    def run_queue(self):
+        devices = [device for device, _ in
+                   self.connected_devices.get_selected_devices(self.test_options.compound_input_value.get())]
+        if not devices:
+            messagebox.showwarning('Warning!', 'Select at least one connected device')
+            return
+        steps_count = self.job_queue.count_pending_steps()
+        if steps_count == 0:
+            messagebox.showwarning('Warning!', 'The queue is empty')
+            return
+
+        self.workers = []
+        for device in devices:
+            worker = AcquisitionWorker(self.device_manager.get(device), device)
+            worker.start_queue(self.job_queue)
+            self.workers.append(worker)
+        self.queue_started_at = time.time()
+        self.start_polling_workers(devices, steps_count)
+
+    def update_queue_status(self):
+        jobs_counts = self.job_queue.count_jobs()
+        status = f'Queue: {jobs_counts.get(JOB_STATUS_PENDING, 0)} pending, {jobs_counts.get(JOB_STATUS_DONE, 0)} done'
+        if jobs_counts.get(JOB_STATUS_FAILED, 0):
+            status += f', {jobs_counts[JOB_STATUS_FAILED]} failed'
+        if self.queue_started_at is not None:
+            throughput = self.job_queue.get_throughput(since=self.queue_started_at)
+            if throughput.steps_count:
+                status += f'\n{throughput.wall_samples_per_hour:.0f} samples/hour'
+        self.test_options.set_queue_status(status)
+
+    def start_polling_workers(self, devices, steps_count):
+        # the live plot follows the first selected device
+        self.plotted_device = devices[0]
+        self.running_devices = set(devices)
+        self.finished_steps_count = 0
+        self.steps_count = steps_count
+
+        self.test_options.set_running_state(True)
+        self.connected_devices.disable_all_elements()
+        self.test_options.set_progress(0, self.steps_count, 'Starting...')
+        self.parent.after(self.WORKER_POLL_INTERVAL_MS, self.poll_worker_events)
+
+    def cancel_test(self):
+        for worker in self.workers:
+            worker.cancel()
+
+    def poll_worker_events(self):
+        for worker in self.workers:
+            for event in worker.get_events():
+                self.handle_worker_event(event)
+
+        if self.running_devices:
+            self.parent.after(self.WORKER_POLL_INTERVAL_MS, self.poll_worker_events)
+        else:
+            self.test_options.set_running_state(False)
+            self.connected_devices.enable_all_elements()
+            self.update_queue_status()
+            print()
+
+    def handle_worker_event(self, event):
+        device_prefix = f'{event.device}: ' if len(self.workers) > 1 else ''
+        is_plotted = event.device == self.plotted_device and event.context is not None and \
+            event.context['create_plot']
+
+        if event.kind == STEP_STARTED:
+            self.test_options.set_progress(self.finished_steps_count, self.steps_count,
+                                           f'{device_prefix}Running {event.context["title"]} '
+                                           f'({event.step_index + 1}/{event.steps_count})')
+            if is_plotted:
+                import zntest.waveforms as waveforms
+
+                self.get_live_plot().start_run(event.context['title'], waveforms.get_plot_bounds(event.context))
+        elif event.kind == STEP_SAMPLES:
+            if is_plotted:
+                with instrumentation.span('plot', device=event.device, title=event.context['title']):
+                    self.get_live_plot().add_samples(*event.payload.get_columns())
+        elif event.kind == STEP_FINISHED:
+            self.finished_steps_count += 1
+            if self.queue_started_at is not None:
+                self.update_queue_status()
+            status = f'{device_prefix}{event.context["title"]} is finished ({event.payload.samples_count} samples)'
+            analysis = event.payload.analysis
+            if analysis is not None and 'peak_height' in analysis:
+                status += f'\npeak {analysis["peak_height"]:.3f} uA at {analysis["peak_potential"]:.3f} V'
+            elif analysis is not None:
+                status += f'\ncharge {analysis["charge"]:.3f} uC'
+                if analysis['anomalies']:
+                    status += ', ' + ', '.join(kind.replace('_', ' ') for kind in analysis['anomalies'])
+            self.test_options.set_progress(self.finished_steps_count, self.steps_count, status)
+        elif event.kind == SEQUENCE_FINISHED:
+            self.running_devices.discard(event.device)
+            status = f'{device_prefix}Zn test is finished'
+            if event.payload is not None and event.payload.skipped_count:
+                status += f'\n{event.payload.skipped_count} unchanged settings skipped, ' \
+                          f'{event.payload.saved_sec * 1e3:.0f} ms saved'
+                print('[{}]\t{}{} unchanged device settings skipped, {:.0f} ms saved'.format(
+                    datetime.now().strftime("%H:%M:%S"), device_prefix, event.payload.skipped_count,
+                    event.payload.saved_sec * 1e3))
+            self.test_options.set_progress(self.finished_steps_count, self.steps_count, status)
+        elif event.kind == SEQUENCE_CANCELLED:
+            self.running_devices.discard(event.device)
+            self.test_options.set_progress(self.finished_steps_count, self.steps_count,
+                                           f'{device_prefix}Zn test is cancelled')
+        elif event.kind == SEQUENCE_FAILED:
+            self.running_devices.discard(event.device)
+            # the job queue fails without a step when the next job can't be claimed
+            title = event.context['title'] if event.context is not None else 'Job queue'
+            self.test_options.set_progress(self.finished_steps_count, self.steps_count,
+                                           f'{device_prefix}{title} failed')
+            messagebox.showerror('The error occurred!', f'{device_prefix}{title}\n{event.payload}')
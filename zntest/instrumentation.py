@@ -0,0 +1,241 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+# ZNTEST_TRACE=<file> appends JSON lines of every run to the file,
+# ZNTEST_PROFILE=<folder> additionally saves cProfile stats of every run into the folder
+TRACE_PATH_VARIABLE = 'ZNTEST_TRACE'
+PROFILE_FOLDER_VARIABLE = 'ZNTEST_PROFILE'
+
+_trace_path = None
+_profile_folder = None
+_write_lock = threading.Lock()
+# cProfile profiles one thread at a time on Python 3.12+, runs started while another run is profiled aren't profiled
+_profile_lock = threading.Lock()
+_local = threading.local()
+
+
+def configure(trace_path=None, profile_folder=None):
+    """
+        Turns instrumentation on when trace_path is given and off otherwise.
+    """
+    global _trace_path, _profile_folder
+    _trace_path = trace_path
+    _profile_folder = profile_folder if trace_path is not None else None
+    if _profile_folder is not None and os.path.exists(_profile_folder) is False:
+        os.makedirs(_profile_folder)
+
+
+def configure_from_environment():
+    trace_path = os.environ.get(TRACE_PATH_VARIABLE) or None
+    profile_folder = os.environ.get(PROFILE_FOLDER_VARIABLE) or None
+    if profile_folder is not None and trace_path is None:
+        trace_path = os.path.join(profile_folder, 'trace.jsonl')
+    configure(trace_path, profile_folder)
+
+
+def is_enabled():
+    return _trace_path is not None
+
+
+def write_record(record):
+    line = json.dumps(record, default=str) + '\n'
+    with _write_lock:
+        with open(_trace_path, 'a', encoding='utf-8') as trace_file:
+            trace_file.write(line)
+
+
+class NullSpan:
+    """
+        Class of the span returned when instrumentation is off, entering and leaving it does nothing.
+    """
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+NULL_SPAN = NullSpan()
+
+
+class Span:
+    """
+        Class measuring wall time of a block. Inside a run trace the time is added to the run phase,
+        otherwise the span is written as its own record.
+    """
+
+    __slots__ = ('name', 'fields', 'started_at')
+
+    def __init__(self, name, fields):
+        self.name = name
+        self.fields = fields
+        self.started_at = None
+
+    def __enter__(self):
+        self.started_at = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        duration = time.perf_counter() - self.started_at
+        trace = getattr(_local, 'trace', None)
+        if trace is not None:
+            trace.add_span(self.name, duration)
+        elif _trace_path is not None:
+            write_record(dict(self.fields, event='span', name=self.name, at=datetime.now().isoformat(),
+                              duration_sec=duration))
+        return False
+
+
+def span(name, **fields):
+    if _trace_path is None:
+        return NULL_SPAN
+    return Span(name, fields)
+
+
+def count(name, value):
+    trace = getattr(_local, 'trace', None)
+    if trace is not None:
+        trace.counters[name] = trace.counters.get(name, 0) + value
+
+
+def observe_samples(t):
+    # device time of the first and the last sample gives the effective sample rate
+    trace = getattr(_local, 'trace', None)
+    if trace is not None and len(t):
+        if trace.first_sample_time is None:
+            trace.first_sample_time = float(t[0])
+        trace.last_sample_time = float(t[-1])
+        trace.samples_count += len(t)
+
+
+def iterate_timed(iterable, name):
+    """
+        Yields items of the iterable, time spent in getting every item is added to the name span,
+        e.g. waiting for the samples of a chunk to come off the serial port.
+    """
+    if _trace_path is None:
+        yield from iterable
+        return
+    iterator = iter(iterable)
+    while True:
+        with span(name):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
+
+
+class RunTrace:
+    """
+        Class collecting phase timings and counters of one test run.
+    """
+
+    def __init__(self, kind, context):
+        self.kind = kind
+        self.context = context
+        self.started_at = datetime.now()
+        self.started_perf_counter = time.perf_counter()
+        # phase name: [count, total seconds, maximal seconds]
+        self.spans = {}
+        self.counters = {}
+        self.samples_count = 0
+        self.first_sample_time = None
+        self.last_sample_time = None
+
+    def add_span(self, name, duration):
+        phase = self.spans.get(name)
+        if phase is None:
+            self.spans[name] = [1, duration, duration]
+        else:
+            phase[0] += 1
+            phase[1] += duration
+            phase[2] = max(phase[2], duration)
+
+    def get_records(self, error=None):
+        duration = time.perf_counter() - self.started_perf_counter
+        base = {'kind': self.kind, 'title': self.context.get('title'), 'compound': self.context.get('compound'),
+                'device': self.context.get('device'), 'started_at': self.started_at.isoformat()}
+        records = [dict(base, event='phase', name=name, count=phase_count, total_sec=total, max_sec=maximum)
+                   for name, (phase_count, total, maximum) in self.spans.items()]
+
+        device_duration = None
+        if self.first_sample_time is not None and self.last_sample_time > self.first_sample_time:
+            device_duration = self.last_sample_time - self.first_sample_time
+        acquisition_sec = self.spans.get('acquisition', [0, 0.0, 0.0])[1]
+        records.append(dict(
+            base, event='run', duration_sec=duration, samples_count=self.samples_count,
+            requested_sample_rate=self.context.get('sample_rate'),
+            effective_sample_rate=(self.samples_count - 1) / device_duration if device_duration else None,
+            wall_sample_rate=self.samples_count / acquisition_sec if acquisition_sec > 0 else None,
+            counters=self.counters, error=error))
+        return records
+
+
+@contextmanager
+def trace_run(kind, context):
+    """
+        Collects spans of the run on the calling thread and writes them as JSON lines when the run is over,
+        with profiling on the run is also profiled with cProfile, unless another run is profiled at the time.
+    """
+    if _trace_path is None:
+        yield None
+        return
+
+    trace = RunTrace(kind, context)
+    previous_trace = getattr(_local, 'trace', None)
+    _local.trace = trace
+    profile = None
+    if _profile_folder is not None and _profile_lock.acquire(blocking=False):
+        import cProfile
+
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # another profiling tool, e.g. a profiler the application is run under, is active
+            profile = None
+            _profile_lock.release()
+    error = None
+    try:
+        yield trace
+    except BaseException as e:
+        error = f'{type(e).__name__}: {e}'
+        raise
+    finally:
+        if profile is not None:
+            profile.disable()
+            _profile_lock.release()
+            profile.dump_stats(os.path.join(_profile_folder, '{}__{}__{}.prof'.format(
+                kind, context.get('compound'), trace.started_at.strftime('%Y-%m-%d__%H-%M-%S-%f'))))
+        _local.trace = previous_trace
+        for record in trace.get_records(error):
+            write_record(record)
+
+
+def read_run_reports(path):
+    """
+        Returns run records of the trace file in the order they were written, phase records of every run
+        are collected into its 'phases' dict.
+    """
+    reports = []
+    phases = {}
+    with open(path, encoding='utf-8') as trace_file:
+        for line in trace_file:
+            record = json.loads(line)
+            run_key = (record.get('device'), record.get('started_at'))
+            if record['event'] == 'phase':
+                phases.setdefault(run_key, {})[record['name']] = record
+            elif record['event'] == 'run':
+                reports.append(dict(record, phases=phases.pop(run_key, {})))
+    return reports
+
+
+configure_from_environment()
@@ -0,0 +1,277 @@
+import json
+import os
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime
+
+from zntest.locking import is_file_locked, lock_file
+from zntest.store import STARTED_AT_FORMAT, connect_database
+
+SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS jobs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        compound TEXT NOT NULL,
+        plan TEXT,
+        status TEXT NOT NULL,
+        device TEXT,
+        owner TEXT,
+        queued_at TEXT NOT NULL,
+        started_at TEXT,
+        finished_at TEXT,
+        error TEXT
+    );
+    CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, id);
+    CREATE TABLE IF NOT EXISTS job_steps (
+        job_id INTEGER NOT NULL REFERENCES jobs (id) ON DELETE CASCADE,
+        step_index INTEGER NOT NULL,
+        kind TEXT NOT NULL,
+        context TEXT NOT NULL,
+        status TEXT NOT NULL,
+        run_id INTEGER,
+        samples_count INTEGER,
+        started_at REAL,
+        finished_at REAL,
+        PRIMARY KEY (job_id, step_index)
+    );
+'''
+
+JOB_STATUS_PENDING = 'pending'
+JOB_STATUS_RUNNING = 'running'
+JOB_STATUS_DONE = 'done'
+JOB_STATUS_FAILED = 'failed'
+
+# the device is chosen when the job is claimed, so it isn't stored with the step
+RUNTIME_CONTEXT_KEYS = ('device',)
+# columns added after the first release of the queue, they are added to existing databases on open
+ADDED_COLUMNS = (
+    ('owner', 'TEXT'),
+)
+
+Job = namedtuple('Job', ['id', 'compound', 'plan', 'status', 'device', 'steps'])
+JobStep = namedtuple('JobStep', ['job_id', 'step_index', 'kind', 'context', 'status', 'run_id', 'samples_count',
+                                 'started_at', 'finished_at'])
+Throughput = namedtuple('Throughput', ['steps_count', 'samples_count', 'busy_sec', 'wall_sec',
+                                       'samples_per_hour', 'wall_samples_per_hour'])
+
+
+def get_default_job_queue_path():
+    return os.path.join(os.getcwd(), 'data', 'jobs.sqlite3')
+
+
+class JobQueue:
+    """
+        Class keeping a persistent queue of Zn test jobs in a SQLite database.
+        A job is the sequence of test steps of one sample, its steps always run in order on one device,
+        while several devices can take jobs from the same queue. Every finished step is committed
+        with its run id and timing, so a job interrupted by a crash resumes from its first unfinished step.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or get_default_job_queue_path()
+        folder = os.path.dirname(self.path)
+        if folder and os.path.exists(folder) is False:
+            os.makedirs(folder)
+
+        self.lock = threading.Lock()
+        # the queue can be shared by application instances running different devices, every instance holds
+        # the lock of its owner file while the queue is open, jobs it runs are recognized by it
+        self.owner = f'{self.path}.{os.getpid()}.lock'
+        self.owner_file = open(self.owner, 'wb')
+        lock_file(self.owner_file, is_blocking=True)
+        self.connection = connect_database(self.path)
+        self.connection.executescript(SCHEMA)
+        self.migrate()
+        self.resume_interrupted_jobs()
+
+    def migrate(self):
+        with self.connection:
+            self.connection.execute('BEGIN IMMEDIATE')
+            columns = [row[1] for row in self.connection.execute('PRAGMA table_info(jobs)')]
+            for column, definition in ADDED_COLUMNS:
+                if column not in columns:
+                    self.connection.execute(f'ALTER TABLE jobs ADD COLUMN {column} {definition}')
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+        self.owner_file.close()
+        os.remove(self.owner)
+
+    def resume_interrupted_jobs(self):
+        """
+            Jobs left running were interrupted by a crash, their unfinished steps are run again.
+            Jobs whose owner file is still locked are running in another application instance, they are kept.
+        """
+        with self.lock, self.connection:
+            self.connection.execute('BEGIN IMMEDIATE')
+            rows = self.connection.execute('SELECT id, owner FROM jobs WHERE status = ?',
+                                           (JOB_STATUS_RUNNING,)).fetchall()
+            # jobs owned by this instance's owner file were left by a crashed process of the same pid
+            job_ids = [job_id for job_id, owner in rows
+                       if owner is None or owner == self.owner or not is_file_locked(owner)]
+            self.connection.executemany('UPDATE job_steps SET status = ?, started_at = NULL WHERE job_id = ? AND '
+                                        'status = ?', [(JOB_STATUS_PENDING, job_id, JOB_STATUS_RUNNING)
+                                                       for job_id in job_ids])
+            self.connection.executemany('UPDATE jobs SET status = ?, device = NULL, owner = NULL WHERE id = ?',
+                                        [(JOB_STATUS_PENDING, job_id) for job_id in job_ids])
+        # owner files left by crashed instances
+        for owner in {owner for _, owner in rows if owner is not None and owner != self.owner}:
+            if os.path.exists(owner) and not is_file_locked(owner):
+                os.remove(owner)
+        return len(job_ids)
+
+    def add_job(self, compound, contexts, plan=None):
+        """
+            Appends the job of (test kind, context) steps to the queue and returns its id.
+        """
+        with self.lock, self.connection:
+            cursor = self.connection.execute(
+                'INSERT INTO jobs (compound, plan, status, queued_at) VALUES (?, ?, ?, ?)',
+                (compound, plan, JOB_STATUS_PENDING, datetime.now().strftime(STARTED_AT_FORMAT)))
+            job_id = cursor.lastrowid
+            self.connection.executemany(
+                'INSERT INTO job_steps (job_id, step_index, kind, context, status) VALUES (?, ?, ?, ?, ?)',
+                [(job_id, step_index, kind, json.dumps({key: value for key, value in context.items()
+                                                        if key not in RUNTIME_CONTEXT_KEYS}),
+                  JOB_STATUS_PENDING) for step_index, (kind, context) in enumerate(contexts)])
+        return job_id
+
+    def claim_next_job(self, device=None):
+        """
+            Marks the first pending job as running on the device and returns it, None when the queue is empty.
+            Claiming is atomic, so every job is taken by one device only, also when the queue is shared
+            by several application instances.
+        """
+        with self.lock, self.connection:
+            # the write lock is taken before the pending job is selected, so no other connection claims it meanwhile
+            self.connection.execute('BEGIN IMMEDIATE')
+            row = self.connection.execute('SELECT id FROM jobs WHERE status = ? ORDER BY id LIMIT 1',
+                                          (JOB_STATUS_PENDING,)).fetchone()
+            if row is None:
+                return None
+            self.connection.execute(
+                'UPDATE jobs SET status = ?, device = ?, owner = ?, started_at = COALESCE(started_at, ?) WHERE id = ?',
+                (JOB_STATUS_RUNNING, device, self.owner, datetime.now().strftime(STARTED_AT_FORMAT), row[0]))
+        return self.get_job(row[0])
+
+    def get_job(self, job_id):
+        with self.lock:
+            job_row = self.connection.execute('SELECT id, compound, plan, status, device FROM jobs WHERE id = ?',
+                                              (job_id,)).fetchone()
+            step_rows = self.connection.execute(f'SELECT {", ".join(JobStep._fields)} FROM job_steps '
+                                                'WHERE job_id = ? ORDER BY step_index', (job_id,)).fetchall()
+        if job_row is None:
+            raise KeyError(f'Job #{job_id} is not found')
+        steps = [JobStep(*row[:3], json.loads(row[3]), *row[4:]) for row in step_rows]
+        return Job(*job_row, steps)
+
+    def start_step(self, job_id, step_index):
+        with self.lock, self.connection:
+            self.connection.execute('UPDATE job_steps SET status = ?, started_at = ? WHERE job_id = ? AND '
+                                    'step_index = ?', (JOB_STATUS_RUNNING, time.time(), job_id, step_index))
+
+    def finish_step(self, job_id, step_index, run_id, samples_count):
+        with self.lock, self.connection:
+            self.connection.execute('UPDATE job_steps SET status = ?, run_id = ?, samples_count = ?, '
+                                    'finished_at = ? WHERE job_id = ? AND step_index = ?',
+                                    (JOB_STATUS_DONE, run_id, samples_count, time.time(), job_id, step_index))
+
+    def finish_job(self, job_id, error=None):
+        status = JOB_STATUS_DONE if error is None else JOB_STATUS_FAILED
+        with self.lock, self.connection:
+            if error is not None:
+                self.connection.execute('UPDATE job_steps SET status = ?, finished_at = ? WHERE job_id = ? AND '
+                                        'status = ?', (JOB_STATUS_FAILED, time.time(), job_id, JOB_STATUS_RUNNING))
+            self.connection.execute('UPDATE jobs SET status = ?, finished_at = ?, error = ? WHERE id = ?',
+                                    (status, datetime.now().strftime(STARTED_AT_FORMAT), error, job_id))
+
+    def release_job(self, job_id):
+        # a cancelled job goes back to the queue, its finished steps are kept
+        with self.lock, self.connection:
+            self.connection.execute('UPDATE job_steps SET status = ?, started_at = NULL WHERE job_id = ? AND '
+                                    'status = ?', (JOB_STATUS_PENDING, job_id, JOB_STATUS_RUNNING))
+            self.connection.execute('UPDATE jobs SET status = ?, device = NULL, owner = NULL WHERE id = ?',
+                                    (JOB_STATUS_PENDING, job_id))
+
+    def retry_failed_jobs(self):
+        with self.lock, self.connection:
+            self.connection.execute('UPDATE job_steps SET status = ?, started_at = NULL, finished_at = NULL '
+                                    'WHERE status = ?', (JOB_STATUS_PENDING, JOB_STATUS_FAILED))
+            cursor = self.connection.execute('UPDATE jobs SET status = ?, device = NULL, error = NULL '
+                                             'WHERE status = ?', (JOB_STATUS_PENDING, JOB_STATUS_FAILED))
+        return cursor.rowcount
+
+    def clear(self, statuses=(JOB_STATUS_DONE, JOB_STATUS_FAILED)):
+        with self.lock, self.connection:
+            cursor = self.connection.execute(f'DELETE FROM jobs WHERE status IN ({", ".join("?" * len(statuses))})',
+                                             statuses)
+        return cursor.rowcount
+
+    def count_jobs(self):
+        with self.lock:
+            rows = self.connection.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall()
+        return dict(rows)
+
+    def count_pending_steps(self):
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT COUNT(*) FROM job_steps JOIN jobs ON jobs.id = job_steps.job_id '
+                'WHERE jobs.status = ? AND job_steps.status = ?', (JOB_STATUS_PENDING, JOB_STATUS_PENDING)).fetchone()
+        return row[0]
+
+    def get_throughput(self, since=None):
+        """
+            Returns throughput of the steps finished after since (time.time() value, all steps by default).
+            samples_per_hour counts time spent in steps only, wall_samples_per_hour counts the time from
+            the first step start to the last step finish, so idle time between steps lowers it.
+        """
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT COUNT(*), SUM(samples_count), SUM(finished_at - started_at), MIN(started_at), '
+                'MAX(finished_at) FROM job_steps WHERE status = ? AND finished_at >= ?',
+                (JOB_STATUS_DONE, since or 0.0)).fetchone()
+        steps_count, samples_count, busy_sec, first_started_at, last_finished_at = row
+        samples_count = samples_count or 0
+        busy_sec = busy_sec or 0.0
+        wall_sec = (last_finished_at - first_started_at) if steps_count else 0.0
+        return Throughput(steps_count, samples_count, busy_sec, wall_sec,
+                          samples_count * 3600.0 / busy_sec if busy_sec > 0 else 0.0,
+                          samples_count * 3600.0 / wall_sec if wall_sec > 0 else 0.0)
+
+
+def run_job(job_queue, job, pstat, device=None, on_step_started=None, on_step_finished=None, create_on_samples=None,
+            is_cancel_requested=None):
+    """
+        Runs the unfinished steps of the claimed job one after another. Returns False when it is cancelled before
+        the next step, the job goes back to the queue then. Exceptions of a step mark the job as failed and are
+        raised.
+    """
+    import zntest.utils as utils
+
+    pending_steps = [step for step in job.steps if step.status != JOB_STATUS_DONE]
+    for step in pending_steps:
+        if is_cancel_requested is not None and is_cancel_requested():
+            job_queue.release_job(job.id)
+            return False
+
+        context = dict(step.context, device=device)
+        job_queue.start_step(job.id, step.step_index)
+        if on_step_started is not None:
+            on_step_started(job, step, context)
+        on_samples = create_on_samples(job, step, context) if create_on_samples is not None else None
+        try:
+            result = utils.RUN_TEST_FUNS[step.kind](pstat, context, on_samples)
+        except Exception as e:
+            job_queue.finish_job(job.id, error=f'{type(e).__name__}: {e}')
+            raise
+        except BaseException:
+            # e.g. KeyboardInterrupt, the job isn't failed, it is resumed later
+            job_queue.release_job(job.id)
+            raise
+        job_queue.finish_step(job.id, step.step_index, result.run_id, result.samples_count)
+        if on_step_finished is not None:
+            on_step_finished(job, step, context, result)
+
+    job_queue.finish_job(job.id)
+    return True
@@ -0,0 +1,67 @@
+import os
+
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+    import msvcrt
+
+# Windows locks are mandatory, so a byte far beyond the data is locked instead of the data itself,
+# other processes can read the locked file then
+WINDOWS_LOCK_OFFSET = 2 ** 31 - 2
+
+
+def lock_file(file, is_blocking=False):
+    """
+        Takes the exclusive lock of the open file, it is held until unlock_file is called or the file is closed,
+        also when the process crashes. Returns False when the file is locked by another process
+        and is_blocking is False.
+    """
+    if fcntl is not None:
+        try:
+            fcntl.flock(file.fileno(), fcntl.LOCK_EX | (0 if is_blocking else fcntl.LOCK_NB))
+        except BlockingIOError:
+            return False
+        return True
+
+    position = file.tell()
+    file.seek(WINDOWS_LOCK_OFFSET)
+    try:
+        msvcrt.locking(file.fileno(), msvcrt.LK_LOCK if is_blocking else msvcrt.LK_NBLCK, 1)
+    except OSError:
+        return False
+    finally:
+        file.seek(position)
+    return True
+
+
+def unlock_file(file):
+    if fcntl is not None:
+        fcntl.flock(file.fileno(), fcntl.LOCK_UN)
+        return
+    position = file.tell()
+    file.seek(WINDOWS_LOCK_OFFSET)
+    try:
+        msvcrt.locking(file.fileno(), msvcrt.LK_UNLCK, 1)
+    finally:
+        file.seek(position)
+
+
+def is_file_locked(path):
+    """
+        Returns True when another process holds the lock of the file.
+    """
+    try:
+        with open(path, 'rb') as file:
+            if lock_file(file):
+                unlock_file(file)
+                return False
+            return True
+    except FileNotFoundError:
+        return False
+
+
+def get_temporary_path(path):
+    # every process writes its own temporary file, so concurrent atomic replaces of the same file don't mix
+    return f'{path}.{os.getpid()}.tmp'
@@ -0,0 +1,81 @@
+from collections import namedtuple
+from types import MappingProxyType
+
+import numpy as np
+
+T_ROW = 0
+VOLT_ROW = 1
+CURR_ROW = 2
+
+RunMetadata = namedtuple('RunMetadata', ['compound', 'kind', 'param', 'started_at', 'title', 'run_id'],
+                         defaults=(None, None))
+
+
+def create_run_metadata(compound, kind, param, started_at, title=None, run_id=None):
+    # param is wrapped into a read-only mapping, so metadata shared between views can't be changed through any of them
+    return RunMetadata(compound, kind, MappingProxyType(dict(param or {})), started_at, title, run_id)
+
+
+class MeasurementRun:
+    """
+        Class keeping samples of a measurement run in one contiguous (3, samples count) array with t, volt and curr
+        rows, so every column is contiguous and consumers share the buffer instead of copying it.
+        The samples are read-only, metadata is an immutable RunMetadata. Slicing by time returns views
+        of the same buffer.
+    """
+
+    __slots__ = ('samples', 'metadata')
+
+    def __init__(self, samples, metadata):
+        if samples.ndim != 2 or samples.shape[0] != 3:
+            raise ValueError(f'Samples must have (3, samples count) shape, not {samples.shape}')
+        if samples.strides[1] != samples.itemsize:
+            # every row must be contiguous, e.g. a transposed (samples count, 3) table is copied once here
+            samples = np.ascontiguousarray(samples)
+        # the caller's array stays writable, only this view is read-only
+        samples = samples.view()
+        samples.flags.writeable = False
+        self.samples = samples
+        self.metadata = metadata
+
+    @classmethod
+    def from_columns(cls, t, volt, curr, metadata, dtype=np.float64):
+        samples = np.empty((3, len(t)), dtype=dtype)
+        samples[T_ROW] = t
+        samples[VOLT_ROW] = volt
+        samples[CURR_ROW] = curr
+        return cls(samples, metadata)
+
+    @property
+    def t(self):
+        return self.samples[T_ROW]
+
+    @property
+    def volt(self):
+        return self.samples[VOLT_ROW]
+
+    @property
+    def curr(self):
+        return self.samples[CURR_ROW]
+
+    @property
+    def nbytes(self):
+        return self.samples.nbytes
+
+    def __len__(self):
+        return self.samples.shape[1]
+
+    def __repr__(self):
+        return f'MeasurementRun({self.metadata.kind!r}, {self.metadata.compound!r}, {len(self)} samples)'
+
+    def get_columns(self):
+        return self.t, self.volt, self.curr
+
+    def window(self, start_time=None, end_time=None):
+        """
+            Returns the run of the samples with start_time <= t < end_time, the samples aren't copied.
+            t must be non-decreasing, as it is in every acquired run.
+        """
+        start = 0 if start_time is None else int(np.searchsorted(self.t, start_time, side='left'))
+        end = len(self) if end_time is None else int(np.searchsorted(self.t, end_time, side='left'))
+        return MeasurementRun(self.samples[:, start:max(start, end)], self.metadata)
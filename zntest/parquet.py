@@ -0,0 +1,325 @@
+import json
+import os
+from collections import OrderedDict
+from urllib.parse import quote, unquote
+
+import zntest.analysis as analysis
+import zntest.store as store
+from zntest.locking import get_temporary_path, lock_file
+
+# the dataset folder holds two datasets partitioned alike, kind=<kind>/compound=<compound>/date=<YYYY-MM-DD>:
+# runs, one row per run with its settings, statistics and analysis, and samples, one row per sample,
+# every run in its own row groups. Files of both datasets written by one export have the same name.
+RUNS_DATASET = 'runs'
+SAMPLES_DATASET = 'samples'
+PARTITION_FIELDS = ('kind', 'compound', 'date')
+# names starting with an underscore or a dot are skipped by dataset readers
+MANIFEST_FILE_NAME = '_manifest.json'
+LOCK_FILE_NAME = '_export.lock'
+PART_FILE_SUFFIX = '.parquet'
+COMPRESSION = 'zstd'
+# runs are exported when they are no longer written, a running run is exported by a later export
+EXPORTED_STATUSES = (store.RUN_STATUS_COMPLETE, store.RUN_STATUS_PARTIAL)
+RUN_STATISTICS_FIELDS = ('duration', 'volt_min', 'volt_max', 'curr_min', 'curr_max', 'curr_mean', 'curr_std',
+                         'charge')
+# square wave voltammetry results of the stored analysis are columns of their own
+ANALYSIS_FIELDS = analysis.RESULT_FIELDS
+
+
+def get_default_export_path():
+    return os.path.join(os.getcwd(), 'data', 'export')
+
+
+def import_pyarrow():
+    # pyarrow is needed only to export and query the datasets, the application runs without it
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise RuntimeError('Parquet export requires pyarrow, install it with: '
+                           'pip install -r requirements-parquet.txt') from None
+    return pyarrow, pyarrow.parquet
+
+
+def get_runs_schema(pa):
+    return pa.schema([('run_id', pa.int64()), ('started_at', pa.timestamp('s')), ('title', pa.string()),
+                      ('current_range', pa.string()), ('sample_rate', pa.int32()), ('param', pa.string()),
+                      ('status', pa.string()), ('device', pa.string()), ('samples_count', pa.int64())] +
+                     [(field, pa.float64()) for field in RUN_STATISTICS_FIELDS + ANALYSIS_FIELDS] +
+                     [('analysis_version', pa.int32()), ('analysis', pa.string())])
+
+
+def get_samples_schema(pa):
+    # time is in seconds, voltage in V and current in uA, as in the run store
+    return pa.schema([('run_id', pa.int64()), ('t', pa.float32()), ('volt', pa.float32()), ('curr', pa.float32())])
+
+
+def get_partition_folder(record):
+    # partition values are URI encoded, as dataset readers decode them, so any compound name makes a valid folder
+    return os.path.join(f'kind={quote(record.kind, safe="")}', f'compound={quote(record.compound, safe="")}',
+                        f'date={record.started_at.date().isoformat()}')
+
+
+def get_run_statistics(samples):
+    """
+        Returns dict of RUN_STATISTICS_FIELDS of the (3, samples count) samples, NaN of an empty run.
+        charge is the current integrated over time, uC.
+    """
+    t, volt, curr = samples.astype(float)
+    if len(t) == 0:
+        return {field: float('nan') for field in RUN_STATISTICS_FIELDS}
+    return {'duration': float(t[-1] - t[0]), 'volt_min': float(volt.min()), 'volt_max': float(volt.max()),
+            'curr_min': float(curr.min()), 'curr_max': float(curr.max()), 'curr_mean': float(curr.mean()),
+            'curr_std': float(curr.std()), 'charge': float(analysis.integrate_trapezoid(curr, t))}
+
+
+def create_run_row(record, samples, stored_analysis):
+    row = {'run_id': record.id, 'started_at': record.started_at, 'title': record.title,
+           'current_range': record.current_range, 'sample_rate': record.sample_rate,
+           'param': json.dumps(record.param, sort_keys=True), 'status': record.status, 'device': record.device,
+           'samples_count': samples.shape[1]}
+    row.update(get_run_statistics(samples))
+    version, result = stored_analysis if stored_analysis is not None else (None, {})
+    row.update({field: result.get(field) for field in ANALYSIS_FIELDS})
+    row['analysis_version'] = version
+    row['analysis'] = json.dumps(result, sort_keys=True) if stored_analysis is not None else None
+    return row
+
+
+class ParquetExporter:
+    """
+        Class exporting runs of the run store into partitioned Parquet datasets in folder, every export
+        adds new files, written files are never rewritten. Exported runs are recorded in the manifest,
+        an export interrupted after writing a file but before recording it is recovered from the runs dataset.
+        Exports of several application instances are serialized with the lock file of the folder.
+    """
+
+    def __init__(self, folder=None):
+        self.folder = folder or get_default_export_path()
+        self.manifest_path = os.path.join(self.folder, MANIFEST_FILE_NAME)
+
+    def load_manifest(self):
+        # file path relative to the runs dataset: exported run ids
+        try:
+            with open(self.manifest_path) as manifest_file:
+                return json.load(manifest_file)['files']
+        except FileNotFoundError:
+            return {}
+
+    def save_manifest(self, files):
+        temporary_path = get_temporary_path(self.manifest_path)
+        with open(temporary_path, 'w') as manifest_file:
+            json.dump({'files': files}, manifest_file, sort_keys=True)
+        os.replace(temporary_path, self.manifest_path)
+
+    def iter_part_files(self, dataset):
+        dataset_folder = os.path.join(self.folder, dataset)
+        for folder, _, file_names in os.walk(dataset_folder):
+            for file_name in file_names:
+                if file_name.endswith(PART_FILE_SUFFIX) and not file_name.startswith(('.', '_')):
+                    yield os.path.relpath(os.path.join(folder, file_name), dataset_folder)
+
+    def recover_manifest(self, files):
+        """
+            Adds the runs files missing in the manifest, removes samples files without their runs file,
+            both are left by an interrupted export. Returns True when files were changed.
+        """
+        _, pq = import_pyarrow()
+        is_changed = False
+        for path in self.iter_part_files(RUNS_DATASET):
+            if path not in files:
+                table = pq.read_table(os.path.join(self.folder, RUNS_DATASET, path), columns=['run_id'])
+                files[path] = table.column('run_id').to_pylist()
+                is_changed = True
+        for path in self.iter_part_files(SAMPLES_DATASET):
+            if path not in files:
+                os.remove(os.path.join(self.folder, SAMPLES_DATASET, path))
+        return is_changed
+
+    def export(self, run_store, compound=None, kind=None, started_from=None, started_to=None):
+        """
+            Exports the complete and partial runs of the run store, which aren't exported yet and match the filter
+            of RunStore.find_runs. Returns (exported runs count, written files count).
+        """
+        import_pyarrow()
+        if os.path.exists(self.folder) is False:
+            os.makedirs(self.folder)
+
+        with open(os.path.join(self.folder, LOCK_FILE_NAME), 'a+b') as lock:
+            lock_file(lock, is_blocking=True)
+            files = self.load_manifest()
+            if self.recover_manifest(files):
+                self.save_manifest(files)
+            exported_run_ids = {run_id for run_ids in files.values() for run_id in run_ids}
+
+            partitions = OrderedDict()
+            for record in run_store.find_runs(compound, kind, started_from, started_to):
+                if record.status in EXPORTED_STATUSES and record.id not in exported_run_ids:
+                    partitions.setdefault(get_partition_folder(record), []).append(record)
+
+            # queries read the files of the manifest, the files of an export are added at once when it's done,
+            # files of an interrupted export are recovered by the next one
+            try:
+                for partition_folder, records in partitions.items():
+                    files[self.write_partition(run_store, partition_folder, records)] = [record.id
+                                                                                         for record in records]
+            finally:
+                if partitions:
+                    self.save_manifest(files)
+        return sum(len(records) for records in partitions.values()), len(partitions)
+
+    def write_partition(self, run_store, partition_folder, records):
+        """
+            Writes the samples file and then the runs file of the runs, the runs file marks the runs exported.
+            Returns the file path relative to the datasets.
+        """
+        pa, pq = import_pyarrow()
+
+        run_ids = [record.id for record in records]
+        # run ids of the store are unique and exported once, so the names of the files of a partition don't collide
+        path = os.path.join(partition_folder, f'part-{min(run_ids):08d}-{max(run_ids):08d}{PART_FILE_SUFFIX}')
+        samples_schema = get_samples_schema(pa)
+        rows = []
+        with self.open_part_file(SAMPLES_DATASET, path) as file_path:
+            with pq.ParquetWriter(file_path, samples_schema, compression=COMPRESSION) as writer:
+                for record in records:
+                    samples = run_store.load_samples(record.id)
+                    rows.append(create_run_row(record, samples, run_store.get_analysis(record.id)))
+                    # every run is written as its own row groups, their run_id statistics let readers
+                    # skip the row groups of other runs
+                    run_id = pa.repeat(pa.scalar(record.id, pa.int64()), samples.shape[1])
+                    writer.write_table(pa.Table.from_arrays([run_id] + [pa.array(values) for values in samples],
+                                                            schema=samples_schema))
+
+        with self.open_part_file(RUNS_DATASET, path) as file_path:
+            pq.write_table(pa.Table.from_pylist(rows, schema=get_runs_schema(pa)), file_path, compression=COMPRESSION)
+        return path
+
+    def open_part_file(self, dataset, path):
+        return PartFile(os.path.join(self.folder, dataset, path))
+
+
+class PartFile:
+    """
+        Context manager of a new dataset file, it is written to a hidden temporary file of the same folder,
+        which is moved to path when the writing succeeds, so readers never see a file in the middle of writing.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        folder, file_name = os.path.split(path)
+        self.temporary_path = os.path.join(folder, '.' + os.path.basename(get_temporary_path(file_name)))
+
+    def __enter__(self):
+        folder = os.path.dirname(self.path)
+        if os.path.exists(folder) is False:
+            os.makedirs(folder)
+        return self.temporary_path
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            os.replace(self.temporary_path, self.path)
+        elif os.path.exists(self.temporary_path):
+            os.remove(self.temporary_path)
+        return False
+
+
+def get_partition_values(path):
+    # kind=<kind>/compound=<compound>/date=<date>/part-<first run id>-<last run id>.parquet
+    return dict(part.split('=', 1) for part in os.path.normpath(path).split(os.sep)[:len(PARTITION_FIELDS)])
+
+
+def is_partition_selected(path, compound=None, kind=None, started_from=None, started_to=None):
+    values = get_partition_values(path)
+    return (compound is None or unquote(values['compound']) == compound) and \
+        (kind is None or unquote(values['kind']) == kind) and \
+        (started_from is None or values['date'] >= started_from.date().isoformat()) and \
+        (started_to is None or values['date'] <= started_to.date().isoformat())
+
+
+def open_dataset(folder, dataset, compound=None, kind=None, started_from=None, started_to=None):
+    """
+        Returns pyarrow.dataset.Dataset of the runs or samples dataset, kind, compound and date partition fields
+        are its string columns. The files are taken from the manifest, only the files of the partitions matching
+        the filter are opened, the dataset folder isn't listed.
+    """
+    pa, _ = import_pyarrow()
+    import pyarrow.dataset as ds
+
+    partition_schema = pa.schema([(field, pa.string()) for field in PARTITION_FIELDS])
+    schema = get_runs_schema(pa) if dataset == RUNS_DATASET else get_samples_schema(pa)
+    dataset_folder = os.path.join(folder, dataset)
+    paths = [os.path.join(dataset_folder, path) for path in sorted(ParquetExporter(folder).load_manifest())
+             if is_partition_selected(path, compound, kind, started_from, started_to)]
+    return ds.dataset(paths, schema=pa.unify_schemas([schema, partition_schema]), format='parquet',
+                      partitioning=ds.partitioning(partition_schema, flavor='hive'), partition_base_dir=dataset_folder)
+
+
+def combine_conditions(conditions):
+    expression = None
+    for condition in conditions:
+        expression = condition if expression is None else expression & condition
+    return expression
+
+
+def get_partition_conditions(compound=None, kind=None, started_from=None, started_to=None):
+    # partition fields select the folders which are read
+    import pyarrow.dataset as ds
+
+    conditions = []
+    if compound is not None:
+        conditions.append(ds.field('compound') == compound)
+    if kind is not None:
+        conditions.append(ds.field('kind') == kind)
+    if started_from is not None:
+        conditions.append(ds.field('date') >= started_from.date().isoformat())
+    if started_to is not None:
+        conditions.append(ds.field('date') <= started_to.date().isoformat())
+    return conditions
+
+
+def get_runs_filter(compound=None, kind=None, started_from=None, started_to=None):
+    """
+        Returns the runs dataset filter expression of RunStore.find_runs arguments or None. Partition fields
+        select the folders which are read, the start time is checked against started_at statistics of the row groups
+        and then against every run.
+    """
+    pa, _ = import_pyarrow()
+    import pyarrow.dataset as ds
+
+    conditions = get_partition_conditions(compound, kind, started_from, started_to)
+    if started_from is not None:
+        conditions.append(ds.field('started_at') >= pa.scalar(started_from, pa.timestamp('s')))
+    if started_to is not None:
+        conditions.append(ds.field('started_at') <= pa.scalar(started_to, pa.timestamp('s')))
+    return combine_conditions(conditions)
+
+
+def read_runs(folder=None, compound=None, kind=None, started_from=None, started_to=None, columns=None):
+    """
+        Returns pyarrow.Table of the exported runs matching the filter, like RunStore.find_runs,
+        only the matching partitions are read.
+    """
+    dataset = open_dataset(folder or get_default_export_path(), RUNS_DATASET, compound, kind, started_from, started_to)
+    return dataset.to_table(columns=columns, filter=get_runs_filter(compound, kind, started_from, started_to))
+
+
+def read_samples(folder=None, run_ids=None, compound=None, kind=None, started_from=None, started_to=None,
+                 columns=None):
+    """
+        Returns pyarrow.Table of the samples of the exported runs matching the filter and run_ids,
+        only the row groups of the matching runs in the matching partitions are read.
+    """
+    import pyarrow.dataset as ds
+
+    folder = folder or get_default_export_path()
+    if started_from is not None or started_to is not None:
+        # samples have no start time, the runs started in the time range are found in the runs dataset
+        matching_run_ids = read_runs(folder, compound, kind, started_from, started_to,
+                                     columns=['run_id']).column('run_id').to_pylist()
+        run_ids = matching_run_ids if run_ids is None else sorted(set(run_ids) & set(matching_run_ids))
+    conditions = get_partition_conditions(compound, kind, started_from, started_to)
+    if run_ids is not None:
+        conditions.append(ds.field('run_id').isin(list(run_ids)))
+    dataset = open_dataset(folder, SAMPLES_DATASET, compound, kind, started_from, started_to)
+    return dataset.to_table(columns=columns, filter=combine_conditions(conditions))
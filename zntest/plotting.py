@@ -0,0 +1,359 @@
+from tkinter import BOTH, TOP
+
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+from matplotlib.figure import Figure
+from matplotlib.lines import Line2D
+
+# (x label, y label, x column, y column) of every live plot, columns are indexes in a (t, volt, curr) chunk
+PLOTS = (
+    ('time (sec)', 'potential (V)', 0, 1),
+    ('time (sec)', 'current (uA)', 0, 2),
+    ('potential (V)', 'current (uA)', 1, 2),
+)
+MAX_ARCHIVED_RUNS = 3
+AXES_GROWTH_FACTOR = 1.5
+
+
+class MinMaxDecimator:
+    """
+        Class keeping a growing (x, y) trace decimated to a fixed number of bins.
+        Every bin holds the points with minimal and maximal y of its samples, when all bins are filled
+        neighbouring bins are merged and a bin covers twice as many samples. Memory use and the number of
+        points to draw don't depend on the number of added samples.
+    """
+
+    def __init__(self, bins_count):
+        self.bins_count = max(2, bins_count - bins_count % 2)
+        self.samples_per_bin = 1
+        self.samples_count = 0
+        self.bins_filled = 0
+
+        # x, y and sample index of minimal and maximal y in every bin, the last slot is for the partial bin
+        self.x_min = np.empty(self.bins_count + 1)
+        self.y_min = np.empty(self.bins_count + 1)
+        self.i_min = np.empty(self.bins_count + 1, dtype=np.int64)
+        self.x_max = np.empty(self.bins_count + 1)
+        self.y_max = np.empty(self.bins_count + 1)
+        self.i_max = np.empty(self.bins_count + 1, dtype=np.int64)
+        self.partial_count = 0
+
+        self.points_x = np.empty(2 * (self.bins_count + 1))
+        self.points_y = np.empty(2 * (self.bins_count + 1))
+
+    def add(self, x, y):
+        start = 0
+        while start < len(x):
+            if self.bins_filled == self.bins_count:
+                self.merge_bins()
+
+            remaining_count = len(x) - start
+            if self.partial_count > 0 or remaining_count < self.samples_per_bin:
+                take_count = min(self.samples_per_bin - self.partial_count, remaining_count)
+                self.add_to_partial_bin(x[start:start + take_count], y[start:start + take_count])
+                start += take_count
+            else:
+                bins_count = min(remaining_count // self.samples_per_bin, self.bins_count - self.bins_filled)
+                start += self.add_full_bins(x[start:], y[start:], bins_count)
+
+    def add_full_bins(self, x, y, bins_count):
+        samples_count = bins_count * self.samples_per_bin
+        x_bins = x[:samples_count].reshape(bins_count, self.samples_per_bin)
+        y_bins = y[:samples_count].reshape(bins_count, self.samples_per_bin)
+        rows = np.arange(bins_count)
+        arg_min = y_bins.argmin(axis=1)
+        arg_max = y_bins.argmax(axis=1)
+
+        bins = slice(self.bins_filled, self.bins_filled + bins_count)
+        first_index = self.samples_count + rows * self.samples_per_bin
+        self.x_min[bins] = x_bins[rows, arg_min]
+        self.y_min[bins] = y_bins[rows, arg_min]
+        self.i_min[bins] = first_index + arg_min
+        self.x_max[bins] = x_bins[rows, arg_max]
+        self.y_max[bins] = y_bins[rows, arg_max]
+        self.i_max[bins] = first_index + arg_max
+
+        self.bins_filled += bins_count
+        self.samples_count += samples_count
+        return samples_count
+
+    def add_to_partial_bin(self, x, y):
+        partial = self.bins_filled
+        arg_min = y.argmin()
+        arg_max = y.argmax()
+        if self.partial_count == 0 or y[arg_min] < self.y_min[partial]:
+            self.x_min[partial], self.y_min[partial], self.i_min[partial] = x[arg_min], y[arg_min], \
+                                                                            self.samples_count + arg_min
+        if self.partial_count == 0 or y[arg_max] > self.y_max[partial]:
+            self.x_max[partial], self.y_max[partial], self.i_max[partial] = x[arg_max], y[arg_max], \
+                                                                            self.samples_count + arg_max
+        self.partial_count += len(x)
+        self.samples_count += len(x)
+
+        if self.partial_count == self.samples_per_bin:
+            self.bins_filled += 1
+            self.partial_count = 0
+
+    def merge_bins(self):
+        half = self.bins_count // 2
+        partial = self.bins_count
+        is_partial_pending = self.partial_count > 0
+
+        for x, y, i, is_better in ((self.x_min, self.y_min, self.i_min, np.less_equal),
+                                   (self.x_max, self.y_max, self.i_max, np.greater_equal)):
+            take_first = is_better(y[0:partial:2], y[1:partial:2])
+            x[:half] = np.where(take_first, x[0:partial:2], x[1:partial:2])
+            y[:half] = np.where(take_first, y[0:partial:2], y[1:partial:2])
+            i[:half] = np.where(take_first, i[0:partial:2], i[1:partial:2])
+            if is_partial_pending:
+                x[half], y[half], i[half] = x[partial], y[partial], i[partial]
+
+        self.bins_filled = half
+        self.samples_per_bin *= 2
+
+    def get_points(self):
+        count = self.bins_filled + (1 if self.partial_count > 0 else 0)
+        is_min_first = self.i_min[:count] <= self.i_max[:count]
+        points_x = self.points_x[:2 * count]
+        points_y = self.points_y[:2 * count]
+        points_x[0::2] = np.where(is_min_first, self.x_min[:count], self.x_max[:count])
+        points_x[1::2] = np.where(is_min_first, self.x_max[:count], self.x_min[:count])
+        points_y[0::2] = np.where(is_min_first, self.y_min[:count], self.y_max[:count])
+        points_y[1::2] = np.where(is_min_first, self.y_max[:count], self.y_min[:count])
+        return points_x, points_y
+
+
+class MinMaxPyramid:
+    """
+        Class keeping level of detail pyramid of a run: min/max decimations with base_samples_per_bin samples
+        per bin at the first level and twice as many at every next one, down to a few bins.
+        Bins are taken over sample indexes. The samples visible in an x range are found by bisection when x is
+        monotonic, e.g. t of any run, and from the x extent of every first level bin otherwise, e.g. volt of
+        pulse resolved square wave runs or runs starting at a quiet value apart from the start value. Samples
+        aren't kept, the pyramid takes about as much memory as 4 / base_samples_per_bin of the run.
+    """
+
+    def __init__(self, x, y, base_samples_per_bin=8, min_bins_count=64):
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        self.samples_count = len(x)
+        self.is_x_descending = len(x) > 1 and x[-1] < x[0]
+        self.base_samples_per_bin = base_samples_per_bin
+        # x of the first sample of every first level bin and the last sample, they bound the bins of monotonic x
+        self.x_bounds = np.append(x[::base_samples_per_bin], x[-1:]) if len(x) else np.empty(0)
+        self.x_range = (x.min(), x.max()) if len(x) else (np.nan, np.nan)
+        x_steps = np.diff(x)
+        self.is_x_monotonic = bool(np.all(x_steps >= 0) or np.all(x_steps <= 0))
+
+        # every level is (x_min, y_min, i_min, x_max, y_max, i_max) arrays with a value per bin
+        self.levels = []
+        bins_count = -(-len(x) // base_samples_per_bin)
+        padded_count = bins_count * base_samples_per_bin
+        # the last bin is padded with its last sample, it doesn't change the bin min and max
+        indexes = np.minimum(np.arange(padded_count), len(x) - 1).reshape(bins_count, base_samples_per_bin)
+        y_bins = y[indexes]
+        if not self.is_x_monotonic:
+            x_bins = x[indexes]
+            self.bin_x_low = x_bins.min(axis=1)
+            self.bin_x_high = x_bins.max(axis=1)
+        rows = np.arange(bins_count)
+        arg_min = indexes[rows, y_bins.argmin(axis=1)]
+        arg_max = indexes[rows, y_bins.argmax(axis=1)]
+        level = (x[arg_min], y[arg_min], arg_min, x[arg_max], y[arg_max], arg_max)
+        self.levels.append(level)
+        while len(level[0]) > min_bins_count:
+            level = self.merge_level(level)
+            self.levels.append(level)
+
+    @staticmethod
+    def merge_level(level):
+        x_min, y_min, i_min, x_max, y_max, i_max = level
+        if len(x_min) % 2:
+            # the odd last bin is merged with itself
+            level = tuple(np.append(values, values[-1:]) for values in level)
+            x_min, y_min, i_min, x_max, y_max, i_max = level
+        take_min_first = y_min[0::2] <= y_min[1::2]
+        take_max_first = y_max[0::2] >= y_max[1::2]
+        return (np.where(take_min_first, x_min[0::2], x_min[1::2]),
+                np.where(take_min_first, y_min[0::2], y_min[1::2]),
+                np.where(take_min_first, i_min[0::2], i_min[1::2]),
+                np.where(take_max_first, x_max[0::2], x_max[1::2]),
+                np.where(take_max_first, y_max[0::2], y_max[1::2]),
+                np.where(take_max_first, i_max[0::2], i_max[1::2]))
+
+    def get_index_range(self, x_low, x_high):
+        """
+            Returns (start, end) indexes of the samples in [x_low; x_high] rounded out to the first level bins.
+            For non-monotonic x it spans from the first to the last bin with samples in the range.
+        """
+        if not self.is_x_monotonic:
+            visible_bins = np.flatnonzero((self.bin_x_high >= x_low) & (self.bin_x_low <= x_high))
+            if len(visible_bins) == 0:
+                return 0, 0
+            end = min((int(visible_bins[-1]) + 1) * self.base_samples_per_bin, self.samples_count)
+            return int(visible_bins[0]) * self.base_samples_per_bin, end
+        bounds = -self.x_bounds if self.is_x_descending else self.x_bounds
+        low, high = (-x_high, -x_low) if self.is_x_descending else (x_low, x_high)
+        start_bin = max(int(np.searchsorted(bounds, low, side='right')) - 1, 0)
+        end_bin = int(np.searchsorted(bounds, high, side='left'))
+        end = min(end_bin * self.base_samples_per_bin, self.samples_count)
+        return min(start_bin * self.base_samples_per_bin, end), end
+
+    def get_points(self, start, end, max_points_count):
+        """
+            Returns (x, y) of the samples from start to end at the coarsest level which still has at least
+            max_points_count / 2 points, every bin gives its min and max in the order of samples.
+        """
+        if start >= end:
+            return np.empty(0), np.empty(0)
+        samples_per_bin = self.base_samples_per_bin
+        level_index = 0
+        while level_index + 1 < len(self.levels) and \
+                (end - start) // (samples_per_bin * 2) >= max_points_count // 4:
+            level_index += 1
+            samples_per_bin *= 2
+
+        x_min, y_min, i_min, x_max, y_max, i_max = self.levels[level_index]
+        bins = slice(start // samples_per_bin, -(-end // samples_per_bin))
+        is_min_first = i_min[bins] <= i_max[bins]
+        points_x = np.empty(2 * len(is_min_first))
+        points_y = np.empty(2 * len(is_min_first))
+        points_x[0::2] = np.where(is_min_first, x_min[bins], x_max[bins])
+        points_x[1::2] = np.where(is_min_first, x_max[bins], x_min[bins])
+        points_y[0::2] = np.where(is_min_first, y_min[bins], y_max[bins])
+        points_y[1::2] = np.where(is_min_first, y_max[bins], y_min[bins])
+        return points_x, points_y
+
+
+class LivePlot:
+    """
+        Class embedding live plots of the running test into the Tk window.
+        Traces are decimated to about one min/max pair per pixel column and redrawn with blitting,
+        so redraw cost doesn't grow with the number of acquired samples. The traces of the previous runs
+        are kept greyed out in the background, only the last MAX_ARCHIVED_RUNS are kept.
+    """
+
+    def __init__(self, parent):
+        self.figure = Figure(figsize=(4.6, 6.0), dpi=100)
+        self.axes = []
+        self.lines = []
+        self.legends = []
+        for plot_index, (x_label, y_label, _, _) in enumerate(PLOTS):
+            axes = self.figure.add_subplot(len(PLOTS), 1, plot_index + 1)
+            axes.set_xlabel(x_label)
+            axes.set_ylabel(y_label)
+            axes.grid(True)
+            self.axes.append(axes)
+            line = axes.plot([], [], animated=True)[0]
+            self.lines.append(line)
+            # the legend is drawn into the blit background with a static copy of the line, the animated line
+            # would leave its handle blank, start_run only changes the legend text
+            legend = axes.legend(handles=[Line2D([], [], color=line.get_color())], labels=[''],
+                                 loc='upper right', fontsize='small')
+            legend.set_visible(False)
+            self.legends.append(legend)
+        self.figure.tight_layout()
+        self.archived_lines = []
+
+        if parent is not None:
+            self.canvas = FigureCanvasTkAgg(self.figure, master=parent)
+            self.canvas.get_tk_widget().pack(side=TOP, fill=BOTH, expand=True)
+        else:
+            # without a parent the plot is rendered off screen, e.g. by benchmarks
+            self.canvas = FigureCanvasAgg(self.figure)
+        self.background = None
+        self.canvas.mpl_connect('draw_event', self.on_draw)
+
+        self.decimators = []
+        self.limits = []
+        self.canvas.draw()
+
+    def start_run(self, title, bounds=None):
+        """
+            bounds are (low, high) of the t, volt and curr columns known before the run or None,
+            the axes are laid out for them at once, so known ranges don't cause redraws during the run.
+        """
+        self.archive_lines()
+        self.decimators = [MinMaxDecimator(int(axes.bbox.width)) for axes in self.axes]
+        self.limits = [[None, None] for _ in PLOTS]
+        for plot_index, (_, _, x_column, y_column) in enumerate(PLOTS):
+            for axis_index, column in enumerate((x_column, y_column)):
+                if bounds is not None and bounds[column] is not None:
+                    self.set_axis_limits(plot_index, axis_index, *bounds[column])
+        for line, legend in zip(self.lines, self.legends):
+            line.set_data([], [])
+            line.set_label(title)
+            legend.get_texts()[0].set_text(title)
+            legend.set_visible(True)
+        self.canvas.draw_idle()
+
+    def archive_lines(self):
+        if not any(len(line.get_xdata()) for line in self.lines):
+            return
+        archived = []
+        for axes, line in zip(self.axes, self.lines):
+            archived.append(axes.plot(*line.get_data(), color='0.7', linewidth=0.8, zorder=1)[0])
+        self.archived_lines.append(archived)
+        while len(self.archived_lines) > MAX_ARCHIVED_RUNS:
+            for line in self.archived_lines.pop(0):
+                line.remove()
+
+    def clear(self):
+        for archived in self.archived_lines:
+            for line in archived:
+                line.remove()
+        self.archived_lines = []
+        for line, legend in zip(self.lines, self.legends):
+            line.set_data([], [])
+            legend.set_visible(False)
+        self.canvas.draw_idle()
+
+    def add_samples(self, t, volt, curr):
+        columns = (t, volt, curr)
+        is_relayout_needed = False
+        for plot_index, (_, _, x_column, y_column) in enumerate(PLOTS):
+            decimator = self.decimators[plot_index]
+            decimator.add(columns[x_column], columns[y_column])
+            points_x, points_y = decimator.get_points()
+            self.lines[plot_index].set_data(points_x, points_y)
+            is_relayout_needed |= self.update_limits(plot_index, points_x, points_y)
+
+        if is_relayout_needed or self.background is None:
+            # limits grow geometrically, so full redraws happen only a few times per run
+            self.canvas.draw()
+        else:
+            self.blit()
+
+    def update_limits(self, plot_index, points_x, points_y):
+        is_changed = False
+        for axis_index, points in enumerate((points_x, points_y)):
+            low, high = points.min(), points.max()
+            limits = self.limits[plot_index][axis_index]
+            if limits is None or low < limits[0] or limits[1] < high:
+                if limits is not None:
+                    low, high = min(low, limits[0]), max(high, limits[1])
+                self.set_axis_limits(plot_index, axis_index, low, high)
+                is_changed = True
+        return is_changed
+
+    def set_axis_limits(self, plot_index, axis_index, low, high):
+        span = max(high - low, 1e-6)
+        margin = span * (AXES_GROWTH_FACTOR - 1.0) / 2.0
+        limits = (low - margin, high + margin)
+        self.limits[plot_index][axis_index] = limits
+        if axis_index == 0:
+            self.axes[plot_index].set_xlim(*limits)
+        else:
+            self.axes[plot_index].set_ylim(*limits)
+
+    def on_draw(self, event):
+        self.background = self.canvas.copy_from_bbox(self.figure.bbox)
+        for axes, line in zip(self.axes, self.lines):
+            axes.draw_artist(line)
+
+    def blit(self):
+        self.canvas.restore_region(self.background)
+        for axes, line in zip(self.axes, self.lines):
+            axes.draw_artist(line)
+        self.canvas.blit(self.figure.bbox)
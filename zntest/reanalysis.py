@@ -0,0 +1,192 @@
+import csv
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import numpy as np
+
+import zntest.analysis as analysis
+import zntest.recipe as recipe
+import zntest.runfile as runfile
+import zntest.squarewave as squarewave
+from zntest.locking import get_temporary_path
+from zntest.measurement import MeasurementRun, create_run_metadata
+from zntest.store import RUN_FILE_NAME_PATTERN, RUN_FILE_TIMESTAMP_FORMAT, STARTED_AT_FORMAT
+
+RESULTS_FIELDS = ('kind', 'compound', 'started_at', 'path', 'samples_count', 'peak_potential', 'peak_height',
+                  'peak_area', 'concentration', 'charge', 'mean_current', 'final_current', 'error')
+CONSTANT_VOLTAGE_RESULT_FIELDS = ('charge', 'mean_current', 'final_current')
+PROGRESS_INTERVAL_SEC = 1.0
+
+
+def get_default_output_folder():
+    return os.path.join(os.getcwd(), 'data', 'out')
+
+
+def discover_run_files(output_folder):
+    """
+        Returns (kind, path, compound, started_at) of every per-run file named <compound>__<timestamp>.csv
+        or <compound>__<timestamp>.zrun.
+    """
+    run_files = []
+    for kind in (recipe.CONSTANT_VOLTAGE_TEST_KIND, recipe.SQUARE_WAVE_VOLTAMMETRY_TEST_KIND):
+        kind_folder = os.path.join(output_folder, kind)
+        if os.path.exists(kind_folder) is False:
+            continue
+        file_names = sorted(os.listdir(kind_folder))
+        run_file_names = set(file_names)
+        for file_name in file_names:
+            if RUN_FILE_NAME_PATTERN.match(file_name) and \
+                    os.path.splitext(file_name)[0] + runfile.RUN_FILE_EXTENSION in run_file_names:
+                # CSV exported from a binary run file is the same run
+                continue
+            match = RUN_FILE_NAME_PATTERN.match(file_name) or runfile.RUN_FILE_NAME_PATTERN.match(file_name)
+            if match is not None:
+                run_files.append((kind, os.path.join(kind_folder, file_name), match.group('compound'),
+                                  match.group('started_at')))
+    return run_files
+
+
+def parse_run_file_content(content):
+    """
+        Parses run file content into (3, samples count) array of t, volt and curr rows. All rows end with the same
+        compound field, so it is replaced by a separator and the numbers are parsed with a single np.fromstring call.
+    """
+    lines = content.split(b'\n', 2)
+    if len(lines) < 2 or not lines[1].strip():
+        return np.empty((3, 0))
+    compound_suffix = b',' + lines[1].rstrip(b'\r').split(b',', 3)[3]
+    numbers_text = content[len(lines[0]) + 1:].replace(compound_suffix + b'\r\n', b',') \
+        .replace(compound_suffix + b'\n', b',').rstrip(b',\r\n')
+    values = np.fromstring(numbers_text.decode('ascii'), dtype=float, sep=',')
+    if len(values) % 3 != 0:
+        raise ValueError('unexpected number of values')
+    return np.ascontiguousarray(values.reshape(-1, 3).T)
+
+
+def summarize_constant_voltage(t, curr):
+    if len(t) == 0:
+        return {field: float('nan') for field in CONSTANT_VOLTAGE_RESULT_FIELDS}
+    return {
+        'charge': float(analysis.integrate_trapezoid(curr, t)),
+        'mean_current': float(curr.mean()),
+        'final_current': float(curr[-1]),
+    }
+
+
+def get_analysis_fingerprint(calibration):
+    # anything changing analysis results is a part of the content hash
+    return json.dumps([analysis.ANALYSIS_VERSION, analysis.DEFAULT_ANALYSIS_SETTINGS,
+                       calibration._asdict() if calibration is not None else None]).encode()
+
+
+def analyze_run_file(task):
+    """
+        Process pool task. Returns (path, content hash, result), result is None when the content hash equals
+        the cached one, so the file doesn't have to be parsed again.
+    """
+    kind, path, compound, started_at, cached_hash, calibration = task
+    with open(path, 'rb') as run_file:
+        content = run_file.read()
+    content_hash = hashlib.sha1(content + get_analysis_fingerprint(calibration)).hexdigest()
+    if content_hash == cached_hash:
+        return path, content_hash, None
+
+    if path.endswith(runfile.RUN_FILE_EXTENSION):
+        run = runfile.open_run(path)
+    else:
+        try:
+            samples = parse_run_file_content(content)
+        except ValueError:
+            samples = np.loadtxt(path, delimiter=',', skiprows=1, usecols=(0, 1, 2), ndmin=2, unpack=True)
+        run = MeasurementRun(samples, create_run_metadata(compound, kind, None,
+                                                          datetime.strptime(started_at, RUN_FILE_TIMESTAMP_FORMAT)))
+
+    result = {'samples_count': len(run)}
+    if kind == recipe.SQUARE_WAVE_VOLTAMMETRY_TEST_KIND:
+        if len(run) > 0:
+            # a run whose samples don't make the steps of its param is reported in the error column
+            try:
+                voltammogram = squarewave.get_voltammogram(run)
+            except ValueError as e:
+                result['error'] = str(e)
+            else:
+                result.update(analysis.analyze_square_wave_voltammetry(*voltammogram, calibration=calibration))
+    else:
+        result.update(summarize_constant_voltage(run.t, run.curr))
+    return path, content_hash, result
+
+
+def load_cache(cache_path):
+    if os.path.exists(cache_path) is False:
+        return {}
+    with open(cache_path, 'r', encoding='utf-8') as cache_file:
+        return json.load(cache_file)
+
+
+def save_cache(cache, cache_path):
+    temporary_path = get_temporary_path(cache_path)
+    with open(temporary_path, 'w', encoding='utf-8') as cache_file:
+        json.dump(cache, cache_file)
+    os.replace(temporary_path, cache_path)
+
+
+def write_results(run_files, cache, results_path):
+    with open(results_path, 'w', encoding='utf-8', newline='') as results_csv:
+        writer = csv.DictWriter(results_csv, fieldnames=RESULTS_FIELDS, extrasaction='ignore')
+        writer.writeheader()
+        for kind, path, compound, started_at in run_files:
+            row = {'kind': kind, 'compound': compound, 'path': os.path.relpath(path, os.path.dirname(results_path))}
+            row['started_at'] = datetime.strptime(started_at, RUN_FILE_TIMESTAMP_FORMAT).strftime(STARTED_AT_FORMAT)
+            row.update(cache[path]['result'])
+            writer.writerow(row)
+
+
+def reanalyze(output_folder=None, workers=None, chunk_size=None, is_forced=False, calibration=None,
+              progress_stream=sys.stderr):
+    """
+        Analyzes every per-run file of output_folder in a process pool and writes reanalysis.csv results table.
+        Files whose content, analysis version and calibration are unchanged since the last reanalysis are skipped.
+        Returns (analyzed files count, skipped files count).
+    """
+    output_folder = output_folder or get_default_output_folder()
+    cache_path = os.path.join(output_folder, 'reanalysis_cache.json')
+    results_path = os.path.join(output_folder, 'reanalysis.csv')
+
+    run_files = discover_run_files(output_folder)
+    cache = {} if is_forced else load_cache(cache_path)
+    tasks = [(kind, path, compound, started_at, cache.get(path, {}).get('hash'), calibration)
+             for kind, path, compound, started_at in run_files]
+    workers = workers or os.cpu_count() or 1
+    # a few chunks per worker keep all workers busy while the scheduling overhead stays small
+    chunk_size = chunk_size or max(1, len(tasks) // (workers * 4))
+
+    analyzed_count = 0
+    skipped_count = 0
+    started_at = time.perf_counter()
+    last_progress_at = started_at
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for done_count, (path, content_hash, result) in enumerate(executor.map(analyze_run_file, tasks,
+                                                                               chunksize=chunk_size), 1):
+            if result is None:
+                skipped_count += 1
+            else:
+                cache[path] = {'hash': content_hash, 'result': result}
+                analyzed_count += 1
+
+            now = time.perf_counter()
+            if progress_stream is not None and (now - last_progress_at >= PROGRESS_INTERVAL_SEC or
+                                                done_count == len(tasks)):
+                last_progress_at = now
+                print(f'{done_count}/{len(tasks)} files, {done_count / max(now - started_at, 1e-9):.1f} files/s',
+                      file=progress_stream)
+
+    known_paths = {path for _, path, _, _ in run_files}
+    cache = {path: entry for path, entry in cache.items() if path in known_paths}
+    save_cache(cache, cache_path)
+    write_results(run_files, cache, results_path)
+    return analyzed_count, skipped_count
@@ -0,0 +1,136 @@
+import json
+
+CONSTANT_VOLTAGE_TEST_KIND = 'constant'
+SQUARE_WAVE_VOLTAMMETRY_TEST_KIND = 'squarewave'
+
+# (recipe key, test kind, default title) of every step of the Zn test sequence, in the order they are run
+SEQUENCE_STEPS = (
+    ('constant_voltage_test_1', CONSTANT_VOLTAGE_TEST_KIND, 'Constant Voltage Test #1'),
+    ('constant_voltage_test_2', CONSTANT_VOLTAGE_TEST_KIND, 'Constant Voltage Test #2'),
+    ('square_wave_voltammetry_test', SQUARE_WAVE_VOLTAMMETRY_TEST_KIND, 'Square Wave Voltammetry'),
+)
+
+# parameter name: (type, minimal value, maximal value)
+CONSTANT_VOLTAGE_TEST_PARAM = {
+    'quietValue': (float, -10.0, 10.0),
+    'quietTime': (int, 0, 10000),
+    'value': (float, -10.0, 10.0),
+    'duration': (int, 1000, 100000),
+}
+SQUARE_WAVE_VOLTAMMETRY_TEST_PARAM = {
+    'quietValue': (float, -10.0, 10.0),
+    'quietTime': (int, 0, 10000),
+    'amplitude': (float, 0.0, 10.0),
+    'startValue': (float, -10.0, 10.0),
+    'finalValue': (float, -10.0, 10.0),
+    'stepValue': (float, 0.001, 10.0),
+    'window': (float, 0.0, 1.0),
+}
+TEST_PARAM = {
+    CONSTANT_VOLTAGE_TEST_KIND: CONSTANT_VOLTAGE_TEST_PARAM,
+    SQUARE_WAVE_VOLTAMMETRY_TEST_KIND: SQUARE_WAVE_VOLTAMMETRY_TEST_PARAM,
+}
+SAMPLE_RATE_RANGE = (1, 200)
+MAX_COMPOUND_LENGTH = 15
+
+
+def create_test_context(kind, title, current_range, sample_rate, param, compound, save_data, create_plot=False,
+                        device=None):
+    """
+        Creates context taken by utils.run_constant_voltage_test and utils.run_square_wave_voltammetry_test.
+        Raises ValueError when any value is out of its range.
+    """
+    sample_rate = int(sample_rate)
+    if not (SAMPLE_RATE_RANGE[0] <= sample_rate <= SAMPLE_RATE_RANGE[1]):
+        raise ValueError(f'{title}: sample rate value must be in range [{SAMPLE_RATE_RANGE[0]}; '
+                         f'{SAMPLE_RATE_RANGE[1]}]')
+
+    param_ranges = TEST_PARAM[kind]
+    unknown_names = set(param) - set(param_ranges)
+    if unknown_names:
+        raise ValueError(f'{title}: unknown parameters {", ".join(sorted(unknown_names))}')
+    context_param = {}
+    for name, (value_type, minimal_value, maximal_value) in param_ranges.items():
+        if name not in param:
+            raise ValueError(f'{title}: parameter {name} is missing')
+        value = value_type(param[name])
+        if not (minimal_value <= value <= maximal_value):
+            raise ValueError(f'{title}: {name} must be in range [{minimal_value}; {maximal_value}]')
+        context_param[name] = value
+
+    if not compound or len(compound) > MAX_COMPOUND_LENGTH:
+        raise ValueError(f'Compound must be from 1 to {MAX_COMPOUND_LENGTH} characters long')
+
+    context = {}
+    context['kind'] = kind
+    context['title'] = title
+    context['current_range'] = current_range
+    context['sample_rate'] = sample_rate
+    context['param'] = context_param
+    context['create_plot'] = create_plot
+    context['compound'] = compound
+    context['save_data'] = save_data
+    if device is not None:
+        context['device'] = device
+    return context
+
+
+def load_recipe(recipe_file_path):
+    """
+        Loads recipe JSON file. A recipe has the settings of every sequence step keyed as in SEQUENCE_STEPS:
+        {"current_range": "100uA", "sample_rate": 100, "param": {...}, "title": optional,
+        "abort_on_anomaly": optional}, constant voltage tests are aborted on current range saturation or open circuit
+        unless "abort_on_anomaly" is false,
+        optional "save_constant_voltage_tests_output_data" and "save_square_wave_voltammetry_test_output_data"
+        flags (true by default), optional "port" and "samples" - list of compounds or
+        {"compound": ..., "replicates": ...} objects.
+        Optional "sequence" is the list of step keys run for every sample, e.g. to repeat square wave voltammetry
+        after another conditioning step, SEQUENCE_STEPS order is used by default.
+    """
+    with open(recipe_file_path, 'r', encoding='utf-8') as recipe_file:
+        recipe = json.load(recipe_file)
+    for step_key, _, _ in SEQUENCE_STEPS:
+        if step_key not in recipe:
+            raise ValueError(f'Recipe {recipe_file_path} has no {step_key} settings')
+    step_keys = {step_key for step_key, _, _ in SEQUENCE_STEPS}
+    for step_key in recipe.get('sequence', []):
+        if step_key not in step_keys:
+            raise ValueError(f'Recipe {recipe_file_path} sequence has unknown step {step_key}')
+    return recipe
+
+
+def get_recipe_samples(recipe):
+    samples = []
+    for sample in recipe.get('samples', []):
+        if isinstance(sample, str):
+            samples.append(sample)
+        else:
+            samples.extend([sample['compound']] * int(sample.get('replicates', 1)))
+    return samples
+
+
+def load_batch_samples(batch_file_path):
+    # one compound per line, empty lines and lines starting with # are skipped
+    with open(batch_file_path, 'r', encoding='utf-8') as batch_file:
+        return [line.strip() for line in batch_file if line.strip() and not line.lstrip().startswith('#')]
+
+
+def create_sequence_contexts(recipe, compound, device=None, create_plot=False):
+    """
+        Returns (test kind, context) pairs of the Zn test sequence for the compound.
+    """
+    steps = {step_key: (step_key, kind, default_title) for step_key, kind, default_title in SEQUENCE_STEPS}
+    sequence = [steps[step_key] for step_key in recipe['sequence']] if recipe.get('sequence') else SEQUENCE_STEPS
+    contexts = []
+    for step_key, kind, default_title in sequence:
+        step = recipe[step_key]
+        if kind == CONSTANT_VOLTAGE_TEST_KIND:
+            save_data = recipe.get('save_constant_voltage_tests_output_data', True)
+        else:
+            save_data = recipe.get('save_square_wave_voltammetry_test_output_data', True)
+        context = create_test_context(kind, step.get('title', default_title), step['current_range'],
+                                      step['sample_rate'], step['param'], compound, save_data, create_plot, device)
+        if 'abort_on_anomaly' in step:
+            context['abort_on_anomaly'] = bool(step['abort_on_anomaly'])
+        contexts.append((kind, context))
+    return contexts
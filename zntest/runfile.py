@@ -0,0 +1,185 @@
+import json
+import os
+import re
+import struct
+import time
+from datetime import datetime
+
+import numpy as np
+
+from zntest.locking import get_temporary_path, lock_file
+from zntest.measurement import MeasurementRun, create_run_metadata
+
+RUN_FILE_EXTENSION = '.zrun'
+# runs of the same compound started in the same second get _2, _3, ... suffixes
+RUN_FILE_NAME_PATTERN = re.compile(r'^(?P<compound>.*)__(?P<started_at>\d{4}-\d{2}-\d{2}__\d{2}-\d{2}-\d{2})'
+                                   r'(_\d+)?\.zrun$')
+MAGIC = b'ZNRUN'
+FORMAT_VERSION = 1
+# magic, format version, JSON header length
+PREFIX = struct.Struct('<5sBI')
+# samples start at a multiple of the alignment, so memory mapped columns are aligned for any dtype
+DATA_ALIGNMENT = 64
+SAMPLES_DTYPE = '<f8'
+COLUMNS = ('t', 'volt', 'curr')
+# every chunk is flushed to the OS at once, so it survives a crash of the application,
+# fsync, which protects it from a power loss, is done at most once in this interval
+SYNC_INTERVAL_SEC = 1.0
+
+# t, volt and curr rows are stored one after another, each is contiguous
+LAYOUT_COLUMNS = 'columns'
+# (t, volt, curr) records, written while the test is running, so samples can be appended
+LAYOUT_RECORDS = 'records'
+
+
+def encode_header(header):
+    header_json = json.dumps(header, sort_keys=True).encode()
+    data_offset = -(-(PREFIX.size + len(header_json)) // DATA_ALIGNMENT) * DATA_ALIGNMENT
+    # JSON is padded with spaces up to the data offset
+    header_json += b' ' * (data_offset - PREFIX.size - len(header_json))
+    return PREFIX.pack(MAGIC, FORMAT_VERSION, len(header_json)) + header_json
+
+
+def read_header(path):
+    """
+        Returns (header dict, data offset) of the run file.
+    """
+    with open(path, 'rb') as run_file:
+        prefix = run_file.read(PREFIX.size)
+        if len(prefix) < PREFIX.size:
+            raise ValueError(f'{path} is not a run file')
+        magic, version, header_length = PREFIX.unpack(prefix)
+        if magic != MAGIC:
+            raise ValueError(f'{path} is not a run file')
+        if version > FORMAT_VERSION:
+            raise ValueError(f'{path} has unsupported format version {version}')
+        header = json.loads(run_file.read(header_length))
+    return header, PREFIX.size + header_length
+
+
+def create_header(kind, context, start_time):
+    return {
+        'compound': context['compound'],
+        'kind': kind,
+        'title': context.get('title'),
+        'current_range': context.get('current_range'),
+        'sample_rate': context.get('sample_rate'),
+        'param': context.get('param', {}),
+        'device': context.get('device'),
+        'started_at': start_time.isoformat(timespec='seconds'),
+        'dtype': SAMPLES_DTYPE,
+        'columns': list(COLUMNS),
+        'layout': LAYOUT_RECORDS,
+        'samples_count': None,
+    }
+
+
+class RunFileWriter:
+    """
+        Class appending samples of a running test to a run file in the records layout.
+        finish_run_file rewrites the closed file into the columns layout, so readers get contiguous columns.
+        The file is created exclusively and locked while it is written, so another process neither writes
+        the same file nor recovers it as the file of an interrupted run. FileExistsError is raised when
+        the file exists.
+    """
+
+    def __init__(self, path, header, sync_interval=SYNC_INTERVAL_SEC):
+        self.path = path
+        self.header = dict(header, layout=LAYOUT_RECORDS, samples_count=None)
+        self.sync_interval = sync_interval
+        self.run_file = open(path, 'xb')
+        lock_file(self.run_file, is_blocking=True)
+        self.run_file.write(encode_header(self.header))
+        self.sync()
+        self.records = None
+
+    def write(self, t, volt, curr):
+        samples_count = len(t)
+        if self.records is None or len(self.records) < samples_count:
+            self.records = np.empty((samples_count, len(COLUMNS)), dtype=SAMPLES_DTYPE)
+        records = self.records[:samples_count]
+        records[:, 0] = t
+        records[:, 1] = volt
+        records[:, 2] = curr
+        self.run_file.write(records.tobytes())
+        self.run_file.flush()
+        if time.monotonic() - self.synced_at >= self.sync_interval:
+            self.sync()
+
+    def sync(self):
+        self.run_file.flush()
+        os.fsync(self.run_file.fileno())
+        self.synced_at = time.monotonic()
+
+    def close(self):
+        # closing the file releases its lock
+        if not self.run_file.closed:
+            self.sync()
+            self.run_file.close()
+
+
+def open_run(path, mode='r'):
+    """
+        Returns MeasurementRun of the run file. Samples are memory mapped, so only the pages which are touched
+        are read from disk. Samples of a file in the records layout are copied into the columns layout,
+        an incomplete last record of an interrupted run is ignored.
+    """
+    header, data_offset = read_header(path)
+    dtype = np.dtype(header['dtype'])
+    columns_count = len(header['columns'])
+    if header['layout'] == LAYOUT_COLUMNS:
+        samples_count = header['samples_count']
+    else:
+        samples_count = (os.path.getsize(path) - data_offset) // (dtype.itemsize * columns_count)
+
+    metadata = create_run_metadata(header['compound'], header['kind'], header['param'],
+                                   datetime.fromisoformat(header['started_at']), header['title'])
+    if samples_count == 0:
+        return MeasurementRun(np.empty((columns_count, 0), dtype=dtype), metadata)
+    if header['layout'] == LAYOUT_COLUMNS:
+        samples = np.memmap(path, dtype=dtype, mode=mode, offset=data_offset, shape=(columns_count, samples_count))
+    else:
+        samples = np.memmap(path, dtype=dtype, mode=mode, offset=data_offset,
+                            shape=(samples_count, columns_count)).T
+    return MeasurementRun(samples, metadata)
+
+
+def finish_run_file(records_path, path, is_records_removed=True):
+    """
+        Rewrites run file in the records layout at records_path into the columns layout at path
+        and removes the records file. The file at path is replaced atomically, it is either complete or missing.
+    """
+    header, _ = read_header(records_path)
+    run = open_run(records_path)
+    header['layout'] = LAYOUT_COLUMNS
+    header['samples_count'] = len(run)
+
+    temporary_path = get_temporary_path(path)
+    with open(temporary_path, 'wb') as run_file:
+        run_file.write(encode_header(header))
+        run.samples.astype(header['dtype'], copy=False).tofile(run_file)
+        run_file.flush()
+        os.fsync(run_file.fileno())
+    del run
+    os.replace(temporary_path, path)
+    if is_records_removed:
+        os.remove(records_path)
+    return header['samples_count']
+
+
+def export_csv(path, csv_path=None):
+    """
+        Converts the run file into the CSV format of the legacy per-run files, returns the CSV file path.
+    """
+    from zntest.utils import OUTPUT_DATA_HEADER, SAMPLES_CHUNK_SIZE, format_csv_row, format_output_data
+
+    csv_path = csv_path or os.path.splitext(path)[0] + '.csv'
+    run = open_run(path)
+    with open(csv_path, 'w', encoding='utf-8', newline='') as output_csv:
+        output_csv.write(format_csv_row(OUTPUT_DATA_HEADER))
+        # the run is converted chunk by chunk, so a long run is never formatted in memory at once
+        chunk_size = SAMPLES_CHUNK_SIZE * 100
+        for start in range(0, len(run), chunk_size):
+            t, volt, curr = run.samples[:, start:start + chunk_size]
+            output_csv.write(format_output_data(t, volt, curr, run.metadata.compound))
+    return csv_path
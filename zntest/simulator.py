@@ -0,0 +1,344 @@
+import json
+import os
+import time
+import zlib
+
+# ZNTEST_SIMULATED_DEVICES=<count> adds simulated potentiostats to the available ports,
+# ZNTEST_SIMULATOR_SPEED=<factor> runs them factor times faster than real time, 0 runs them as fast as possible
+SIMULATED_DEVICES_VARIABLE = 'ZNTEST_SIMULATED_DEVICES'
+SIMULATOR_SPEED_VARIABLE = 'ZNTEST_SIMULATOR_SPEED'
+SIMULATED_PORT_PREFIX = 'sim://'
+
+FIRMWARE_VERSION = 'FW0.0.8-sim'
+CURRENT_RANGES = ('1uA', '10uA', '100uA', '1000uA')
+VOLTAGE_RANGES = ('1V', '2V', '5V', '10V')
+TEST_NAMES = ('constant', 'squareWave')
+DEFAULT_SAMPLE_PERIOD_MS = 10
+
+# Zn stripping peak of the square wave difference current, uA at 1 ppb and its potential and width, V
+ZN_PEAK_HEIGHT_PER_PPB = 0.02
+ZN_PEAK_POTENTIAL = -1.0
+ZN_PEAK_WIDTH = 0.045
+# Cottrell decay of the deposition current i = k / sqrt(t) + background, k in uA s^0.5
+COTTRELL_COEFFICIENT = 4.0
+# shortest time after the potential step the decay is computed for, the current is limited by the cell resistance
+COTTRELL_MIN_TIME_SEC = 0.02
+BACKGROUND_CURRENT = 0.05
+NOISE_STD = 0.01
+# simulated faults: the working electrode is disconnected, only the amplifier noise is measured,
+# or the cell is shorted and the current is far beyond any range
+FAULT_OPEN_CIRCUIT = 'open_circuit'
+FAULT_SHORT_CIRCUIT = 'short_circuit'
+OPEN_CIRCUIT_NOISE_STD = 0.001
+# charging current after every pulse edge of the square wave, uA per V of the edge, and its time constant
+CHARGING_CURRENT_PER_VOLT = 400.0
+CHARGING_TIME_CONSTANT_SEC = 0.0008
+
+
+def is_simulated_port(port):
+    return port.startswith(SIMULATED_PORT_PREFIX)
+
+
+def get_simulated_ports():
+    devices_count = int(os.environ.get(SIMULATED_DEVICES_VARIABLE) or 0)
+    return [f'{SIMULATED_PORT_PREFIX}{device_index + 1}' for device_index in range(devices_count)]
+
+
+def get_default_speed():
+    return float(os.environ.get(SIMULATOR_SPEED_VARIABLE) or 1.0)
+
+
+def get_current_range_limit(current_range):
+    return float(current_range[:-2])
+
+
+def get_port_concentration(port):
+    # every simulated device measures its own, but reproducible, Zn concentration between 20 and 120 ppb
+    return 20.0 + zlib.crc32(port.encode()) % 1000 / 10.0
+
+
+def simulate_constant_current(param, t, rng):
+    """
+        Returns the current of the constant voltage test: Cottrell decay after every potential step, from the open
+        circuit to the quiet value at the test start and from the quiet value to the test value after the quiet
+        time. Its sign follows the direction of the step, so deposition at negative potential gives cathodic current.
+    """
+    import numpy as np
+
+    curr = np.full(len(t), BACKGROUND_CURRENT)
+    quiet_time = param['quietTime'] / 1.0e3
+    for step_time, step in ((0.0, param['quietValue']), (quiet_time, param['value'] - param['quietValue'])):
+        if step == 0.0:
+            continue
+        elapsed = t - step_time
+        is_after_step = elapsed >= 0.0
+        curr[is_after_step] += np.sign(step) * COTTRELL_COEFFICIENT * min(abs(step), 1.0) / \
+            np.sqrt(np.maximum(elapsed[is_after_step], COTTRELL_MIN_TIME_SEC))
+    return curr + rng.normal(0.0, NOISE_STD, len(t))
+
+
+def simulate_square_wave_current(volt, quiet_count, amplitude, concentration, rng):
+    """
+        Returns the square wave difference current: the Zn stripping peak of sech^2 shape on a sloping baseline.
+    """
+    import numpy as np
+
+    curr = np.full(len(volt), BACKGROUND_CURRENT)
+    sweep_volt = volt[quiet_count:]
+    # the difference current grows with the amplitude until it is about the peak width
+    peak_height = ZN_PEAK_HEIGHT_PER_PPB * concentration * min(amplitude / ZN_PEAK_WIDTH, 1.0)
+    curr[quiet_count:] += 0.2 * (sweep_volt - ZN_PEAK_POTENTIAL) + \
+        peak_height / np.cosh((sweep_volt - ZN_PEAK_POTENTIAL) / ZN_PEAK_WIDTH) ** 2
+    return curr + rng.normal(0.0, NOISE_STD, len(volt))
+
+
+def simulate_square_wave_pulse_current(step_volt, amplitude, concentration, half_period_sec, pulse_samples, rng):
+    """
+        Returns the current sampled pulse_samples times in every half period of the square wave steps, forward half
+        period first: the faradaic current, split evenly between the forward and the reverse pulse so that their
+        difference is the peak of simulate_square_wave_current, and the charging current decaying after every
+        pulse edge.
+    """
+    import numpy as np
+
+    peak_height = ZN_PEAK_HEIGHT_PER_PPB * concentration * min(amplitude / ZN_PEAK_WIDTH, 1.0)
+    difference = 0.2 * (step_volt - ZN_PEAK_POTENTIAL) + \
+        peak_height / np.cosh((step_volt - ZN_PEAK_POTENTIAL) / ZN_PEAK_WIDTH) ** 2
+    pulse_t = (np.arange(pulse_samples) + 1.0) * half_period_sec / pulse_samples
+    charging = CHARGING_CURRENT_PER_VOLT * 2.0 * amplitude * np.exp(-pulse_t / CHARGING_TIME_CONSTANT_SEC)
+    forward = BACKGROUND_CURRENT + difference[:, None] / 2.0 + charging
+    reverse = BACKGROUND_CURRENT - difference[:, None] / 2.0 - charging
+    curr = np.stack((forward, reverse), axis=1).ravel()
+    return curr + rng.normal(0.0, NOISE_STD, len(curr))
+
+
+class SimulatedPotentiostat:
+    """
+        Class standing in for potentiostat.Potentiostat without hardware. It answers the commands used by
+        the application and streams synthetic samples of 'constant' and 'squareWave' tests through readline
+        the same way the device does: Cottrell decay of the constant voltage current and Zn stripping peak of
+        the square wave current, both with Gaussian noise. Samples are paced speed times faster than
+        real time, speed 0 streams them as fast as they are read. fault is None or one of FAULT_OPEN_CIRCUIT and
+        FAULT_SHORT_CIRCUIT. Square wave tests report one difference current per step, as the firmware does,
+        unless pulse_samples is given, then every half period is reported as pulse_samples raw samples.
+    """
+
+    def __init__(self, port, speed=None, concentration=None, seed=None, fault=None, pulse_samples=0):
+        self.port = port
+        self.fault = fault
+        self.pulse_samples = pulse_samples
+        self.speed = get_default_speed() if speed is None else speed
+        self.concentration = get_port_concentration(port) if concentration is None else concentration
+        self.seed = seed
+        self.test_count = 0
+        self.is_open = True
+        self.current_range = CURRENT_RANGES[-1]
+        self.voltage_range = VOLTAGE_RANGES[0]
+        self.sample_period = DEFAULT_SAMPLE_PERIOD_MS
+        self.params = {
+            'constant': {'quietValue': 0.0, 'quietTime': 0, 'value': -1.4, 'duration': 1000},
+            'squareWave': {'quietValue': 0.0, 'quietTime': 0, 'amplitude': 0.025, 'startValue': -1.4,
+                           'finalValue': -0.6, 'stepValue': 0.005, 'window': 0.2},
+        }
+        self.samples = None
+        self.next_sample_index = 0
+        self.test_started_at = None
+
+    def check_open(self):
+        if not self.is_open:
+            raise RuntimeError(f'Simulated potentiostat {self.port} is closed')
+
+    def open(self):
+        self.is_open = True
+
+    def close(self):
+        self.is_open = False
+        self.samples = None
+
+    def get_firmware_version(self):
+        return FIRMWARE_VERSION
+
+    def get_hardware_variant(self):
+        return 'simulated'
+
+    def get_device_id(self):
+        return self.port
+
+    def get_test_names(self):
+        return list(TEST_NAMES)
+
+    def get_all_curr_range(self):
+        return list(CURRENT_RANGES)
+
+    def get_curr_range(self):
+        self.check_open()
+        return self.current_range
+
+    def set_curr_range(self, curr_range):
+        self.check_open()
+        if curr_range not in CURRENT_RANGES:
+            raise ValueError('unknown current range')
+        self.current_range = curr_range
+        return curr_range
+
+    def get_all_volt_range(self):
+        return list(VOLTAGE_RANGES)
+
+    def get_volt_range(self):
+        self.check_open()
+        return self.voltage_range
+
+    def set_volt_range(self, volt_range):
+        self.check_open()
+        if volt_range not in VOLTAGE_RANGES:
+            raise ValueError('unknown voltage range')
+        self.voltage_range = volt_range
+        return volt_range
+
+    def get_sample_period(self):
+        return self.sample_period
+
+    def set_sample_period(self, sample_period):
+        self.check_open()
+        self.sample_period = int(sample_period)
+        return self.sample_period
+
+    def get_sample_rate(self):
+        return 1.0e3 / self.sample_period
+
+    def set_sample_rate(self, sample_rate):
+        return self.set_sample_period(int(1.0e3 / sample_rate))
+
+    def get_param(self, testname):
+        return dict(self.params[testname])
+
+    def set_param(self, testname, param):
+        self.check_open()
+        if testname not in TEST_NAMES:
+            raise ValueError(f'unknown test {testname}')
+        self.params[testname] = dict(self.params[testname], **param)
+        return dict(self.params[testname])
+
+    def get_test_done_time(self, test, timeunit='ms'):
+        t, _, _ = self.create_samples(test, with_current=False)
+        done_time_ms = (t[-1] if len(t) else 0.0) + self.sample_period
+        return done_time_ms if timeunit == 'ms' else done_time_ms / 1.0e3
+
+    def create_samples(self, testname, with_current=True):
+        """
+            Returns (t in ms, volt, curr) of the test, the samples follow zntest.waveforms.compute_potential_grid,
+            pulse resolved square wave samples follow zntest.waveforms.compute_expected_waveform.
+        """
+        import numpy as np
+
+        param = self.params[testname]
+        if testname == 'squareWave' and self.pulse_samples > 0:
+            return self.create_pulse_samples(param, with_current)
+
+        quiet_count = int(param['quietTime'] / self.sample_period)
+        if testname == 'constant':
+            test_volt = np.full(int(param['duration'] / self.sample_period), float(param['value']))
+        else:
+            direction = 1.0 if param['finalValue'] >= param['startValue'] else -1.0
+            steps_count = int(np.floor(abs(param['finalValue'] - param['startValue']) / param['stepValue'] +
+                                       1e-9)) + 1
+            test_volt = param['startValue'] + direction * param['stepValue'] * np.arange(steps_count)
+        volt = np.concatenate((np.full(quiet_count, float(param['quietValue'])), test_volt))
+        t = np.arange(len(volt), dtype=float) * self.sample_period
+        if not with_current:
+            return t, volt, None
+
+        seed = self.seed if self.seed is None else (self.seed, self.test_count)
+        rng = np.random.default_rng(seed)
+        if testname == 'constant':
+            curr = simulate_constant_current(param, t / 1.0e3, rng)
+        else:
+            curr = simulate_square_wave_current(volt, quiet_count, param['amplitude'], self.concentration, rng)
+        if self.fault == FAULT_OPEN_CIRCUIT:
+            curr = rng.normal(0.0, OPEN_CIRCUIT_NOISE_STD, len(t))
+        elif self.fault == FAULT_SHORT_CIRCUIT:
+            curr = curr * 1.0e6
+        limit = get_current_range_limit(self.current_range)
+        return t, volt, np.clip(curr, -limit, limit)
+
+    def create_pulse_samples(self, param, with_current=True):
+        import numpy as np
+        from zntest.waveforms import get_step_values
+
+        period = self.sample_period / (2.0 * self.pulse_samples)
+        quiet_count = int(param['quietTime'] / period)
+        step_volt = get_step_values(param)
+        pulses = np.repeat([param['amplitude'], -param['amplitude']], self.pulse_samples)
+        volt = np.concatenate((np.full(quiet_count, float(param['quietValue'])),
+                               (step_volt[:, None] + pulses).ravel()))
+        t = np.arange(len(volt), dtype=float) * period
+        if not with_current:
+            return t, volt, None
+
+        rng = np.random.default_rng(self.seed if self.seed is None else (self.seed, self.test_count))
+        curr = np.concatenate((BACKGROUND_CURRENT + rng.normal(0.0, NOISE_STD, quiet_count),
+                               simulate_square_wave_pulse_current(step_volt, param['amplitude'], self.concentration,
+                                                                  self.sample_period / 2.0e3, self.pulse_samples,
+                                                                  rng)))
+        limit = get_current_range_limit(self.current_range)
+        return t, volt, np.clip(curr, -limit, limit)
+
+    def send_cmd(self, cmd_dict, rsp=True):
+        self.check_open()
+        command = cmd_dict.get('command')
+        if command == 'runTest':
+            if cmd_dict.get('test') not in TEST_NAMES:
+                raise ValueError(f'unknown test {cmd_dict.get("test")}')
+            self.samples = self.create_samples(cmd_dict['test'])
+            self.test_count += 1
+            self.next_sample_index = 0
+            self.test_started_at = time.perf_counter()
+        elif command == 'stopTest':
+            self.samples = None
+        else:
+            raise ValueError(f'Simulated potentiostat doesn\'t support {command} command')
+        if rsp:
+            return {'success': True, 'response': dict(cmd_dict)}
+
+    def stop_test(self, rsp=True):
+        return self.send_cmd({'command': 'stopTest'}, rsp)
+
+    def readline(self):
+        """
+            Returns the next line the device would send: a JSON sample, then the empty message ending the test.
+        """
+        self.check_open()
+        if self.samples is None:
+            return b''
+        t, volt, curr = self.samples
+        sample_index = self.next_sample_index
+        if sample_index >= len(t):
+            self.samples = None
+            return b'{}\n'
+
+        if self.speed > 0:
+            delay = self.test_started_at + t[sample_index] / 1.0e3 / self.speed - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        self.next_sample_index += 1
+        # t is in ms, pulse resolved samples are less than a millisecond apart
+        return b'{"t":%.3f,"v":%.4f,"i":%.4f}\n' % (t[sample_index], volt[sample_index], curr[sample_index])
+
+    def run_test(self, testname, param=None, filename=None, on_data=None, display='pbar', timeunit='s',
+                 max_decode_err=0):
+        # the same result as Potentiostat.run_test without the multiplexer, progress isn't displayed
+        if param is not None:
+            self.set_param(testname, param)
+        time_scale = 1.0e-3 if timeunit == 's' else 1.0
+        self.send_cmd({'command': 'runTest', 'test': testname})
+        t_values, volt_values, curr_values = [], [], []
+        while True:
+            sample = json.loads(self.readline().decode())
+            if 't' not in sample:
+                break
+            t_values.append(sample['t'] * time_scale)
+            volt_values.append(sample['v'])
+            curr_values.append(sample['i'])
+            if on_data is not None:
+                on_data(0, t_values[-1], volt_values[-1], curr_values[-1])
+        return t_values, volt_values, curr_values
@@ -0,0 +1,112 @@
+from collections import namedtuple
+
+import numpy as np
+
+import zntest.analysis as analysis
+from zntest.waveforms import get_step_values
+
+# quiet_count: samples at the quiet value before the sweep, steps_count: steps of the staircase,
+# pulse_samples: samples of every half period, 0 when the device reports one processed sample per step
+PulseLayout = namedtuple('PulseLayout', ['quiet_count', 'steps_count', 'pulse_samples'])
+# currents of every step: forward and reverse half period means over the window and their difference
+SquareWaveCurrents = namedtuple('SquareWaveCurrents', ['volt', 'forward', 'reverse', 'difference'])
+
+
+def get_pulse_layout(t, param):
+    """
+        Returns PulseLayout of the square wave run. The Rodeostat squareWave test reports one sample per step,
+        the difference current already averaged over the window, pulse resolved runs have 2 * pulse_samples
+        samples per step, forward half period first. Raises ValueError when the run is neither.
+    """
+    steps_count = len(get_step_values(param))
+    quiet_sec = param['quietTime'] / 1.0e3
+    spacing = t[1] - t[0] if len(t) > 1 else 0.0
+    # the sweep starts after the quiet time, the samples of every step are a whole multiple of the steps
+    samples_per_step = int(round((len(t) - np.searchsorted(t, quiet_sec - spacing / 2.0)) / steps_count))
+    if samples_per_step < 1 or samples_per_step != 1 and samples_per_step % 2 != 0 or \
+            steps_count * samples_per_step > len(t):
+        raise ValueError(f'{len(t)} samples don\'t make {steps_count} square wave steps')
+    return PulseLayout(len(t) - steps_count * samples_per_step, steps_count, samples_per_step // 2)
+
+
+def get_window_start(pulse_samples, window):
+    # the device averages the current at the end of every half period, when the charging current has decayed,
+    # window is the fraction of the half period which is averaged
+    return pulse_samples - min(pulse_samples, max(1, int(round(window * pulse_samples))))
+
+
+def reconstruct_currents(curr, layout, window):
+    """
+        Returns (forward, reverse, difference) currents of every step of pulse resolved runs. curr is the current of
+        a single run or a 2D array with a run per row, all of the same layout, every run is reshaped into
+        a (steps, half periods, pulse samples) view without copying, so the batch is reduced at once.
+    """
+    if layout.pulse_samples == 0:
+        raise ValueError('The run has one sample per step, the window was applied by the device')
+    curr = np.asarray(curr, dtype=float)
+    pulses = curr[..., layout.quiet_count:].reshape(curr.shape[:-1] + (layout.steps_count, 2, layout.pulse_samples))
+    window_pulses = pulses[..., get_window_start(layout.pulse_samples, window):]
+    forward = window_pulses[..., 0, :].mean(axis=-1)
+    reverse = window_pulses[..., 1, :].mean(axis=-1)
+    return forward, reverse, forward - reverse
+
+
+def reconstruct_run(run, window=None):
+    """
+        Returns SquareWaveCurrents of the pulse resolved run, window is the param window of the run by default.
+    """
+    param = run.metadata.param
+    layout = get_pulse_layout(run.t, param)
+    forward, reverse, difference = reconstruct_currents(run.curr, layout, param['window'] if window is None
+                                                        else window)
+    return SquareWaveCurrents(get_step_values(param), forward, reverse, difference)
+
+
+def get_voltammogram(run):
+    """
+        Returns (volt, curr) of the difference voltammogram analysis works with: samples of the run as they are
+        when the device processed them, the currents reconstructed with the param window of a pulse resolved run.
+    """
+    param = run.metadata.param
+    if not param or len(run) == 0 or get_pulse_layout(run.t, param).pulse_samples == 0:
+        return run.volt, run.curr
+    currents = reconstruct_run(run)
+    return currents.volt, currents.difference
+
+
+def reconstruct_stored_runs(run_store, run_ids, window, settings=analysis.DEFAULT_ANALYSIS_SETTINGS,
+                            calibration=None, errors=None):
+    """
+        Recomputes the currents of the stored pulse resolved runs with another window and analyzes the new
+        difference voltammograms. Runs of the same param and layout are stacked and reconstructed as one batch.
+        Returns (SquareWaveCurrents, analysis result) of every run in the order of run_ids,
+        None for the runs processed by the device and the runs whose samples don't make the steps of their
+        param, the ValueError of these is put into the errors dict by run id, when it is given.
+    """
+    results = [None] * len(run_ids)
+    batches = {}
+    for run_index, run_id in enumerate(run_ids):
+        run = run_store.load_run(run_id)
+        param = run.metadata.param
+        if not param or len(run) == 0:
+            continue
+        try:
+            layout = get_pulse_layout(run.t, param)
+        except ValueError as e:
+            if errors is not None:
+                errors[run_id] = e
+            continue
+        if layout.pulse_samples == 0:
+            continue
+        key = (layout, tuple(sorted(param.items())))
+        batches.setdefault(key, []).append((run_index, run.curr))
+
+    for (layout, param_items), runs in batches.items():
+        step_volt = get_step_values(dict(param_items))
+        forward, reverse, difference = reconstruct_currents(np.stack([curr for _, curr in runs]), layout, window)
+        batch_result = analysis.analyze_square_wave_voltammetry(np.broadcast_to(step_volt, difference.shape),
+                                                                difference, settings, calibration)
+        for row, (run_index, _) in enumerate(runs):
+            results[run_index] = (SquareWaveCurrents(step_volt, forward[row], reverse[row], difference[row]),
+                                  {field: float(batch_result[field][row]) for field in analysis.RESULT_FIELDS})
+    return results
@@ -0,0 +1,404 @@
+import csv
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+from collections import namedtuple
+from datetime import datetime
+
+# NumPy is imported by the functions which need it, so opening the store doesn't delay the GUI start
+SAMPLES_DTYPE = 'float32'
+STARTED_AT_FORMAT = '%Y-%m-%dT%H:%M:%S'
+RUN_FILE_NAME_PATTERN = re.compile(r'^(?P<compound>.*)__(?P<started_at>\d{4}-\d{2}-\d{2}__\d{2}-\d{2}-\d{2})\.csv$')
+RUN_FILE_TIMESTAMP_FORMAT = '%Y-%m-%d__%H-%M-%S'
+
+SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS runs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        compound TEXT NOT NULL,
+        kind TEXT NOT NULL,
+        started_at TEXT NOT NULL,
+        title TEXT,
+        current_range TEXT,
+        sample_rate INTEGER,
+        param TEXT NOT NULL,
+        samples_count INTEGER NOT NULL DEFAULT 0,
+        status TEXT NOT NULL DEFAULT 'complete',
+        device TEXT
+    );
+    CREATE INDEX IF NOT EXISTS runs_compound_started_at ON runs (compound, started_at);
+    CREATE INDEX IF NOT EXISTS runs_kind_started_at ON runs (kind, started_at);
+    CREATE INDEX IF NOT EXISTS runs_started_at ON runs (started_at);
+    CREATE TABLE IF NOT EXISTS samples (
+        run_id INTEGER NOT NULL REFERENCES runs (id) ON DELETE CASCADE,
+        chunk INTEGER NOT NULL,
+        t BLOB NOT NULL,
+        volt BLOB NOT NULL,
+        curr BLOB NOT NULL,
+        PRIMARY KEY (run_id, chunk)
+    );
+    CREATE TABLE IF NOT EXISTS analysis (
+        run_id INTEGER PRIMARY KEY REFERENCES runs (id) ON DELETE CASCADE,
+        version INTEGER NOT NULL,
+        result TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS imported_blocks (
+        block_key TEXT PRIMARY KEY,
+        run_id INTEGER NOT NULL REFERENCES runs (id) ON DELETE CASCADE,
+        source TEXT NOT NULL
+    );
+'''
+
+RUN_STATUS_RUNNING = 'running'
+RUN_STATUS_COMPLETE = 'complete'
+RUN_STATUS_PARTIAL = 'partial'
+
+RunRecord = namedtuple('RunRecord', ['id', 'compound', 'kind', 'started_at', 'title', 'current_range', 'sample_rate',
+                                     'param', 'samples_count', 'status', 'device'])
+
+# columns added after the first release of the store, they are added to existing databases on open
+ADDED_COLUMNS = (
+    ('status', f"TEXT NOT NULL DEFAULT '{RUN_STATUS_COMPLETE}'"),
+    ('device', 'TEXT'),
+    ('run_file', 'TEXT'),
+)
+# a writer waits this long for another connection, e.g. of another application instance, to finish its transaction
+BUSY_TIMEOUT_SEC = 30.0
+
+
+def connect_database(path):
+    """
+        Opens SQLite database shared by threads and application instances. In write-ahead log mode readers
+        don't block the writer and commits are appended to the log without fsync, the log is synced when it is
+        checkpointed into the database, so a crash of the application loses no commits and committing a chunk
+        stays cheap. Writers of several connections are serialized by SQLite, they wait up to BUSY_TIMEOUT_SEC.
+    """
+    connection = sqlite3.connect(path, timeout=BUSY_TIMEOUT_SEC, check_same_thread=False)
+    connection.execute('PRAGMA journal_mode = WAL')
+    connection.execute('PRAGMA synchronous = NORMAL')
+    connection.execute('PRAGMA foreign_keys = ON')
+    return connection
+
+
+def get_default_store_path():
+    return os.path.join(os.getcwd(), 'data', 'out', 'runs.sqlite3')
+
+
+def to_blob(values):
+    import numpy as np
+
+    return np.ascontiguousarray(values, dtype=SAMPLES_DTYPE).tobytes()
+
+
+def from_blobs(rows):
+    """
+        Returns (3, samples count) array of t, volt and curr chunk BLOB rows. Chunks are copied straight
+        into their place in the array, the BLOBs aren't joined first.
+    """
+    import numpy as np
+
+    itemsize = np.dtype(SAMPLES_DTYPE).itemsize
+    samples = np.empty((3, sum(len(row[0]) for row in rows) // itemsize), dtype=SAMPLES_DTYPE)
+    offset = 0
+    for row in rows:
+        chunk_size = len(row[0]) // itemsize
+        for column in range(3):
+            samples[column, offset:offset + chunk_size] = np.frombuffer(row[column], dtype=SAMPLES_DTYPE)
+        offset += chunk_size
+    return samples
+
+
+class RunStore:
+    """
+        Class storing measurement runs in a SQLite database.
+        Run metadata is kept in the indexed 'runs' table, so runs can be looked up by compound, test kind and
+        start time without reading any sample data. Samples are kept in the 'samples' table as float32 BLOBs
+        keyed by run id, so loading one run doesn't touch data of any other run.
+        Samples of a running test are appended chunk by chunk, every chunk is committed separately,
+        so a run interrupted by a crash keeps everything acquired before it.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or get_default_store_path()
+        folder = os.path.dirname(self.path)
+        if folder and os.path.exists(folder) is False:
+            os.makedirs(folder)
+
+        # the store is shared between the GUI thread and the acquisition worker
+        self.lock = threading.Lock()
+        self.connection = connect_database(self.path)
+        self.connection.executescript(SCHEMA)
+        self.migrate()
+
+    def migrate(self):
+        with self.connection:
+            # columns are read in the write transaction, so another instance can't add them meanwhile
+            self.connection.execute('BEGIN IMMEDIATE')
+            columns = [row[1] for row in self.connection.execute('PRAGMA table_info(runs)')]
+            for column, definition in ADDED_COLUMNS:
+                if column not in columns:
+                    self.connection.execute(f'ALTER TABLE runs ADD COLUMN {column} {definition}')
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+    def add_run(self, kind, context, start_time, t, volt, curr):
+        run_id = self.begin_run(kind, context, start_time)
+        self.append_samples(run_id, 0, t, volt, curr)
+        self.finish_run(run_id)
+        return run_id
+
+    def begin_run(self, kind, context, start_time, run_file_path=None):
+        with self.lock, self.connection:
+            return self.insert_run(kind, context, start_time, RUN_STATUS_RUNNING, run_file_path)
+
+    def insert_run(self, kind, context, start_time, status, run_file_path=None):
+        # the caller holds the lock and the transaction
+        cursor = self.connection.execute(
+            'INSERT INTO runs (compound, kind, started_at, title, current_range, sample_rate, param, status, '
+            'device, run_file) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (context['compound'], kind, start_time.strftime(STARTED_AT_FORMAT), context.get('title'),
+             context.get('current_range'), context.get('sample_rate'),
+             json.dumps(context.get('param', {}), sort_keys=True), status, context.get('device'), run_file_path))
+        return cursor.lastrowid
+
+    def append_samples(self, run_id, chunk, t, volt, curr):
+        with self.lock, self.connection:
+            self.insert_samples(run_id, chunk, t, volt, curr)
+
+    def insert_samples(self, run_id, chunk, t, volt, curr):
+        # the caller holds the lock and the transaction
+        self.connection.execute('INSERT INTO samples (run_id, chunk, t, volt, curr) VALUES (?, ?, ?, ?, ?)',
+                                (run_id, chunk, to_blob(t), to_blob(volt), to_blob(curr)))
+        self.connection.execute('UPDATE runs SET samples_count = samples_count + ? WHERE id = ?', (len(t), run_id))
+
+    def add_imported_run(self, block_key, source, kind, context, start_time, t, volt, curr):
+        """
+            Adds complete run imported from a block of a legacy file in one transaction. Returns id of the run
+            or None when the block of block_key is imported already, so importing a file again adds nothing.
+        """
+        with self.lock, self.connection:
+            # the block is looked up in the write transaction, so another instance can't import it meanwhile
+            self.connection.execute('BEGIN IMMEDIATE')
+            if self.connection.execute('SELECT 1 FROM imported_blocks WHERE block_key = ?',
+                                       (block_key,)).fetchone() is not None:
+                return None
+            run_id = self.insert_run(kind, context, start_time, RUN_STATUS_COMPLETE)
+            self.insert_samples(run_id, 0, t, volt, curr)
+            self.connection.execute('INSERT INTO imported_blocks (block_key, run_id, source) VALUES (?, ?, ?)',
+                                    (block_key, run_id, source))
+        return run_id
+
+    def finish_run(self, run_id, status=RUN_STATUS_COMPLETE):
+        with self.lock, self.connection:
+            self.connection.execute('UPDATE runs SET status = ? WHERE id = ?', (status, run_id))
+
+    def mark_interrupted_runs(self, is_run_file_active_fun=None):
+        """
+            Marks runs left in 'running' state as partial, they were interrupted by a crash, the chunks committed
+            before it are kept. Runs whose run file is still written, is_run_file_active_fun(run file path) is True,
+            belong to another application instance and are kept running.
+        """
+        with self.lock, self.connection:
+            rows = self.connection.execute('SELECT id, run_file FROM runs WHERE status = ?',
+                                           (RUN_STATUS_RUNNING,)).fetchall()
+            run_ids = [run_id for run_id, run_file_path in rows if run_file_path is None or
+                       is_run_file_active_fun is None or not is_run_file_active_fun(run_file_path)]
+            self.connection.executemany('UPDATE runs SET status = ? WHERE id = ? AND status = ?',
+                                        [(RUN_STATUS_PARTIAL, run_id, RUN_STATUS_RUNNING) for run_id in run_ids])
+        return len(run_ids)
+
+    def find_runs(self, compound=None, kind=None, started_from=None, started_to=None):
+        conditions = []
+        arguments = []
+        if compound is not None:
+            conditions.append('compound = ?')
+            arguments.append(compound)
+        if kind is not None:
+            conditions.append('kind = ?')
+            arguments.append(kind)
+        if started_from is not None:
+            conditions.append('started_at >= ?')
+            arguments.append(started_from.strftime(STARTED_AT_FORMAT))
+        if started_to is not None:
+            conditions.append('started_at <= ?')
+            arguments.append(started_to.strftime(STARTED_AT_FORMAT))
+
+        query = f'SELECT {", ".join(RunRecord._fields)} FROM runs'
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        query += ' ORDER BY started_at, id'
+
+        with self.lock:
+            rows = self.connection.execute(query, arguments).fetchall()
+        return [self.to_run_record(row) for row in rows]
+
+    def get_run(self, run_id):
+        with self.lock:
+            row = self.connection.execute(f'SELECT {", ".join(RunRecord._fields)} FROM runs WHERE id = ?',
+                                          (run_id,)).fetchone()
+        if row is None:
+            raise KeyError(f'Run #{run_id} is not found')
+        return self.to_run_record(row)
+
+    def load_samples(self, run_id):
+        # the (3, samples count) array unpacks into t, volt and curr rows
+        with self.lock:
+            rows = self.connection.execute('SELECT t, volt, curr FROM samples WHERE run_id = ? ORDER BY chunk',
+                                           (run_id,)).fetchall()
+        return from_blobs(rows)
+
+    def load_samples_range(self, run_id, start, end):
+        """
+            Returns (3, end - start) array of the samples from start to end, only the chunks holding them are read.
+        """
+        import numpy as np
+
+        with self.lock:
+            # length() of a BLOB is taken from the record header, the chunk data isn't read
+            chunk_sizes = self.connection.execute('SELECT chunk, length(t) FROM samples WHERE run_id = ? '
+                                                  'ORDER BY chunk', (run_id,)).fetchall()
+        itemsize = np.dtype(SAMPLES_DTYPE).itemsize
+        first_chunk, last_chunk, first_chunk_start = None, None, 0
+        offset = 0
+        for chunk, blob_size in chunk_sizes:
+            chunk_end = offset + blob_size // itemsize
+            if first_chunk is None and chunk_end > start:
+                first_chunk, first_chunk_start = chunk, offset
+            if offset < end:
+                last_chunk = chunk
+            offset = chunk_end
+        if first_chunk is None or last_chunk is None or start >= end:
+            return from_blobs([])
+
+        with self.lock:
+            rows = self.connection.execute('SELECT t, volt, curr FROM samples WHERE run_id = ? AND '
+                                           'chunk BETWEEN ? AND ? ORDER BY chunk',
+                                           (run_id, first_chunk, last_chunk)).fetchall()
+        return from_blobs(rows)[:, start - first_chunk_start:end - first_chunk_start]
+
+    def load_run(self, run_id):
+        from zntest.measurement import MeasurementRun, create_run_metadata
+
+        record = self.get_run(run_id)
+        metadata = create_run_metadata(record.compound, record.kind, record.param, record.started_at, record.title,
+                                       record.id)
+        return MeasurementRun(self.load_samples(run_id), metadata)
+
+    def set_analysis(self, run_id, version, result):
+        with self.lock, self.connection:
+            self.connection.execute('INSERT OR REPLACE INTO analysis (run_id, version, result) VALUES (?, ?, ?)',
+                                    (run_id, version, json.dumps(result, sort_keys=True)))
+
+    def get_analysis(self, run_id):
+        """
+            Returns (analysis version, result dict) of the run or None when the run isn't analyzed.
+        """
+        with self.lock:
+            row = self.connection.execute('SELECT version, result FROM analysis WHERE run_id = ?',
+                                          (run_id,)).fetchone()
+        if row is None:
+            return None
+        return row[0], json.loads(row[1])
+
+    @staticmethod
+    def to_run_record(row):
+        values = list(row)
+        values[3] = datetime.strptime(values[3], STARTED_AT_FORMAT)
+        values[7] = json.loads(values[7])
+        return RunRecord(*values)
+
+
+_default_stores = {}
+_default_stores_lock = threading.Lock()
+
+
+def get_default_store():
+    path = get_default_store_path()
+    with _default_stores_lock:
+        if path not in _default_stores:
+            _default_stores[path] = RunStore(path)
+        return _default_stores[path]
+
+
+def read_database_csv_blocks(database_file_path):
+    """
+        Splits legacy database.csv into (header, rows) of runs. Every run starts with the header row and
+        is followed by two blank rows.
+    """
+    blocks = []
+    rows = None
+    with open(database_file_path, 'r', encoding='utf-8', newline='') as database_csv:
+        for row in csv.reader(database_csv, delimiter=','):
+            if row and row[0] == 'time':
+                rows = []
+                blocks.append((row, rows))
+            elif row and rows is not None:
+                rows.append(row)
+    return [(header, rows) for header, rows in blocks if rows]
+
+
+def get_database_csv_block_key(block_index, header, rows):
+    # blocks are keyed by their content and position, the key of a block doesn't change when runs are appended
+    # to the file or the file is moved, and repeated blocks of equal content get keys of their own
+    block_hash = hashlib.sha256()
+    block_hash.update(f'{block_index}\n'.encode('utf-8'))
+    for row in [header] + rows:
+        block_hash.update((','.join(row) + '\n').encode('utf-8'))
+    return block_hash.hexdigest()
+
+
+def read_legacy_param(header, row):
+    # legacy files keep time, volt, current and compound columns, any columns after them are test parameters
+    param = {}
+    for name, value in zip(header[4:], row[4:]):
+        try:
+            param[name] = float(value)
+        except ValueError:
+            param[name] = value
+    return param
+
+
+def read_run_files_start_times(folder):
+    # legacy per-run files carry the run start time in their names, it is matched to database.csv runs by content
+    start_times = {}
+    for file_name in os.listdir(folder):
+        match = RUN_FILE_NAME_PATTERN.match(file_name)
+        if match is None:
+            continue
+        with open(os.path.join(folder, file_name), 'r', encoding='utf-8', newline='') as run_csv:
+            rows = [row for row in csv.reader(run_csv, delimiter=',') if row][1:]
+        if rows:
+            key = (match.group('compound'), len(rows), tuple(rows[0]))
+            start_times[key] = datetime.strptime(match.group('started_at'), RUN_FILE_TIMESTAMP_FORMAT)
+    return start_times
+
+
+def import_database_csv(store, database_file_path, kind):
+    """
+        Imports runs of legacy database.csv and returns ids of the added runs. Blocks imported before
+        are skipped, so importing a file again, e.g. after more runs were appended to it, adds only the new runs.
+    """
+    import numpy as np
+
+    source = os.path.abspath(database_file_path)
+    folder = os.path.dirname(source)
+    start_times = read_run_files_start_times(folder)
+    fallback_start_time = datetime.fromtimestamp(os.path.getmtime(database_file_path)).replace(microsecond=0)
+
+    run_ids = []
+    for block_index, (header, rows) in enumerate(read_database_csv_blocks(database_file_path)):
+        compound = rows[0][3]
+        samples = np.array([row[:3] for row in rows], dtype=float)
+        start_time = start_times.get((compound, len(rows), tuple(rows[0])), fallback_start_time)
+        context = {'compound': compound, 'title': f'Imported from {os.path.basename(database_file_path)}',
+                   'param': read_legacy_param(header, rows[0])}
+        run_id = store.add_imported_run(get_database_csv_block_key(block_index, header, rows), source, kind, context,
+                                        start_time, samples[:, 0], samples[:, 1], samples[:, 2])
+        if run_id is not None:
+            run_ids.append(run_id)
+    return run_ids
+
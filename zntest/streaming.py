@@ -0,0 +1,370 @@
+import json
+import os
+import struct
+import threading
+from collections import deque
+
+import zntest.store as store
+
+# asyncio and socket are imported when the server is started, the publish functions do nothing until then,
+# so importing this module doesn't delay the GUI start
+
+# ZNTEST_STREAMING_SERVER=[host:]port starts the streaming server with the application
+STREAMING_SERVER_VARIABLE = 'ZNTEST_STREAMING_SERVER'
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+
+# every frame is a header of its kind and payload length followed by the payload: UTF-8 JSON of an event,
+# or samples: device name length, device name, samples count and float32 t, volt and curr columns
+FRAME_HEADER = struct.Struct('<BI')
+SAMPLES_HEADER = struct.Struct('<HI')
+FRAME_EVENT = 1
+FRAME_SAMPLES = 2
+
+EVENT_STEP_STARTED = 'step_started'
+EVENT_STEP_FINISHED = 'step_finished'
+EVENT_STEP_FAILED = 'step_failed'
+# sent to a subscriber before the frames which follow the sample frames dropped because it was reading too slowly
+EVENT_SAMPLES_DROPPED = 'samples_dropped'
+EVENT_RUN = 'run'
+EVENT_FIELDS = ('device', 'title', 'kind', 'compound')
+
+# sample frames are dropped for a subscriber which has this many bytes waiting, event frames are always queued
+# unless a subscriber has MAX_QUEUED_EVENT_BYTES waiting, then it is disconnected
+MAX_QUEUED_BYTES = 1024 * 1024
+MAX_QUEUED_EVENT_BYTES = 4 * MAX_QUEUED_BYTES
+MAX_PENDING_FRAMES = 256
+# send buffer of the live stream sockets, the kernel would grow it up to megabytes for a slow subscriber,
+# which delays the frames it gets after its backlog by as much, the backlog is kept in its queue instead
+LIVE_SEND_BUFFER_BYTES = 256 * 1024
+# open live streams are given this long to send their queues when the server is stopped
+STOP_TIMEOUT_SEC = 1.0
+# stored runs are sent in frames of this many samples
+SAMPLES_PER_FRAME = 4096
+MAX_REQUEST_HEAD_BYTES = 8192
+
+
+def encode_frame(kind, payload):
+    return FRAME_HEADER.pack(kind, len(payload)) + payload
+
+
+def encode_event(event, **fields):
+    return encode_frame(FRAME_EVENT, json.dumps(dict(fields, event=event), default=str).encode())
+
+
+def encode_samples(device, t, volt, curr):
+    device_name = (device or '').encode()
+    return encode_frame(FRAME_SAMPLES, SAMPLES_HEADER.pack(len(device_name), len(t)) + device_name +
+                        store.to_blob(t) + store.to_blob(volt) + store.to_blob(curr))
+
+
+def decode_frames(data):
+    """
+        Splits data into complete (kind, payload) frames, returns them and the number of bytes they took.
+    """
+    frames = []
+    offset = 0
+    while offset + FRAME_HEADER.size <= len(data):
+        kind, length = FRAME_HEADER.unpack_from(data, offset)
+        if offset + FRAME_HEADER.size + length > len(data):
+            break
+        offset += FRAME_HEADER.size
+        frames.append((kind, data[offset:offset + length]))
+        offset += length
+    return frames, offset
+
+
+def decode_samples(payload):
+    """
+        Returns (device, (3, samples count) float32 array) of the samples frame payload.
+    """
+    import numpy as np
+
+    device_name_length, samples_count = SAMPLES_HEADER.unpack_from(payload)
+    offset = SAMPLES_HEADER.size + device_name_length
+    samples = np.frombuffer(payload, dtype=store.SAMPLES_DTYPE, count=3 * samples_count, offset=offset)
+    return bytes(payload[SAMPLES_HEADER.size:offset]).decode(), samples.reshape(3, samples_count)
+
+
+def encode_chunk(data):
+    # HTTP/1.1 chunked transfer coding
+    return b'%x\r\n' % len(data) + data + b'\r\n'
+
+
+def get_context_fields(context):
+    return {field: context.get(field) for field in EVENT_FIELDS}
+
+
+class Subscriber:
+    """
+        Class queueing the frames of one live stream connection. The queue is bounded: sample frames which don't
+        fit are dropped and counted, so a slow subscriber only loses its own samples.
+    """
+
+    def __init__(self, writer):
+        import asyncio
+
+        self.writer = writer
+        self.frames = deque()
+        self.queued_bytes = 0
+        self.dropped_count = 0
+        self.ready = asyncio.Event()
+        self.is_closed = False
+        self.is_finished = False
+
+    def add(self, frame, is_droppable):
+        if is_droppable and self.queued_bytes + len(frame) > MAX_QUEUED_BYTES:
+            self.dropped_count += 1
+            return
+        if self.queued_bytes + len(frame) > MAX_QUEUED_EVENT_BYTES:
+            self.close()
+            return
+        self.frames.append(frame)
+        self.queued_bytes += len(frame)
+        self.ready.set()
+
+    def take_frames(self):
+        frames = list(self.frames)
+        if self.dropped_count:
+            frames.insert(0, encode_event(EVENT_SAMPLES_DROPPED, frames_count=self.dropped_count))
+            self.dropped_count = 0
+        self.frames.clear()
+        self.queued_bytes = 0
+        self.ready.clear()
+        return frames
+
+    def close(self):
+        # the connection is dropped, the frames in the queue aren't sent
+        self.is_closed = True
+        self.ready.set()
+
+    def finish(self):
+        # the frames in the queue are sent and the stream is ended
+        self.is_finished = True
+        self.ready.set()
+
+
+class StreamingServer:
+    """
+        Class serving live samples and step events of the acquisition and the runs of the run store over local
+        HTTP from its own event loop thread. Endpoints:
+            GET /live        chunked stream of event and sample frames of all devices,
+            GET /runs        JSON list of the stored runs,
+            GET /runs/<id>   the run event frame and sample frames of the stored run.
+        Acquisition threads only hand the frames over to the loop, every subscriber has its own bounded queue,
+        so neither a slow nor a stalled subscriber delays acquisition or the other subscribers.
+    """
+
+    def __init__(self, host=DEFAULT_HOST, port=DEFAULT_PORT, store_path=None):
+        self.host = host
+        self.port = port
+        self.store_path = store_path
+        self.subscribers = set()
+        self.live_tasks = set()
+        self.loop = None
+        self.server = None
+        self.thread = None
+        self.lock = threading.Lock()
+        self.pending_count = 0
+        self.skipped_count = 0
+
+    def start(self):
+        import asyncio
+
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name='zntest-streaming', daemon=True)
+        self.thread.start()
+        try:
+            self.server = asyncio.run_coroutine_threadsafe(
+                asyncio.start_server(self.handle_connection, self.host, self.port), self.loop).result()
+        except BaseException:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            raise
+        # port 0 binds any free port
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+    def stop(self):
+        import asyncio
+
+        async def close_server():
+            self.server.close()
+            for subscriber in list(self.subscribers):
+                subscriber.finish()
+            if self.live_tasks:
+                _, pending = await asyncio.wait(list(self.live_tasks), timeout=STOP_TIMEOUT_SEC)
+                for task in pending:
+                    task.cancel()
+            await self.server.wait_closed()
+
+        asyncio.run_coroutine_threadsafe(close_server(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+    def has_subscribers(self):
+        return bool(self.subscribers)
+
+    def publish(self, encode_fun, is_droppable=False):
+        """
+            Queues the frame returned by encode_fun() for every subscriber, it is encoded in the loop thread,
+            the calling thread doesn't wait. Sample frames are skipped for everybody when the loop is
+            MAX_PENDING_FRAMES behind, so the frames waiting for the loop don't pile up either.
+        """
+        if not self.subscribers:
+            return
+        with self.lock:
+            if is_droppable and self.pending_count >= MAX_PENDING_FRAMES:
+                self.skipped_count += 1
+                return
+            self.pending_count += 1
+        self.loop.call_soon_threadsafe(self.broadcast, encode_fun, is_droppable)
+
+    def broadcast(self, encode_fun, is_droppable):
+        with self.lock:
+            self.pending_count -= 1
+            skipped_count, self.skipped_count = self.skipped_count, 0
+        frame = encode_fun()
+        for subscriber in list(self.subscribers):
+            subscriber.dropped_count += skipped_count
+            subscriber.add(frame, is_droppable)
+
+    async def handle_connection(self, reader, writer):
+        import asyncio
+
+        try:
+            head = await reader.readuntil(b'\r\n\r\n')
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            writer.close()
+            return
+        request_line = head.split(b'\r\n', 1)[0].decode('latin-1').split()
+        try:
+            if len(head) > MAX_REQUEST_HEAD_BYTES or len(request_line) != 3 or request_line[0] != 'GET':
+                await self.send_response(writer, 400, 'Bad Request')
+            elif request_line[1] == '/live':
+                await self.stream_live(writer)
+            elif request_line[1] == '/runs':
+                await self.send_run_list(writer)
+            elif request_line[1].startswith('/runs/') and request_line[1][len('/runs/'):].isdigit():
+                await self.send_run(writer, int(request_line[1][len('/runs/'):]))
+            else:
+                await self.send_response(writer, 404, 'Not Found')
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def send_response(writer, status, reason, content_type='text/plain', body=None):
+        body = reason.encode() if body is None else body
+        writer.write(f'HTTP/1.1 {status} {reason}\r\nContent-Type: {content_type}\r\nContent-Length: {len(body)}\r\n'
+                     f'Connection: close\r\n\r\n'.encode() + body)
+        await writer.drain()
+
+    @staticmethod
+    def start_chunked_response(writer):
+        writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: application/octet-stream\r\nTransfer-Encoding: chunked\r\n'
+                     b'Cache-Control: no-cache\r\nConnection: close\r\n\r\n')
+
+    async def stream_live(self, writer):
+        import asyncio
+        import socket
+
+        sock = writer.get_extra_info('socket')
+        if sock is not None:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, LIVE_SEND_BUFFER_BYTES)
+        self.start_chunked_response(writer)
+        subscriber = Subscriber(writer)
+        self.subscribers.add(subscriber)
+        self.live_tasks.add(asyncio.current_task())
+        try:
+            while not subscriber.is_finished:
+                await subscriber.ready.wait()
+                if subscriber.is_closed:
+                    return
+                # frames published while this chunk is being sent wait in the queue, drain() returns when
+                # the socket buffer is below its limit, so the queue is where a slow subscriber's backlog builds up
+                writer.write(encode_chunk(b''.join(subscriber.take_frames())))
+                await writer.drain()
+            writer.write(encode_chunk(b''))
+            await writer.drain()
+        finally:
+            self.subscribers.discard(subscriber)
+            self.live_tasks.discard(asyncio.current_task())
+
+    def get_store(self):
+        return store.RunStore(self.store_path) if self.store_path else store.get_default_store()
+
+    async def send_run_list(self, writer):
+        def find_runs():
+            return [{field: value for field, value in run._asdict().items()} for run in self.get_store().find_runs()]
+
+        runs = await self.loop.run_in_executor(None, find_runs)
+        await self.send_response(writer, 200, 'OK', 'application/json', json.dumps(runs, default=str).encode())
+
+    async def send_run(self, writer, run_id):
+        def load_run():
+            run_store = self.get_store()
+            return run_store.get_run(run_id), run_store.load_samples(run_id)
+
+        try:
+            record, samples = await self.loop.run_in_executor(None, load_run)
+        except KeyError:
+            await self.send_response(writer, 404, 'Not Found')
+            return
+        self.start_chunked_response(writer)
+        writer.write(encode_chunk(encode_event(EVENT_RUN, **record._asdict())))
+        for start in range(0, samples.shape[1], SAMPLES_PER_FRAME):
+            chunk = samples[:, start:start + SAMPLES_PER_FRAME]
+            writer.write(encode_chunk(encode_samples(record.device, chunk[0], chunk[1], chunk[2])))
+            await writer.drain()
+        writer.write(encode_chunk(b''))
+        await writer.drain()
+
+
+_server = None
+
+
+def get_server():
+    return _server
+
+
+def start_server(host=DEFAULT_HOST, port=DEFAULT_PORT, store_path=None):
+    global _server
+    if _server is None:
+        _server = StreamingServer(host, port, store_path).start()
+    return _server
+
+
+def parse_address(address):
+    """
+        Returns (host, port) of [host:]port address. Raises ValueError when the port isn't a number.
+    """
+    host, _, port = address.rpartition(':')
+    return host or DEFAULT_HOST, int(port)
+
+
+def start_server_from_environment():
+    address = os.environ.get(STREAMING_SERVER_VARIABLE)
+    return start_server(*parse_address(address)) if address else None
+
+
+def stop_server():
+    global _server
+    if _server is not None:
+        _server.stop()
+        _server = None
+
+
+def publish_event(event, context, **fields):
+    # events are published only when the server is running and somebody is subscribed
+    if _server is not None and _server.has_subscribers():
+        fields = dict(get_context_fields(context) if context is not None else {}, **fields)
+        _server.publish(lambda: encode_event(event, **fields))
+
+
+def publish_samples(device, t, volt, curr):
+    if _server is not None and _server.has_subscribers():
+        # acquisition reuses its chunk buffer, the frame is encoded later in the server thread, so it gets a copy
+        samples = (t.copy(), volt.copy(), curr.copy())
+        _server.publish(lambda: encode_samples(device, *samples), is_droppable=True)
@@ -0,0 +1,552 @@
+import asyncio
+import json
+import os
+import threading
+from collections import deque
+
+import numpy as np
+from potentiostat import Potentiostat
+from potentiostat.potentiostat import (CommandKey, CurrKey, CurrRangeKey, DataDecodeException, DeviceIdKey,
+                                       GetCurrRangeCmd, GetDeviceIdCmd, GetParamCmd, GetSamplePeriodCmd,
+                                       GetTestDoneTimeCmd, GetTestNamesCmd, GetVariantCmd, GetVersionCmd,
+                                       HwVariantToCurrRangesDict, HwVariantToVoltRangesDict, MessageKey, ParamKey,
+                                       ResponseKey, RunTestCmd, SamplePeriodKey, SetCurrRangeCmd, SetParamCmd,
+                                       SetSamplePeriodCmd, SetVoltRangeCmd, StopTestCmd, SuccessKey, TestDoneTimeKey,
+                                       TestKey, TestNameArrayKey, TimeKey, TimeUnitToScale, VariantKey, VersionKey,
+                                       VoltKey, VoltRangeKey)
+
+# ZNTEST_SERIAL_TRANSPORT=asyncio connects potentiostats through PipelinedPotentiostat of this module
+# instead of potentiostat.Potentiostat
+SERIAL_TRANSPORT_VARIABLE = 'ZNTEST_SERIAL_TRANSPORT'
+ASYNCIO_SERIAL_TRANSPORT = 'asyncio'
+
+BAUDRATE = 115200
+COMMAND_TIMEOUT_SEC = 1.5
+READ_BUFFER_SIZE = 64 * 1024
+# ports without a file descriptor (Windows) are polled instead of waiting for them to become readable
+READ_POLL_INTERVAL_SEC = 0.005
+TIME_SCALE = TimeUnitToScale['s']
+
+STATE_IDLE = 'idle'
+STATE_TESTING = 'testing'
+STATE_STOPPING = 'stopping'
+
+# sample messages {"t":10,"v":-1.4000,"i":0.0123} become whitespace separated numbers when the JSON syntax
+# and the key names are removed
+SAMPLE_PREFIX = b'{"' + TimeKey.encode() + b'":'
+VOLT_FIELD = b'"' + VoltKey.encode() + b'":'
+CURR_FIELD = b'"' + CurrKey.encode() + b'":'
+SAMPLE_SEPARATORS = bytes.maketrans(b':,\r\n', b'    ')
+SAMPLE_DELETED_CHARS = b'{}"' + TimeKey.encode() + VoltKey.encode() + CurrKey.encode()
+
+
+def is_asyncio_transport_enabled():
+    return os.environ.get(SERIAL_TRANSPORT_VARIABLE) == ASYNCIO_SERIAL_TRANSPORT
+
+
+_event_loop = None
+_event_loop_lock = threading.Lock()
+
+
+def get_event_loop():
+    """
+        Returns the event loop shared by the serial ports of all potentiostats, it runs in its own daemon thread.
+    """
+    global _event_loop
+    with _event_loop_lock:
+        if _event_loop is None:
+            _event_loop = asyncio.new_event_loop()
+            threading.Thread(target=_event_loop.run_forever, name='zntest-serial', daemon=True).start()
+        return _event_loop
+
+
+def encode_cmd(cmd_dict):
+    cmd_json = json.dumps(cmd_dict, separators=(',', ':')) + '\n'
+    # the same workaround of the USB serial bug of 64 bytes long messages as Potentiostat.write
+    if len(cmd_json) % 64 == 0:
+        cmd_json = f' {cmd_json}'
+    return cmd_json.encode()
+
+
+def check_response(cmd_dict, msg_dict, expected=None):
+    """
+        Raises IOError when the response doesn't confirm the command, the same checks as Potentiostat.check_cmd_msg.
+        expected is (response key, value) the device has to echo, e.g. the current range which was set.
+    """
+    if SuccessKey not in msg_dict:
+        raise IOError(f'json key {SuccessKey} missing')
+    if not msg_dict[SuccessKey]:
+        raise IOError(f'{msg_dict.get(MessageKey)}, {msg_dict}')
+    response = msg_dict.get(ResponseKey, {})
+    if response.get(CommandKey) != cmd_dict[CommandKey]:
+        raise IOError(f'command sent, {cmd_dict[CommandKey]}, not same as received, {response.get(CommandKey)}')
+    if TestKey in cmd_dict and response.get(TestKey) != cmd_dict[TestKey]:
+        raise IOError(f'testname sent, {cmd_dict[TestKey]}, not same as received, {response.get(TestKey)}')
+    if expected is not None and response.get(expected[0]) != expected[1]:
+        raise IOError(f'{expected[0]} sent, {expected[1]}, not same as received, {response.get(expected[0])}')
+
+
+def parse_sample_lines(buffer, end):
+    """
+        Parses the complete lines buffer[:end] of sample messages into (3, samples count) array of t in s, volt
+        and curr rows. The lines are checked and counted in the buffer itself, then the numbers of all of them are
+        parsed with a single np.fromstring call. Returns None when a line isn't a sample message of the t, v, i keys
+        in this order, e.g. a response or the end of the test, such lines are parsed one by one.
+    """
+    lines_count = buffer.count(b'\n', 0, end)
+    if buffer.count(SAMPLE_PREFIX, 0, end) != lines_count or buffer.count(b':', 0, end) != 3 * lines_count:
+        return None
+    # every line is written by the same firmware code, so the key order of the first one is the order of all
+    volt_position = buffer.find(VOLT_FIELD, 0, end)
+    curr_position = buffer.find(CURR_FIELD, 0, end)
+    if not 0 < volt_position < curr_position < buffer.find(b'\n', 0, end):
+        return None
+
+    values = np.fromstring(buffer[:end].translate(SAMPLE_SEPARATORS, SAMPLE_DELETED_CHARS).decode('ascii'),
+                           dtype=float, sep=' ')
+    if len(values) != 3 * lines_count:
+        return None
+    samples = values.reshape(-1, 3).T
+    samples[0] *= TIME_SCALE
+    return samples
+
+
+class AsyncPotentiostat:
+    """
+        Class talking to the potentiostat over the serial port from an asyncio event loop.
+        The port is read whenever it becomes readable, into one preallocated buffer, and complete lines are parsed
+        in place: a batch of sample messages is parsed at once by parse_sample_lines, other messages are responses
+        matched to the commands in the order they were written. Commands are pipelined, any number of them may be
+        written before the first response comes back, so several devices can share one loop without a thread
+        blocked on every port.
+    """
+
+    def __init__(self, port, serial_port):
+        self.port = port
+        self.serial_port = serial_port
+        self.loop = asyncio.get_running_loop()
+        self.buffer = bytearray(READ_BUFFER_SIZE)
+        self.buffer_size = 0
+        # (command, response future, expected echo) of the commands waiting for their responses
+        self.pending = deque()
+        # responses nobody waits for, they are checked by the next command which is waited for
+        self.deferred = []
+        self.state = STATE_IDLE
+        self.chunks = deque()
+        self.buffered_count = 0
+        self.samples_event = asyncio.Event()
+        self.stopped = None
+        self.error = None
+        # a line of the running test which isn't JSON, raised by read_samples as run_test raises it
+        self.test_error = None
+        self.poll_task = None
+        self.hardware_variant = None
+        self.firmware_version = None
+
+    @classmethod
+    async def connect(cls, port):
+        import serial
+
+        # the port is locked, so the discovery of another application instance doesn't write to it
+        serial_port = serial.Serial(port, baudrate=BAUDRATE, timeout=0, exclusive=True)
+        serial_port.reset_input_buffer()
+        transport = cls(port, serial_port)
+        transport.start_reading()
+        try:
+            variant_response, version_response = await transport.send_cmds([{CommandKey: GetVariantCmd},
+                                                                             {CommandKey: GetVersionCmd}])
+        except BaseException:
+            await transport.close()
+            raise
+        transport.hardware_variant = variant_response[ResponseKey][VariantKey]
+        transport.firmware_version = version_response[ResponseKey][VersionKey]
+        return transport
+
+    def start_reading(self):
+        try:
+            self.loop.add_reader(self.serial_port.fileno(), self.on_readable)
+        except (OSError, ValueError, NotImplementedError):
+            # pyserial ports have no file descriptor on Windows and the proactor loop can't wait for them
+            self.poll_task = self.loop.create_task(self.poll_serial_port())
+
+    def stop_reading(self):
+        if self.poll_task is not None:
+            self.poll_task.cancel()
+            self.poll_task = None
+        elif self.serial_port.is_open:
+            self.loop.remove_reader(self.serial_port.fileno())
+
+    def on_readable(self):
+        view = memoryview(self.buffer)[self.buffer_size:]
+        try:
+            read_size = os.readv(self.serial_port.fileno(), [view])
+        except BlockingIOError:
+            return
+        except OSError as error:
+            self.fail(error)
+            return
+        finally:
+            view.release()
+        if read_size == 0:
+            self.fail(IOError(f'{self.port} is disconnected'))
+            return
+        self.on_data(read_size)
+
+    async def poll_serial_port(self):
+        while True:
+            try:
+                data = self.serial_port.read(self.serial_port.in_waiting)
+            except OSError as error:
+                self.fail(error)
+                return
+            if not data:
+                await asyncio.sleep(READ_POLL_INTERVAL_SEC)
+                continue
+            if self.buffer_size + len(data) > len(self.buffer):
+                self.buffer.extend(bytes(self.buffer_size + len(data) - len(self.buffer)))
+            self.buffer[self.buffer_size:self.buffer_size + len(data)] = data
+            self.on_data(len(data))
+
+    def on_data(self, read_size):
+        self.buffer_size += read_size
+        end = self.buffer.rfind(b'\n', 0, self.buffer_size) + 1
+        if end > 0:
+            self.handle_lines(end)
+            # the incomplete last line is moved to the start of the buffer, the buffer keeps its size
+            remaining_size = self.buffer_size - end
+            self.buffer[:remaining_size] = self.buffer[end:self.buffer_size]
+            self.buffer_size = remaining_size
+        if self.buffer_size == len(self.buffer):
+            # a line longer than the buffer
+            self.buffer.extend(bytes(len(self.buffer)))
+
+    def handle_lines(self, end):
+        if self.state == STATE_TESTING:
+            samples = parse_sample_lines(self.buffer, end)
+            if samples is not None:
+                self.add_samples(samples)
+                return
+
+        start = 0
+        while start < end:
+            line_end = self.buffer.index(b'\n', start, end) + 1
+            self.handle_line(self.buffer[start:line_end])
+            start = line_end
+
+    def handle_line(self, line):
+        try:
+            message = json.loads(line)
+        except ValueError:
+            if self.state == STATE_TESTING:
+                # the test ends, as Potentiostat.run_test ends it with max_decode_err=0
+                self.test_error = DataDecodeException(f'{self.port} sent a line which is not JSON: {line[:80]!r}')
+                self.state = STATE_IDLE
+                self.samples_event.set()
+            # garbled and empty lines between the tests are skipped
+            return
+
+        if self.state == STATE_TESTING:
+            if TimeKey in message:
+                self.add_samples(np.array([[message[TimeKey] * TIME_SCALE], [message[VoltKey]],
+                                           [message[CurrKey]]]))
+            else:
+                # the end of the test is reported with a message without sample data
+                self.state = STATE_IDLE
+                self.samples_event.set()
+            return
+        if self.state == STATE_STOPPING:
+            if TimeKey not in message:
+                self.state = STATE_IDLE
+                if not self.stopped.done():
+                    self.stopped.set_result(None)
+            return
+        if not self.pending or TimeKey in message:
+            # samples sent after the test was stopped aren't responses
+            return
+
+        cmd_dict, future, expected = self.pending.popleft()
+        if future.done():
+            return
+        try:
+            check_response(cmd_dict, message, expected)
+        except IOError as error:
+            future.set_exception(error)
+            return
+        if cmd_dict[CommandKey] == RunTestCmd:
+            # samples follow the response right away, possibly in the same read
+            self.state = STATE_TESTING
+        future.set_result(message)
+
+    def add_samples(self, samples):
+        self.chunks.append(samples)
+        self.buffered_count += samples.shape[1]
+        self.samples_event.set()
+
+    def fail(self, error):
+        self.error = error
+        self.stop_reading()
+        self.fail_pending(error)
+        self.samples_event.set()
+        if self.stopped is not None and not self.stopped.done():
+            self.stopped.set_result(None)
+
+    def fail_pending(self, error):
+        while self.pending:
+            _, future, _ = self.pending.popleft()
+            if not future.done():
+                future.set_exception(error)
+
+    def check_error(self):
+        if self.error is not None:
+            raise self.error
+
+    def write_cmd(self, cmd_dict, rsp=True, expected=None):
+        """
+            Writes the command without waiting for its response and returns the response future,
+            None when rsp is False.
+        """
+        self.check_error()
+        self.serial_port.write(encode_cmd(cmd_dict))
+        if not rsp:
+            return None
+        future = self.loop.create_future()
+        self.pending.append((cmd_dict, future, expected))
+        return future
+
+    async def wait_response(self, future):
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), COMMAND_TIMEOUT_SEC)
+        except asyncio.TimeoutError:
+            # later responses can't be matched to their commands anymore
+            self.fail_pending(TimeoutError(f'{self.port} doesn\'t respond'))
+            raise
+
+    def check_deferred(self):
+        # responses come in the order of the commands, so the deferred ones are resolved by now
+        deferred, self.deferred = self.deferred, []
+        for future in deferred:
+            if future.done() and future.exception() is not None:
+                raise future.exception()
+
+    async def defer_cmd(self, cmd_dict, expected=None):
+        """
+            Writes the command, its response is checked when the response of the next command is waited for.
+        """
+        self.deferred.append(self.write_cmd(cmd_dict, expected=expected))
+
+    async def send_cmd(self, cmd_dict, rsp=True):
+        future = self.write_cmd(cmd_dict, rsp)
+        if future is None:
+            return None
+        try:
+            response = await self.wait_response(future)
+        finally:
+            self.check_deferred()
+        return response
+
+    async def send_cmds(self, cmd_dicts):
+        # all commands are written before their responses are waited for, so they cost one round-trip
+        futures = [self.write_cmd(cmd_dict) for cmd_dict in cmd_dicts]
+        responses = await asyncio.gather(*(self.wait_response(future) for future in futures), return_exceptions=True)
+        self.check_deferred()
+        for response in responses:
+            if isinstance(response, BaseException):
+                raise response
+        return responses
+
+    async def start_test(self, test_name):
+        self.chunks.clear()
+        self.buffered_count = 0
+        self.test_error = None
+        try:
+            await self.send_cmd({CommandKey: RunTestCmd, TestKey: test_name})
+        except BaseException:
+            # the device runs the test even when a setting written before it was refused
+            await self.stop_test()
+            raise
+
+    def is_chunk_ready(self, chunk_size, chunk_max_duration):
+        if self.buffered_count >= chunk_size or self.state != STATE_TESTING or self.error is not None:
+            return True
+        return self.buffered_count > 0 and self.chunks[-1][0, -1] - self.chunks[0][0, 0] >= chunk_max_duration
+
+    async def read_samples(self, chunk_size, chunk_max_duration):
+        """
+            Returns the next (3, samples count) chunk of at most chunk_size samples as soon as chunk_size samples
+            or chunk_max_duration seconds of device time are read, None after the last chunk of the test.
+            TimeoutError is raised when no sample comes for COMMAND_TIMEOUT_SEC, the timeout of the serial reads
+            of Potentiostat.
+        """
+        while not self.is_chunk_ready(chunk_size, chunk_max_duration):
+            self.samples_event.clear()
+            try:
+                await asyncio.wait_for(self.samples_event.wait(), COMMAND_TIMEOUT_SEC)
+            except asyncio.TimeoutError:
+                raise TimeoutError(f'{self.port} sent no samples for {COMMAND_TIMEOUT_SEC} s') from None
+        self.check_error()
+        if self.buffered_count == 0:
+            if self.test_error is not None:
+                raise self.test_error
+            return None
+
+        chunks = []
+        count = 0
+        while self.chunks and count < chunk_size:
+            chunk = self.chunks.popleft()
+            if count + chunk.shape[1] > chunk_size:
+                self.chunks.appendleft(chunk[:, chunk_size - count:])
+                chunk = chunk[:, :chunk_size - count]
+            chunks.append(chunk)
+            count += chunk.shape[1]
+        self.buffered_count -= count
+        return chunks[0] if len(chunks) == 1 else np.concatenate(chunks, axis=1)
+
+    async def stop_test(self):
+        """
+            Stops the running test and skips the samples sent before the device stopped.
+        """
+        if self.state != STATE_TESTING:
+            return
+        self.stopped = self.loop.create_future()
+        self.state = STATE_STOPPING
+        try:
+            self.write_cmd({CommandKey: StopTestCmd}, rsp=False)
+            await asyncio.wait_for(self.stopped, COMMAND_TIMEOUT_SEC)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            self.state = STATE_IDLE
+            self.chunks.clear()
+            self.buffered_count = 0
+
+    async def close(self):
+        self.stop_reading()
+        self.serial_port.close()
+        self.fail_pending(IOError(f'{self.port} is closed'))
+
+
+class ExclusivePotentiostat(Potentiostat):
+    """
+        potentiostat.Potentiostat which locks the serial port while it is open, like the ports of
+        AsyncPotentiostat, so the discovery of another application instance can't open the port and write to it
+        in the middle of a test. SerialException is raised when the port is already locked.
+    """
+
+    def open(self):
+        # Potentiostat doesn't pass serial options through, the lock is requested right before the port is opened
+        self.exclusive = True
+        super().open()
+
+
+class PipelinedPotentiostat:
+    """
+        Class with the interface of potentiostat.Potentiostat used by the application, on top of AsyncPotentiostat
+        running in the event loop shared by all ports. Settings are written without waiting for their responses,
+        the device confirms them before the response of the next command which is waited for, usually runTest,
+        so a test is configured and started in one round-trip. A setting the device refused raises IOError
+        from that command.
+    """
+
+    is_pipelined = True
+
+    def __init__(self, port):
+        self.port = port
+        self.loop = get_event_loop()
+        self.transport = self.call(AsyncPotentiostat.connect(port))
+        self.hardware_variant = self.transport.hardware_variant
+
+    def call(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    def open(self):
+        if self.transport.serial_port.is_open:
+            return
+        self.transport = self.call(AsyncPotentiostat.connect(self.port))
+
+    def close(self):
+        self.call(self.transport.close())
+
+    def send_cmd(self, cmd_dict, rsp=True):
+        return self.call(self.transport.send_cmd(cmd_dict, rsp))
+
+    def get_response(self, cmd_dict, key):
+        return self.send_cmd(cmd_dict)[ResponseKey][key]
+
+    def get_hardware_variant(self):
+        return self.hardware_variant
+
+    def get_firmware_version(self):
+        return self.transport.firmware_version
+
+    def get_all_curr_range(self):
+        return HwVariantToCurrRangesDict[self.hardware_variant]
+
+    def get_all_volt_range(self):
+        return HwVariantToVoltRangesDict[self.hardware_variant]
+
+    def get_curr_range(self):
+        return self.get_response({CommandKey: GetCurrRangeCmd}, CurrRangeKey)
+
+    def set_curr_range(self, curr_range):
+        if curr_range not in self.get_all_curr_range():
+            raise ValueError('unknown current range')
+        self.call(self.transport.defer_cmd({CommandKey: SetCurrRangeCmd, CurrRangeKey: curr_range},
+                                           (CurrRangeKey, curr_range)))
+        return curr_range
+
+    def set_volt_range(self, volt_range):
+        if volt_range not in self.get_all_volt_range():
+            raise ValueError('unknown voltage range')
+        self.call(self.transport.defer_cmd({CommandKey: SetVoltRangeCmd, VoltRangeKey: volt_range},
+                                           (VoltRangeKey, volt_range)))
+        return volt_range
+
+    def get_sample_period(self):
+        return self.get_response({CommandKey: GetSamplePeriodCmd}, SamplePeriodKey)
+
+    def set_sample_period(self, sample_period):
+        self.call(self.transport.defer_cmd({CommandKey: SetSamplePeriodCmd, SamplePeriodKey: sample_period},
+                                           (SamplePeriodKey, sample_period)))
+        return sample_period
+
+    def get_sample_rate(self):
+        return 1.0e3 / self.get_sample_period()
+
+    def set_sample_rate(self, sample_rate):
+        return self.set_sample_period(int(1.0e3 / sample_rate))
+
+    def get_param(self, testname):
+        return self.get_response({CommandKey: GetParamCmd, TestKey: testname}, ParamKey)
+
+    def set_param(self, testname, param):
+        self.call(self.transport.defer_cmd({CommandKey: SetParamCmd, TestKey: testname, ParamKey: param}))
+        return param
+
+    def get_device_id(self):
+        return self.get_response({CommandKey: GetDeviceIdCmd}, DeviceIdKey)
+
+    def get_test_names(self):
+        return self.get_response({CommandKey: GetTestNamesCmd}, TestNameArrayKey)
+
+    def get_test_done_time(self, test, timeunit='ms'):
+        return self.get_response({CommandKey: GetTestDoneTimeCmd, TestKey: test}, TestDoneTimeKey) * \
+            TimeUnitToScale[timeunit]
+
+    def stop_test(self, rsp=True):
+        self.call(self.transport.stop_test())
+
+    def iter_test_chunks(self, test_name, chunk_size, chunk_max_duration):
+        """
+            Runs the test and yields (t, volt, curr) chunks as they are parsed, the test is stopped when
+            the generator is closed before the end of the test.
+        """
+        self.call(self.transport.start_test(test_name))
+        try:
+            while True:
+                samples = self.call(self.transport.read_samples(chunk_size, chunk_max_duration))
+                if samples is None:
+                    return
+                yield samples[0], samples[1], samples[2]
+        except GeneratorExit:
+            self.stop_test()
+            raise
@@ -1,131 +1,460 @@
 import csv
+import io
+import json
 import os
+from collections import namedtuple
 from datetime import datetime
 from json.decoder import JSONDecodeError
 
-import matplotlib.pyplot as plt
-import serial.tools.list_ports
-from potentiostat import Potentiostat
-from serial.serialutil import SerialException
+import zntest.instrumentation as instrumentation
+import zntest.recipe as recipe
+import zntest.streaming as streaming
+import zntest.simulator as simulator
+import zntest.store as store
+from zntest.devicestate import invalidate_device_state
+from zntest.locking import is_file_locked, lock_file
+
+
+# NumPy, pyserial and the potentiostat driver are imported by the functions which need them,
+# so importing utils doesn't delay the GUI start
+
+SERIAL_TIMEOUT_SEC = 1.5
+# USB ids (Teensy 3.2 of the Rodeostat) and descriptions of the serial ports of potentiostat boards
+POTENTIOSTAT_USB_IDS = {(0x16C0, 0x0483)}
+POTENTIOSTAT_PORT_DESCRIPTIONS = ('teensy', 'rodeostat', 'potentiostat')
+
+
+def list_available_ports():
+    """
+        Returns (port, is potentiostat) pairs of the serial ports, a port is taken for a potentiostat when its USB
+        ids or description are the ones of a potentiostat board, other ports aren't probed by the discovery.
+    """
+    import serial.tools.list_ports
+
+    available_ports = []
+    for port_info in serial.tools.list_ports.comports():
+        description = f'{port_info.description or ""} {port_info.product or ""}'.lower()
+        is_potentiostat = (port_info.vid, port_info.pid) in POTENTIOSTAT_USB_IDS or \
+            any(name in description for name in POTENTIOSTAT_PORT_DESCRIPTIONS)
+        available_ports.append((port_info.device, is_potentiostat))
+    # simulated potentiostats (see zntest.simulator) are listed after the serial ports when they are enabled
+    return available_ports + [(port, True) for port in simulator.get_simulated_ports()]
 
 
 def get_available_ports():
-    return [i.device for i in serial.tools.list_ports.comports()]
+    return [port for port, _ in list_available_ports()]
+
+
+def get_potentiostat_ports():
+    return [port for port, is_potentiostat in list_available_ports() if is_potentiostat]
+
+
+def connect(port, timeout=SERIAL_TIMEOUT_SEC):
+    """
+        Returns the potentiostat connected to the port, None when the port can't be opened or it is locked
+        by another application instance. Serial reads of the connection wait for at most timeout seconds,
+        then SERIAL_TIMEOUT_SEC is used again.
+    """
+    if simulator.is_simulated_port(port):
+        return simulator.SimulatedPotentiostat(port)
 
+    from serial.serialutil import SerialException
+
+    import zntest.transport as transport
 
-def connect(port):
     pstat_obj = None
+    # the asyncio transport (see zntest.transport) is used instead of the driver when it is enabled
+    if transport.is_asyncio_transport_enabled():
+        try:
+            pstat_obj = transport.PipelinedPotentiostat(port)
+        except (SerialException, OSError):
+            pass
+        return pstat_obj
+
     try:
-        pstat_obj = Potentiostat(port, timeout=1.5)
-    except SerialException or JSONDecodeError:
+        pstat_obj = transport.ExclusivePotentiostat(port, timeout=timeout)
+    except (SerialException, JSONDecodeError):
         pass
+    else:
+        pstat_obj.timeout = SERIAL_TIMEOUT_SEC
     return pstat_obj
 
 
-def run_constant_voltage_test(pstat, context):
-    test_name = 'constant'
-    pstat.set_curr_range(context['current_range'])
-    pstat.set_sample_rate(context['sample_rate'])
+OUTPUT_DATA_HEADER = ['time', 'volt', 'current', 'compound']
+OUTPUT_DATA_LINE_TERMINATOR = '\r\n'
+
+
+def format_csv_row(values):
+    row_buffer = io.StringIO()
+    csv.writer(row_buffer, delimiter=',', lineterminator=OUTPUT_DATA_LINE_TERMINATOR).writerow(values)
+    return row_buffer.getvalue()
+
+
+def format_output_data(t, volt, curr, compound):
+    # The compound column is the same for every row, so it is baked into the row format once and the whole
+    # table is rendered with a single %-formatting call over the flattened sample array
+    import numpy as np
+
+    compound_field = format_csv_row([compound])[:-len(OUTPUT_DATA_LINE_TERMINATOR)]
+    row_format = '%.4f,%.4f,%.4f,' + compound_field.replace('%', '%%') + OUTPUT_DATA_LINE_TERMINATOR
+    samples = np.column_stack((np.asarray(t, dtype=float), np.asarray(volt, dtype=float),
+                               np.asarray(curr, dtype=float)))
+    return (row_format * len(samples)) % tuple(samples.ravel().tolist())
+
+
+SAMPLES_CHUNK_SIZE = 500
+# at low sample rates a chunk is yielded after this much device time, so consumers never wait long for samples
+SAMPLES_CHUNK_MAX_DURATION_SEC = 1.0
+PARTIAL_FILE_SUFFIX = '.partial'
+
+TestResult = namedtuple('TestResult', ['start_time', 'samples_count', 'run_id', 'analysis'], defaults=(None,))
+
+
+def iter_test_samples(pstat, test_name, param, chunk_size=SAMPLES_CHUNK_SIZE,
+                      chunk_max_duration=SAMPLES_CHUNK_MAX_DURATION_SEC, max_decode_errors=0):
+    """
+        Runs the test and yields (t, volt, curr) chunks of at most chunk_size samples and chunk_max_duration seconds
+        as soon as they come off the serial port. It follows the protocol of Potentiostat.run_test, but samples are
+        kept in one preallocated buffer instead of growing lists, so memory use doesn't depend on the test duration.
+        Yielded arrays are views of that buffer and are overwritten by the next chunk.
+        When the generator is closed before the end of the test, e.g. the test is aborted, the test is stopped.
+        DataDecodeException is raised after more than max_decode_errors lines in a row which aren't JSON,
+        as Potentiostat.run_test raises it, an empty line read when the port timed out counts as one.
+    """
+    import numpy as np
+    from potentiostat.potentiostat import CommandKey, CurrKey, DataDecodeException, RunTestCmd, TestKey, TimeKey, \
+        TimeUnitToScale, VoltKey
+
+    if param is not None:
+        pstat.set_param(test_name, param)
+    if getattr(pstat, 'is_pipelined', False):
+        # the asyncio transport reads and parses samples in batches itself
+        yield from pstat.iter_test_chunks(test_name, chunk_size, chunk_max_duration)
+        return
+
+    time_scale = TimeUnitToScale['s']
+    buffer = np.empty((3, chunk_size))
+    samples_count = 0
+    decode_errors_count = 0
+
+    pstat.send_cmd({CommandKey: RunTestCmd, TestKey: test_name})
+    try:
+        while True:
+            sample_json = pstat.readline().strip()
+            try:
+                sample = json.loads(sample_json.decode())
+            except ValueError:
+                # a device which went quiet or was unplugged only returns empty lines
+                decode_errors_count += 1
+                if decode_errors_count > max_decode_errors:
+                    raise DataDecodeException(f'{decode_errors_count} lines in a row are not JSON, the last one: '
+                                              f'{sample_json[:80]!r}') from None
+                continue
+            decode_errors_count = 0
+            if TimeKey not in sample:
+                # the end of the test is reported with a message without sample data
+                break
+
+            buffer[0, samples_count] = sample[TimeKey] * time_scale
+            buffer[1, samples_count] = sample[VoltKey]
+            buffer[2, samples_count] = sample[CurrKey]
+            samples_count += 1
+            if samples_count == chunk_size or buffer[0, samples_count - 1] - buffer[0, 0] >= chunk_max_duration:
+                yield buffer[0, :samples_count], buffer[1, :samples_count], buffer[2, :samples_count]
+                samples_count = 0
+    except GeneratorExit:
+        # the consumer stopped reading in the middle of the test
+        stop_test(pstat)
+        raise
+
+    if samples_count > 0:
+        yield buffer[0, :samples_count], buffer[1, :samples_count], buffer[2, :samples_count]
+
+
+def stop_test(pstat, max_decode_errors=0):
+    """
+        Stops the running test and skips the samples sent before the device stopped. DataDecodeException is raised
+        after more than max_decode_errors lines in a row which aren't JSON.
+    """
+    from potentiostat.potentiostat import DataDecodeException, TimeKey
+
+    pstat.stop_test(rsp=False)
+    decode_errors_count = 0
+    while True:
+        line = pstat.readline().strip()
+        if not line:
+            # the read timed out, the device doesn't send anything more
+            return
+        try:
+            message = json.loads(line.decode())
+        except ValueError:
+            decode_errors_count += 1
+            if decode_errors_count > max_decode_errors:
+                raise DataDecodeException(f'{decode_errors_count} lines in a row are not JSON while the test '
+                                          f'was stopped') from None
+            continue
+        decode_errors_count = 0
+        if TimeKey not in message:
+            return
+
+
+def get_output_file_path(test_folder_name, context, start_time, extension='.csv', index=1):
+    output_file_name = '{}__{}{}{}'.format(context['compound'], start_time.strftime('%Y-%m-%d__%H-%M-%S'),
+                                           f'_{index}' if index > 1 else '', extension)
+    output_file_folder = os.path.join(os.getcwd(), 'data', 'out', test_folder_name)
+    if os.path.exists(output_file_folder) is False:
+        os.makedirs(output_file_folder)
+    return os.path.join(output_file_folder, output_file_name)
+
+
+class OutputDataWriter:
+    """
+        Class saving test output data while the test is running.
+        Every chunk is appended and flushed to '<run file>.partial' and committed to the run store,
+        the partial file is converted to the binary run file (see zntest.runfile) when the test is over.
+        CSV files are exported from run files on demand.
+    """
+
+    def __init__(self, test_folder_name, context, start_time):
+        import zntest.runfile as runfile
+
+        # another application instance may save a run of the same compound started in the same second,
+        # creating the partial file exclusively reserves the name
+        header = runfile.create_header(test_folder_name, context, start_time)
+        index = 1
+        while True:
+            self.output_file_path = get_output_file_path(test_folder_name, context, start_time,
+                                                         runfile.RUN_FILE_EXTENSION, index)
+            try:
+                if os.path.exists(self.output_file_path) is False:
+                    self.run_file_writer = runfile.RunFileWriter(self.output_file_path + PARTIAL_FILE_SUFFIX, header)
+                    break
+            except FileExistsError:
+                pass
+            index += 1
+
+        self.run_store = store.get_default_store()
+        self.run_id = self.run_store.begin_run(test_folder_name, context, start_time, self.output_file_path)
+        self.chunks_count = 0
+        self.samples_count = 0
+
+    def write(self, t, volt, curr):
+        with instrumentation.span('write_run_file'):
+            self.run_file_writer.write(t, volt, curr)
+        # records of float64 (t, volt, curr) in the run file, float32 columns in the store
+        instrumentation.count('run_file_bytes', len(t) * 3 * 8)
+
+        with instrumentation.span('write_store'):
+            self.run_store.append_samples(self.run_id, self.chunks_count, t, volt, curr)
+        instrumentation.count('store_bytes', len(t) * 3 * 4)
+        self.chunks_count += 1
+        self.samples_count += len(t)
+
+    def close(self, is_complete=True):
+        import zntest.runfile as runfile
+
+        # the run file is finished while the partial file is still locked, so it isn't recovered meanwhile
+        # by another application instance
+        with instrumentation.span('finish_run_file'):
+            self.run_file_writer.sync()
+            runfile.finish_run_file(self.output_file_path + PARTIAL_FILE_SUFFIX, self.output_file_path,
+                                    is_records_removed=False)
+        self.run_file_writer.close()
+        remove_file(self.output_file_path + PARTIAL_FILE_SUFFIX)
+        self.run_store.finish_run(self.run_id, store.RUN_STATUS_COMPLETE if is_complete else store.RUN_STATUS_PARTIAL)
+
+
+def remove_file(path):
+    # the file may be removed by another application instance already
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def recover_partial_run_file(partial_file_path, output_file_path):
+    """
+        Converts the partial run file to the run file, returns False when the file is being written or recovered
+        by another application instance.
+    """
+    import zntest.runfile as runfile
+
+    try:
+        partial_file = open(partial_file_path, 'rb')
+    except FileNotFoundError:
+        return False
+    with partial_file:
+        if not lock_file(partial_file):
+            return False
+        # the run file exists when the crash happened after it was finished, before the partial file was removed
+        if os.path.exists(output_file_path) is False:
+            try:
+                runfile.finish_run_file(partial_file_path, output_file_path, is_records_removed=False)
+            except ValueError:
+                # the crash happened before the header was written, there are no samples to recover
+                output_file_path = None
+    remove_file(partial_file_path)
+    return output_file_path is not None
+
+
+def recover_partial_runs():
+    """
+        Recovers runs interrupted by a crash: partial run files are converted to regular run files (legacy CSV ones
+        are truncated to the last complete row), runs left running in the store are marked as partial.
+        Runs being written by another application instance sharing the folder are kept as they are.
+    """
+    import zntest.runfile as runfile
+
+    recovered_file_paths = []
+    output_folder = os.path.join(os.getcwd(), 'data', 'out')
+    for test_folder_name in (recipe.CONSTANT_VOLTAGE_TEST_KIND, recipe.SQUARE_WAVE_VOLTAMMETRY_TEST_KIND):
+        output_file_folder = os.path.join(output_folder, test_folder_name)
+        if os.path.exists(output_file_folder) is False:
+            continue
+        for file_name in os.listdir(output_file_folder):
+            if not file_name.endswith(PARTIAL_FILE_SUFFIX):
+                continue
+            partial_file_path = os.path.join(output_file_folder, file_name)
+            output_file_path = partial_file_path[:-len(PARTIAL_FILE_SUFFIX)]
+            if output_file_path.endswith(runfile.RUN_FILE_EXTENSION):
+                if recover_partial_run_file(partial_file_path, output_file_path):
+                    recovered_file_paths.append(output_file_path)
+                continue
+            with open(partial_file_path, 'rb+') as partial_csv:
+                content = partial_csv.read()
+                partial_csv.truncate(content.rfind(OUTPUT_DATA_LINE_TERMINATOR.encode()) +
+                                     len(OUTPUT_DATA_LINE_TERMINATOR))
+            os.replace(partial_file_path, output_file_path)
+            recovered_file_paths.append(output_file_path)
+
+    if os.path.exists(store.get_default_store_path()):
+        store.get_default_store().mark_interrupted_runs(
+            lambda run_file_path: is_file_locked(run_file_path + PARTIAL_FILE_SUFFIX))
+    return recovered_file_paths
+
+
+def run_test_streaming(pstat, test_name, test_folder_name, context, on_samples=None, monitor=None):
+    """
+        Runs the test, saves its samples and passes them to on_samples. Every chunk is also added to the monitor,
+        e.g. chronoamperometry.ChronoamperometryMonitor, the test is stopped and DepositionAbortedError is raised
+        when the monitor finds a fatal anomaly, unless context 'abort_on_anomaly' is false.
+    """
+    import zntest.chronoamperometry as chronoamperometry
+
+    # phases are timed with instrumentation spans, which do nothing unless instrumentation is turned on
+    with instrumentation.span('configure'):
+        pstat.set_curr_range(context['current_range'])
+        pstat.set_sample_rate(context['sample_rate'])
 
     start_time = datetime.now()
-    print('[{}]\t{} is starting'.format(start_time.strftime("%H:%M:%S"), context['title']))
-    t, volt, curr = pstat.run_test(test_name, param=context['param'], display=None)
+    with instrumentation.span('open_writer'):
+        writer = OutputDataWriter(test_folder_name, context, start_time) if context['save_data'] else None
+    samples_count = 0
+    samples = iter_test_samples(pstat, test_name, context['param'])
+    # acquisition is the time spent waiting for the samples of every chunk, the timed iterator is kept,
+    # so it doesn't stop the test when it is collected before the samples are closed below
+    timed_samples = instrumentation.iterate_timed(samples, 'acquisition')
+    # live samples and step events are published to the streaming server subscribers, if it is running
+    streaming.publish_event(streaming.EVENT_STEP_STARTED, context, started_at=start_time,
+                            run_id=writer.run_id if writer is not None else None)
+    try:
+        for t, volt, curr in timed_samples:
+            instrumentation.observe_samples(t)
+            if writer is not None:
+                writer.write(t, volt, curr)
+            streaming.publish_samples(context.get('device'), t, volt, curr)
+            if on_samples is not None:
+                with instrumentation.span('on_samples'):
+                    on_samples(t, volt, curr)
+            samples_count += len(t)
+            if monitor is not None:
+                with instrumentation.span('monitor'):
+                    anomaly = monitor.add(t, volt, curr)
+                if anomaly is not None and anomaly.kind in chronoamperometry.FATAL_ANOMALIES and \
+                        context.get('abort_on_anomaly', True):
+                    raise chronoamperometry.DepositionAbortedError(context['title'], anomaly)
+    except BaseException as e:
+        # the test is stopped, if it is still running, and the device may be left in the middle of the test,
+        # its settings are sent again before the next one
+        streaming.publish_event(streaming.EVENT_STEP_FAILED, context, samples_count=samples_count, error=repr(e))
+        # errors of the clean-up, e.g. of the device which doesn't answer anymore, are logged, so the original
+        # error is raised
+        try:
+            samples.close()
+        except Exception as cleanup_error:
+            print('[{}]\t{}: stopping the test failed: {!r}'.format(datetime.now().strftime("%H:%M:%S"),
+                                                                   context['title'], cleanup_error))
+        invalidate_device_state(pstat)
+        if writer is not None:
+            try:
+                writer.close(is_complete=False)
+            except Exception as cleanup_error:
+                print('[{}]\t{}: saving the partial run failed: {!r}'.format(datetime.now().strftime("%H:%M:%S"),
+                                                                            context['title'], cleanup_error))
+        raise
+
+    if writer is not None:
+        writer.close()
+    return TestResult(start_time, samples_count, writer.run_id if writer is not None else None)
+
+
+def run_constant_voltage_test(pstat, context, on_samples=None):
+    import zntest.chronoamperometry as chronoamperometry
+
+    test_name = 'constant'
+    print('[{}]\t{} is starting'.format(datetime.now().strftime("%H:%M:%S"), context['title']))
+    monitor = chronoamperometry.ChronoamperometryMonitor(context)
+    with instrumentation.trace_run(recipe.CONSTANT_VOLTAGE_TEST_KIND, context):
+        result = run_test_streaming(pstat, test_name, recipe.CONSTANT_VOLTAGE_TEST_KIND, context, on_samples, monitor)
     print('[{}]\t{} is finished'.format(datetime.now().strftime("%H:%M:%S"), context['title']))
 
-    if context['create_plot']:
-        plt.figure(1)
-        plt.plot(t, volt)
-        plt.xlabel('time (sec)')
-        plt.ylabel('potential (V)')
-        plt.grid('on')
-
-        plt.figure(2)
-        plt.plot(t, curr)
-        plt.xlabel('time (sec)')
-        plt.ylabel('current (uA)')
-        plt.grid('on')
-
-        plt.figure(3)
-        plt.plot(volt, curr)
-        plt.xlabel('potential (V)')
-        plt.ylabel('current (uA)')
-        plt.grid('on')
-
-        plt.show(block=False)
-
-    if context['save_data']:
-        output_file_name = '{}__{}.csv'.format(context['compound'], start_time.strftime('%Y-%m-%d__%H-%M-%S'))
-        output_file_folder = os.path.join(os.getcwd(), 'data', 'out', 'constant')
-        if os.path.exists(output_file_folder) is False:
-            os.makedirs(output_file_folder)
-
-        with open(os.path.join(output_file_folder, output_file_name), 'w', encoding='utf-8', newline='') as output_csv:
-            writer = csv.writer(output_csv, delimiter=',')
-            writer.writerow(['time', 'volt', 'current', 'compound'])
-            for i in range(len(t)):
-                single_time_value = f'{t[i]:.4f}'
-                single_potential_value = f'{volt[i]:.4f}'
-                single_current_value = f'{curr[i]:.4f}'
-                row = [single_time_value, single_potential_value, single_current_value, context['compound']]
-                writer.writerow(row)
-
-        database_file_path = os.path.join(os.getcwd(), 'data', 'out', 'constant', 'database.csv')
-        with open(os.path.join(database_file_path), 'a', encoding='utf-8', newline='') as output_csv:
-            writer = csv.writer(output_csv, delimiter=',')
-            writer.writerow(['time', 'volt', 'current', 'compound'])
-            for i in range(len(t)):
-                single_time_value = f'{t[i]:.4f}'
-                single_potential_value = f'{volt[i]:.4f}'
-                single_current_value = f'{curr[i]:.4f}'
-                row = [single_time_value, single_potential_value, single_current_value, context['compound']]
-                writer.writerow(row)
-            writer.writerow([])
-            writer.writerow([])
-
-
-def run_square_wave_voltammetry_test(pstat, context):
+    monitor_result = monitor.get_result()
+    print('[{}]\t{} charge: {:.4f} uC, Cottrell residual: {:.3f}{}'.format(
+        datetime.now().strftime("%H:%M:%S"), context['title'], monitor_result['charge'],
+        monitor_result['cottrell_residual'],
+        ', anomalies: ' + ', '.join(monitor_result['anomalies']) if monitor_result['anomalies'] else ''))
+    streaming.publish_event(streaming.EVENT_STEP_FINISHED, context, samples_count=result.samples_count,
+                            run_id=result.run_id, analysis=monitor_result)
+    return result._replace(analysis=monitor_result)
+
+
+def run_square_wave_voltammetry_test(pstat, context, on_samples=None):
     test_name = 'squareWave'
-    pstat.set_curr_range(context['current_range'])
-    pstat.set_sample_rate(context['sample_rate'])
+    print('[{}]\t{} is starting'.format(datetime.now().strftime("%H:%M:%S"), context['title']))
+    with instrumentation.trace_run(recipe.SQUARE_WAVE_VOLTAMMETRY_TEST_KIND, context):
+        result = run_test_streaming(pstat, test_name, recipe.SQUARE_WAVE_VOLTAMMETRY_TEST_KIND, context, on_samples)
+        print('[{}]\t{} finished'.format(datetime.now().strftime("%H:%M:%S"), context['title']))
 
-    start_time = datetime.now()
-    print('[{}]\t{} is starting'.format(start_time.strftime("%H:%M:%S"), context['title']))
-    t, volt, curr = pstat.run_test(test_name, param=context['param'], display=None)
-    print('[{}]\t{} finished'.format(datetime.now().strftime("%H:%M:%S"), context['title']))
-
-    if context['create_plot']:
-        plt.figure(1)
-        plt.plot(t, volt)
-        plt.xlabel('time (sec)')
-        plt.ylabel('potential (V)')
-        plt.grid('on')
-
-        plt.figure(2)
-        plt.plot(t, curr)
-        plt.xlabel('time (sec)')
-        plt.ylabel('current (uA)')
-        plt.grid('on')
-
-        plt.figure(3)
-        plt.plot(volt, curr)
-        plt.xlabel('potential (V)')
-        plt.ylabel('current (uA)')
-        plt.grid('on')
-
-        plt.show(block=False)
-
-    if context['save_data']:
-        output_file_name = '{}__{}.csv'.format(context['compound'], start_time.strftime('%Y-%m-%d__%H-%M-%S'))
-        output_file_folder = os.path.join(os.getcwd(), 'data', 'out', 'squarewave')
-        if os.path.exists(output_file_folder) is False:
-            os.makedirs(output_file_folder)
-
-        with open(os.path.join(output_file_folder, output_file_name), 'w', encoding='utf-8', newline='') as output_csv:
-            writer = csv.writer(output_csv, delimiter=',')
-            writer.writerow(['time', 'volt', 'current', 'compound'])
-            for i in range(len(t)):
-                single_time_value = f'{t[i]:.4f}'
-                single_potential_value = f'{volt[i]:.4f}'
-                single_current_value = f'{curr[i]:.4f}'
-                row = [single_time_value, single_potential_value, single_current_value, context['compound']]
-                writer.writerow(row)
+        if result.run_id is not None:
+            import zntest.analysis as analysis
+
+            # the samples are saved by now, so only acquisition errors fail the step, the run can be analyzed
+            # again later, e.g. with the analyze command
+            analysis_errors = {}
+            try:
+                with instrumentation.span('analysis'):
+                    analysis_result = analysis.analyze_stored_runs(store.get_default_store(), [result.run_id],
+                                                                   calibration=analysis.load_calibration(),
+                                                                   errors=analysis_errors)[0]
+            except Exception as e:
+                print('[{}]\t{} analysis failed: {!r}'.format(datetime.now().strftime("%H:%M:%S"), context['title'],
+                                                              e))
+            else:
+                if analysis_result is None:
+                    # e.g. the device sent fewer samples than the steps of the param make
+                    print('[{}]\t{} analysis is skipped: {}'.format(datetime.now().strftime("%H:%M:%S"),
+                                                                    context['title'], analysis_errors[result.run_id]))
+                else:
+                    print('[{}]\t{} peak: {:.4f} uA at {:.4f} V, concentration: {:.4f}'.format(
+                        datetime.now().strftime("%H:%M:%S"), context['title'], analysis_result['peak_height'],
+                        analysis_result['peak_potential'], analysis_result['concentration']))
+                    result = result._replace(analysis=analysis_result)
+    streaming.publish_event(streaming.EVENT_STEP_FINISHED, context, samples_count=result.samples_count,
+                            run_id=result.run_id, analysis=result.analysis)
+    return result
+
+
+RUN_TEST_FUNS = {
+    recipe.CONSTANT_VOLTAGE_TEST_KIND: run_constant_voltage_test,
+    recipe.SQUARE_WAVE_VOLTAMMETRY_TEST_KIND: run_square_wave_voltammetry_test,
+}
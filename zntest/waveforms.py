@@ -0,0 +1,72 @@
+import numpy as np
+
+import zntest.recipe as recipe
+from zntest.cache import get_default_cache
+
+
+def get_sample_period_ms(sample_rate):
+    # the potentiostat keeps the sample period in whole milliseconds
+    return int(1.0e3 / sample_rate)
+
+
+def get_square_wave_frequency(sample_rate):
+    # the Rodeostat squareWave test applies a square wave period per step and a step per sample period,
+    # so the frequency follows the sample period the device keeps
+    return 1.0e3 / get_sample_period_ms(sample_rate)
+
+
+def get_step_values(param):
+    direction = 1.0 if param['finalValue'] >= param['startValue'] else -1.0
+    steps_count = int(np.floor(abs(param['finalValue'] - param['startValue']) / param['stepValue'] + 1e-9)) + 1
+    return param['startValue'] + direction * param['stepValue'] * np.arange(steps_count)
+
+
+def compute_potential_grid(context):
+    """
+        Returns (t, volt) of the samples the potentiostat is expected to report for the test:
+        a sample per sample period at the quiet value and then at the test value or at every square wave step.
+    """
+    param = context['param']
+    period_sec = get_sample_period_ms(context['sample_rate']) / 1.0e3
+    quiet_count = int(param['quietTime'] / 1.0e3 / period_sec)
+    if context['kind'] == recipe.CONSTANT_VOLTAGE_TEST_KIND:
+        test_volt = np.full(int(param['duration'] / 1.0e3 / period_sec), param['value'])
+    else:
+        test_volt = get_step_values(param)
+    volt = np.concatenate((np.full(quiet_count, param['quietValue']), test_volt))
+    t = np.arange(len(volt)) * period_sec
+    return t, volt
+
+
+def compute_expected_waveform(context):
+    """
+        Returns (t, volt) of the potential applied to the cell. Square wave pulses are applied on top of
+        the staircase, every step has forward (+amplitude) and reverse (-amplitude) half periods.
+    """
+    t, volt = compute_potential_grid(context)
+    if context['kind'] == recipe.CONSTANT_VOLTAGE_TEST_KIND:
+        return t, volt
+
+    param = context['param']
+    quiet_count = len(volt) - len(get_step_values(param))
+    half_period_sec = 0.5 / get_square_wave_frequency(context['sample_rate'])
+    pulses = np.tile([param['amplitude'], -param['amplitude']], len(volt) - quiet_count)
+    waveform_t = np.concatenate((t[:quiet_count], t[quiet_count] + half_period_sec * np.arange(len(pulses))))
+    waveform_volt = np.concatenate((volt[:quiet_count], np.repeat(volt[quiet_count:], 2) + pulses))
+    return waveform_t, waveform_volt
+
+
+def compute_plot_bounds(context):
+    """
+        Returns (low, high) bounds of the t, volt and curr columns known before the test starts,
+        the current isn't known, so its bounds are None.
+    """
+    t, volt = compute_expected_waveform(context)
+    if len(t) == 0:
+        return None, None, None
+    period_sec = get_sample_period_ms(context['sample_rate']) / 1.0e3
+    return (0.0, float(t[-1]) + period_sec), (float(volt.min()), float(volt.max())), None
+
+
+def get_plot_bounds(context, cache=None):
+    return (cache or get_default_cache()).get('plot_bounds', context, lambda: compute_plot_bounds(context))
@@ -0,0 +1,149 @@
+import queue
+import threading
+from collections import namedtuple
+
+import zntest.streaming as streaming
+from zntest.devicestate import get_savings, get_savings_difference
+
+STEP_STARTED = 'step_started'
+STEP_SAMPLES = 'step_samples'
+STEP_FINISHED = 'step_finished'
+SEQUENCE_FINISHED = 'sequence_finished'
+SEQUENCE_CANCELLED = 'sequence_cancelled'
+SEQUENCE_FAILED = 'sequence_failed'
+
+WorkerEvent = namedtuple('WorkerEvent', ['device', 'kind', 'step_index', 'steps_count', 'context', 'payload'])
+
+
+class AcquisitionWorker:
+    """
+        Class running test sequence on a background thread.
+        While the sequence is running the worker is the only owner of the potentiostat object,
+        every result is posted back to the GUI through the events queue.
+    """
+
+    def __init__(self, pstat, device=None):
+        self.pstat = pstat
+        self.device = device
+        self.events = queue.Queue()
+        self.cancel_requested = threading.Event()
+        self.thread = None
+
+    def is_running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self, steps):
+        """
+            Starts the sequence. Every step is a (run_test_fun, context) pair,
+            run_test_fun is called as run_test_fun(pstat, context, on_samples).
+        """
+        if self.is_running():
+            raise RuntimeError('Test sequence is already running')
+        self.cancel_requested.clear()
+        self.thread = threading.Thread(target=self.run_sequence, args=(list(steps),), daemon=True)
+        self.thread.start()
+
+    def start_queue(self, job_queue):
+        """
+            Runs jobs taken from the job queue back to back until the queue is empty.
+        """
+        if self.is_running():
+            raise RuntimeError('Test sequence is already running')
+        self.cancel_requested.clear()
+        self.thread = threading.Thread(target=self.run_queue, args=(job_queue,), daemon=True)
+        self.thread.start()
+
+    def cancel(self):
+        # the potentiostat can't be interrupted safely in the middle of a test, so cancellation takes effect
+        # before the next step
+        self.cancel_requested.set()
+
+    def post(self, kind, step_index, steps_count, context=None, payload=None):
+        self.events.put(WorkerEvent(self.device, kind, step_index, steps_count, context, payload))
+        # step events are published by utils.run_test_streaming, sequence events only the worker knows of
+        if kind in (SEQUENCE_FINISHED, SEQUENCE_CANCELLED, SEQUENCE_FAILED):
+            streaming.publish_event(kind, context, device=self.device, step_index=step_index,
+                                    steps_count=steps_count,
+                                    error=repr(payload) if kind == SEQUENCE_FAILED else None)
+
+    def run_sequence(self, steps):
+        steps_count = len(steps)
+        initial_savings = get_savings(self.pstat)
+        for step_index, (run_test_fun, context) in enumerate(steps):
+            if self.cancel_requested.is_set():
+                self.post(SEQUENCE_CANCELLED, step_index, steps_count)
+                return
+
+            self.post(STEP_STARTED, step_index, steps_count, context)
+            on_samples = self.create_samples_poster(step_index, steps_count, context)
+            try:
+                result = run_test_fun(self.pstat, context, on_samples)
+            except Exception as e:
+                self.post(SEQUENCE_FAILED, step_index, steps_count, context, e)
+                return
+            self.post(STEP_FINISHED, step_index, steps_count, context, result)
+
+        # the payload is ShadowSavings of the settings which weren't sent again during the sequence
+        self.post(SEQUENCE_FINISHED, steps_count, steps_count,
+                  payload=get_savings_difference(get_savings(self.pstat), initial_savings))
+
+    def run_queue(self, job_queue):
+        from zntest.jobs import run_job
+
+        initial_savings = get_savings(self.pstat)
+        while not self.cancel_requested.is_set():
+            try:
+                job = job_queue.claim_next_job(self.device)
+            except Exception as e:
+                # the queue can't be read, e.g. its database stays locked, the failure is posted without a step
+                self.post(SEQUENCE_FAILED, 0, 0, None, e)
+                return
+            if job is None:
+                self.post(SEQUENCE_FINISHED, 0, 0, payload=get_savings_difference(get_savings(self.pstat),
+                                                                                   initial_savings))
+                return
+            steps_count = len(job.steps)
+            running_contexts = [job.steps[0].context]
+
+            def on_step_started(job, step, context):
+                running_contexts.append(context)
+                self.post(STEP_STARTED, step.step_index, steps_count, context)
+
+            def on_step_finished(job, step, context, result):
+                self.post(STEP_FINISHED, step.step_index, steps_count, context, result)
+
+            def create_on_samples(job, step, context):
+                return self.create_samples_poster(step.step_index, steps_count, context)
+
+            try:
+                is_finished = run_job(job_queue, job, self.pstat, self.device, on_step_started, on_step_finished,
+                                      create_on_samples, self.cancel_requested.is_set)
+            except Exception as e:
+                # the failed job is kept in the queue with its error, the remaining jobs wait until the device
+                # is checked
+                self.post(SEQUENCE_FAILED, 0, steps_count, running_contexts[-1], e)
+                return
+            if not is_finished:
+                break
+        self.post(SEQUENCE_CANCELLED, 0, 0)
+
+    def create_samples_poster(self, step_index, steps_count, context):
+        import numpy as np
+        from zntest.measurement import MeasurementRun, create_run_metadata
+
+        metadata = create_run_metadata(context['compound'], context['kind'], context['param'], None, context['title'])
+
+        def post_samples(t, volt, curr):
+            # acquisition reuses its chunk buffer, so the GUI gets its own copy in one (3, chunk size) array
+            self.post(STEP_SAMPLES, step_index, steps_count, context, MeasurementRun(np.stack((t, volt, curr)),
+                                                                                     metadata))
+
+        return post_samples
+
+    def get_events(self):
+        events = []
+        while True:
+            try:
+                events.append(self.events.get_nowait())
+            except queue.Empty:
+                return events